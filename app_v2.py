@@ -1,17 +1,20 @@
 # app_v2.py
-from flask import Flask, redirect, url_for
-from jinja2 import DictLoader
+import os
+import time
+from flask import Flask, g, redirect, url_for
+from jinja2 import DictLoader, FileSystemBytecodeCache
 from datetime import timedelta
 from flask_login import current_user
 
-from constants import APP_SECRET, APP_VERSION, DATABASE_URL
-from templates import BASE_TMPL, LOGIN_TMPL, TODAY_TMPL, HISTORY_TMPL, STATS_TMPL
-from db import get_db, close_db
+from constants import APP_SECRET, APP_VERSION, DATABASE_URL, JINJA_CACHE_DIR, SQL_TRACE
+from templates import TEMPLATES
+from db import get_db, close_db, migrate_db, server_timing
 from auth import authbp, login_manager  # login_manager is defined in auth.py
 from routes_today import todaybp
 from routes_history import historybp
 from routes_admin import adminbp
 from routes_account import accountbp
+import metrics
 
 
 def create_app():
@@ -32,24 +35,43 @@ def create_app():
         REMEMBER_COOKIE_DURATION=timedelta(days=30),
     )
 
+    # Schema migrations run once here, before any request borrows a connection
+    with app.app_context():
+        migrate_db()
+
     # Initialize Flask-Login
     login_manager.init_app(app)
     login_manager.login_view = "authbp.login"
 
-    # In-memory templates
-    app.jinja_loader = DictLoader({
-        "BASE_TMPL": BASE_TMPL,
-        "LOGIN_TMPL": LOGIN_TMPL,
-        "TODAY_TMPL": TODAY_TMPL,
-        "HISTORY_TMPL": HISTORY_TMPL,
-        "STATS_TMPL": STATS_TMPL,
-    })
+    # In-memory templates, compiled once per process (views render them by name).
+    # Flask only autoescapes *.html-style names; these have no extension, so
+    # turn it on for all of them, as render_template_string did.
+    app.jinja_loader = DictLoader(TEMPLATES)
+    app.jinja_env.autoescape = True
+    if JINJA_CACHE_DIR:
+        os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+        # Own file pattern: bytecode compiled without autoescape is never loaded
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR, "cespool-%s.cache")
+    for name in TEMPLATES:
+        app.jinja_env.get_template(name)
 
     # Optional bridge: keep legacy `{% if is_admin %}` checks working
     @app.context_processor
     def inject_flags():
         return {"is_admin": bool(getattr(current_user, "is_admin", False))}
 
+    # Request counts and latency for /metrics (also sets g.request_t0)
+    metrics.init_app(app)
+
+    # Opt-in SQL tracing: per-response Server-Timing (a streamed page reports
+    # the queries run before its first chunk; /admin/diag sees all of them)
+    if SQL_TRACE:
+        @app.after_request
+        def _server_timing(resp):
+            if "request_t0" in g:
+                resp.headers["Server-Timing"] = server_timing(time.perf_counter() - g.request_t0)
+            return resp
+
     # Register blueprints
     app.register_blueprint(accountbp)
     app.register_blueprint(authbp)
@@ -1,8 +1,11 @@
 # auth.py
-from flask import Blueprint, request, redirect, url_for, render_template_string, flash, session
+from flask import Blueprint, request, redirect, url_for, render_template, flash, session
+import threading
+import time
+from collections import OrderedDict
 from hashlib import sha256
-from templates import LOGIN_TMPL
-from db import get_db
+from constants import USER_CACHE_TTL, USER_CACHE_SIZE
+from db import get_db, db_path, users_version, DEFAULT_GROUP_ID
 
 # Flask-Login
 from flask_login import (
@@ -19,22 +22,70 @@ login_required = _fl_login_required  # re-export so existing imports keep workin
 
 # ---- User model & loader ----
 class User(UserMixin):
-    def __init__(self, id, username, is_admin=False):
+    def __init__(self, id, username, is_admin=False, group_id=DEFAULT_GROUP_ID):
         self.id = str(id)  # Flask-Login expects a str-ish id
         self.username = username
         # normalize 0/1 or "0"/"1" to a real boolean
         self.is_admin = (int(is_admin) == 1)
+        self.group_id = int(group_id)  # the carpool this user sees and edits
+
+
+def current_group_id() -> int:
+    """Group of the logged-in user; every entries/members query in a request is scoped to it."""
+    return getattr(current_user, "group_id", DEFAULT_GROUP_ID)
+
+# ---- User cache ----
+# load_user runs on every authenticated request; keep recent User objects
+# for USER_CACHE_TTL seconds (LRU-bounded). Each entry remembers
+# meta.users_version, which triggers bump on any users write from any
+# process (admin pages, manage.py set-user), so a cached login is only
+# trusted while that one-row stamp is unchanged.
+_user_cache = OrderedDict()  # (db path, user id) -> (expires, users_version, User)
+_user_cache_lock = threading.Lock()
+_user_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+
+def invalidate_user_cache():
+    """Drop every cached User now (writes to users also bump users_version)."""
+    with _user_cache_lock:
+        _user_cache.clear()
+        _user_cache_stats["invalidations"] += 1
+
+
+def user_cache_stats() -> dict:
+    with _user_cache_lock:
+        return {"size": len(_user_cache), "max": USER_CACHE_SIZE, "ttl": USER_CACHE_TTL,
+                **_user_cache_stats}
+
 
 @login_manager.user_loader
 def load_user(user_id: str):
+    key = (db_path(), str(user_id))
+    now = time.monotonic()
     db = get_db()
+    version = users_version(db)
+    with _user_cache_lock:
+        hit = _user_cache.get(key)
+        if hit and hit[0] > now and hit[1] == version:
+            _user_cache.move_to_end(key)
+            _user_cache_stats["hits"] += 1
+            return hit[2]
+        _user_cache_stats["misses"] += 1
+
     row = db.execute(
-        "SELECT id, username, is_admin FROM users WHERE id = ?",
+        "SELECT id, username, is_admin, group_id FROM users WHERE id = ?",
         (user_id,)
     ).fetchone()
     if not row:
         return None
-    return User(row["id"], row["username"], row["is_admin"])
+    user = User(row["id"], row["username"], row["is_admin"], row["group_id"])
+    with _user_cache_lock:
+        _user_cache[key] = (now + USER_CACHE_TTL, version, user)
+        _user_cache.move_to_end(key)
+        while len(_user_cache) > USER_CACHE_SIZE:
+            _user_cache.popitem(last=False)
+            _user_cache_stats["evictions"] += 1
+    return user
 
 
 # ---- Routes ----
@@ -47,16 +98,16 @@ def login():
 
         db = get_db()
         row = db.execute(
-            "SELECT id, username, password_hash, is_admin FROM users WHERE username=?",
+            "SELECT id, username, password_hash, is_admin, group_id FROM users WHERE username=?",
             (username,)
         ).fetchone()
 
         # Legacy SHA-256 check (matches your current DB contents)
         if row and row["password_hash"] == sha256(password.encode()).hexdigest():
-            user = User(row["id"], row["username"], row["is_admin"])
+            user = User(row["id"], row["username"], row["is_admin"], row["group_id"])
             login_user(user, remember=remember)
 
-            # Bridge for blueprints still using session (routes_admin.before_request)
+            # Legacy session keys; admin checks go through current_user
             session["user_id"] = int(user.id)
             session["username"] = user.username
             session["is_admin"] = 1 if user.is_admin else 0
@@ -65,7 +116,7 @@ def login():
 
         flash("Invalid credentials", "error")
 
-    return render_template_string(LOGIN_TMPL)
+    return render_template("LOGIN_TMPL")
 
 
 @authbp.route("/logout")
@@ -79,7 +130,6 @@ def logout():
 @authbp.route("/account", methods=["GET", "POST"])
 @login_required
 def account():
-    from templates import BASE_TMPL  # avoid circular with DictLoader in app factory
     if request.method == "POST":
         pw1 = request.form.get("pw1", "")
         pw2 = request.form.get("pw2", "")
@@ -92,18 +142,8 @@ def account():
                 (sha256(pw1.encode()).hexdigest(), current_user.id)
             )
             db.commit()
+            invalidate_user_cache()
             flash("Password updated.")
             return redirect(url_for("authbp.account"))
 
-    tmpl = """
-    {% extends 'BASE_TMPL' %}{% block content %}
-      <h3>Account</h3>
-      <form method='post' class='card'>
-        <label>New password<br><input type='password' name='pw1' required></label><br><br>
-        <label>Confirm password<br><input type='password' name='pw2' required></label><br><br>
-        <label><input type="checkbox" name="remember"> Keep me signed in on this device</label><br><br>
-        <button class="btn btn-primary">Change password</button>
-      </form>
-    {% endblock %}
-    """
-    return render_template_string(tmpl, BASE_TMPL=BASE_TMPL)
+    return render_template("PASSWORD_TMPL")
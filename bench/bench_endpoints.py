@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Latency, queries and memory per endpoint on a seeded synthetic dataset.
+
+  python bench/bench_endpoints.py --years 5 --members 3 --out before.json
+  python bench/bench_endpoints.py --years 5 --members 3 --out after.json --compare before.json
+  python bench/bench_endpoints.py --db existing.db --repeat 200
+  python bench/bench_endpoints.py --years 5 --groups 10   # same group size, 10x the table
+
+Each URL is requested once to warm up, then --repeat times through the Flask
+test client: p50/p95/p99/mean latency (ms, full body read) and SQL
+queries per request (the same count /metrics exports). Peak memory is
+the tracemalloc peak over --mem-repeat further requests, timed separately
+because tracing slows everything down. The page cache is off unless
+--page-cache on, so repeats measure the view rather than a cache hit.
+
+Results go to --out as JSON (dataset, commit and environment in "meta");
+--compare prints the change against an earlier file.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import BASE_DIR, generate, login, make_app
+
+URLS = [
+    "/today",
+    "/history",
+    "/history?start=2024-01-01&end=2024-12-31",
+    "/admin/audit",
+    "/admin/audit?q=ca",
+    "/admin/diag",
+    "/account",
+]
+
+
+def _queries_so_far() -> int:
+    import metrics
+    return sum(v for name, _labels, v in metrics.snapshot()["counters"]
+               if name == "cespool_db_queries_total")
+
+
+def _get(client, url):
+    resp = client.get(url)
+    resp.get_data()
+    if resp.status_code != 200:
+        raise SystemExit(f"GET {url} -> {resp.status_code}")
+
+
+def _percentile(samples, pct):
+    if len(samples) < 2:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method="inclusive")[pct - 1]
+
+
+def bench_url(client, url, repeat, mem_repeat) -> dict:
+    _get(client, url)  # warm-up: pool, templates, timeline
+    times = []
+    q0 = _queries_so_far()
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        _get(client, url)
+        times.append((time.perf_counter() - t0) * 1000)
+    queries = (_queries_so_far() - q0) / repeat
+
+    peak = 0
+    for _ in range(mem_repeat):
+        tracemalloc.start()
+        _get(client, url)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {
+        "requests": repeat,
+        "p50_ms": round(_percentile(times, 50), 3),
+        "p95_ms": round(_percentile(times, 95), 3),
+        "p99_ms": round(_percentile(times, 99), 3),
+        "mean_ms": round(statistics.fmean(times), 3),
+        "queries": round(queries, 2),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _compare(results, old_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    print(f"\nvs {old_path} (commit {old['meta'].get('commit') or '?'})")
+    print(f"{'url':<44}{'p50':>20}{'p95':>20}{'queries':>16}")
+    for url, r in results.items():
+        o = old["endpoints"].get(url)
+        if not o:
+            print(f"{url:<44}{'(new)':>20}")
+            continue
+        cells = []
+        for k in ("p50_ms", "p95_ms"):
+            change = (r[k] - o[k]) / o[k] * 100 if o[k] else 0.0
+            cells.append(f"{o[k]:.2f}->{r[k]:.2f} {change:+.0f}%")
+        print(f"{url:<44}{cells[0]:>20}{cells[1]:>20}{o['queries']:>9.1f} -> {r['queries']:<5.1f}")
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--db", help="existing DB to run against (default: generate one)")
+    p.add_argument("--years", type=int, default=5)
+    p.add_argument("--members", type=int, default=3)
+    p.add_argument("--legacy", type=float, default=0.2,
+                   help="share of days stored in the old 'Jul 12, 2023, 12:00:00 AM' format")
+    p.add_argument("--seed", type=int, default=1234)
+    p.add_argument("--groups", type=int, default=1,
+                   help="carpools of this size in the DB (requests are made as the default group)")
+    p.add_argument("--repeat", type=int, default=100)
+    p.add_argument("--mem-repeat", type=int, default=3)
+    p.add_argument("--page-cache", choices=("on", "off"), default="off")
+    p.add_argument("--url", action="append", help="URL to request (repeatable; default: the main views)")
+    p.add_argument("--out", help="write results as JSON here")
+    p.add_argument("--compare", help="earlier --out file to diff against")
+    args = p.parse_args()
+
+    db_path = args.db
+    if not db_path:
+        db_path = os.path.join(tempfile.mkdtemp(prefix="cespool-bench-"), "data.db")
+        t0 = time.perf_counter()
+        n = generate(db_path, args.years, args.members, args.seed, legacy=args.legacy,
+                     groups=args.groups)
+        print(f"generated {n} entries ({args.groups} x {args.years}y x {args.members} members, "
+              f"{args.legacy:.0%} legacy days) in {time.perf_counter() - t0:.1f}s -> {db_path}")
+
+    app = make_app(db_path)
+    if args.page_cache == "off":
+        from rendering import page_cache
+        page_cache.max_bytes = 0  # put() refuses every page
+    client = login(app)
+    with client.session_transaction() as sess:
+        sess["member_key"] = "CA"  # /account shows a member's stats, not the picker
+    with app.app_context():
+        from db import get_db
+        n_entries = get_db().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    results = {}
+    print(f"{'url':<44}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'peak KiB':>10}")
+    for url in args.url or URLS:
+        r = results[url] = bench_url(client, url, args.repeat, args.mem_repeat)
+        print(f"{url:<44}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}"
+              f"{r['queries']:>9.1f}{r['peak_kb']:>10.1f}")
+
+    meta = {
+        "commit": _git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "db": db_path if args.db else None,
+        "years": None if args.db else args.years,
+        "members": None if args.db else args.members,
+        "legacy": None if args.db else args.legacy,
+        "seed": None if args.db else args.seed,
+        "groups": None if args.db else args.groups,
+        "entries": n_entries,
+        "repeat": args.repeat,
+        "page_cache": args.page_cache,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"meta": meta, "endpoints": results}, f, indent=2)
+        print(f"wrote {args.out}")
+    if args.compare:
+        _compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Export throughput on a synthetic multi-year dataset.
+
+  python bench/bench_export.py --years 10 --members 3
+  python bench/bench_export.py --db existing.db      # skip generation
+
+Reports rows/s and MB/s for the CSV and NDJSON encoders run directly
+(what `manage.py export` does) and through /export/entries.<fmt>.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import generate, login, make_app
+
+
+def _measure(make_chunks):
+    """(bytes, seconds) for one timed pass, then peak traced memory from a second pass."""
+    t0 = time.perf_counter()
+    nbytes = sum(len(c) for c in make_chunks())
+    secs = time.perf_counter() - t0
+    tracemalloc.start()
+    for _chunk in make_chunks():
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return nbytes, secs, peak
+
+
+def _http_chunks(client, url):
+    resp = client.get(url, buffered=False)
+    try:
+        yield from resp.response
+    finally:
+        resp.close()
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--db", help="existing DB to export from (default: generate one)")
+    p.add_argument("--years", type=int, default=10)
+    p.add_argument("--members", type=int, default=3)
+    p.add_argument("--seed", type=int, default=1234)
+    args = p.parse_args()
+
+    db_path = args.db
+    if not db_path:
+        db_path = os.path.join(tempfile.mkdtemp(prefix="cespool-bench-"), "data.db")
+        t0 = time.perf_counter()
+        n = generate(db_path, args.years, args.members, args.seed)
+        print(f"generated {n} entries ({args.years}y x {args.members} members) "
+              f"in {time.perf_counter() - t0:.1f}s -> {db_path}")
+
+    app = make_app(db_path)
+    client = login(app)
+    from db import get_db, DEFAULT_GROUP_ID
+    from routes_history import EXPORT_FORMATS, export_query
+    with app.app_context():
+        rows = get_db().execute(
+            "SELECT COUNT(*) FROM entries WHERE group_id=?", (DEFAULT_GROUP_ID,)
+        ).fetchone()[0]
+
+    print(f"{'path':<28}{'rows/s':>12}{'MB/s':>9}{'peak MB':>10}")
+    for fmt, (encode, _mimetype) in EXPORT_FORMATS.items():
+        with app.app_context():
+            sql, params = export_query(DEFAULT_GROUP_ID)
+            db = get_db()
+            nbytes, secs, peak = _measure(lambda: encode(db.execute(sql, params)))
+        print(f"{'encoder ' + fmt:<28}{rows / secs:>12,.0f}{nbytes / secs / 1e6:>9.1f}{peak / 1e6:>10.2f}")
+
+        url = f"/export/entries.{fmt}"
+        nbytes, secs, peak = _measure(lambda: _http_chunks(client, url))
+        print(f"{'GET ' + url:<28}{rows / secs:>12,.0f}{nbytes / secs / 1e6:>9.1f}{peak / 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
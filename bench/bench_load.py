@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Concurrent mixed read/write load against real HTTP servers, for tuning WAL,
+busy_timeout and pool settings (the Monday-morning /today save rush).
+
+  python bench/bench_load.py --years 3 --workers 4 --clients 32 --duration 20
+  python bench/bench_load.py --mix view=40,save=40,history=20 --client-procs 4
+  python bench/bench_load.py --db existing.db --server thread
+  python bench/bench_load.py --target http://127.0.0.1:5002 --password secret
+
+--server process (default) starts --workers server processes on the same DB
+file, each a threaded werkzeug server on its own port, and spreads requests
+over them round-robin like a load balancer would. --server thread runs one
+server inside this process instead (client and server then share the GIL).
+--target drives a server that is already running.
+
+Each client thread logs in with its own session and loops over the mix:
+  view     GET /today
+  save     POST /today for one of the last 7 days with new random roles
+  history  GET /history
+Reports throughput, latency percentiles and errors per kind, plus the
+server's lock waits, busy retries and 'database is locked' errors from
+/metrics (summed over all workers through a shared CESPOOL_METRICS_DIR).
+"""
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import generate, member_keys
+
+DEFAULT_MIX = "view=50,save=30,history=20"
+BUSY_METRICS = (
+    "cespool_db_busy_retries_total",
+    "cespool_db_busy_errors_total",
+    "cespool_db_lock_wait_seconds_sum",
+    "cespool_db_lock_wait_seconds_count",
+)
+
+
+# ---- HTTP client ------------------------------------------------------------------
+class Client:
+    """One logged-in browser: its own cookie jar, a fresh connection per request."""
+
+    def __init__(self, bases, username, password, timeout):
+        self.bases = bases
+        self.timeout = timeout
+        self.cookies = {}
+        self._next = random.randrange(len(bases))
+        status, _ = self.request("POST", "/login", {"username": username, "password": password})
+        if status != 302:
+            raise RuntimeError(f"login as {username!r} failed ({status})")
+
+    def request(self, method, path, form=None):
+        host, port = self.bases[self._next % len(self.bases)]
+        self._next += 1
+        conn = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        headers = {}
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            for header in resp.headers.get_all("Set-Cookie") or []:
+                for name, morsel in SimpleCookie(header).items():
+                    self.cookies[name] = morsel.value
+            return resp.status, resp
+        finally:
+            conn.close()
+
+
+def _save_form(keys, rng):
+    day = date.today() - timedelta(days=rng.randrange(7))
+    active = [k for k in keys if rng.random() >= 0.15]
+    driver = rng.choice(active) if len(active) >= 2 else None
+    form = {"day": day.isoformat()}
+    for k in keys:
+        form[k] = "O" if k not in active else ("D" if k == driver else "R")
+    return form
+
+
+REQUESTS = {
+    "view": lambda keys, rng: ("GET", "/today", None),
+    "save": lambda keys, rng: ("POST", "/today", _save_form(keys, rng)),
+    "history": lambda keys, rng: ("GET", "/history", None),
+}
+OK_STATUS = {"view": (200, 304), "save": (302,), "history": (200, 304)}
+
+
+def _client_thread(bases, args, keys, mix, seed, stop_at, out):
+    rng = random.Random(seed)
+    try:
+        client = Client(bases, args.username, args.password, args.timeout)
+    except (OSError, RuntimeError) as e:
+        out.append(("login", 0, 0.0, repr(e)))
+        return
+    kinds, weights = zip(*mix.items())
+    while time.monotonic() < stop_at:
+        kind = rng.choices(kinds, weights)[0]
+        method, path, form = REQUESTS[kind](keys, rng)
+        t0 = time.perf_counter()
+        try:
+            status, _ = client.request(method, path, form)
+            err = None if status in OK_STATUS[kind] else f"HTTP {status}"
+        except OSError as e:
+            status, err = 0, type(e).__name__
+        out.append((kind, status, time.perf_counter() - t0, err))
+
+
+def run_clients(bases, args, keys, mix, n_threads, seed, stop_at):
+    """n_threads client threads until stop_at; [(kind, status, seconds, error)]."""
+    out = []
+    threads = [threading.Thread(target=_client_thread,
+                                args=(bases, args, keys, mix, seed + i, stop_at, out))
+               for i in range(n_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return out
+
+
+def _client_proc(payload):
+    return run_clients(*payload)
+
+
+# ---- Servers ----------------------------------------------------------------------
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(host, port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=2)
+            conn.request("GET", "/login")
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit(f"server on port {port} did not come up")
+
+
+def serve(port):
+    """--serve: one threaded werkzeug server (a single worker process)."""
+    from werkzeug.serving import make_server
+    from common import make_app
+    make_server("127.0.0.1", port, make_app(os.environ["CESPOOL_DB"]), threaded=True).serve_forever()
+
+
+def start_servers(args, db_path, metrics_dir):
+    env = dict(os.environ, CESPOOL_DB=db_path, CESPOOL_METRICS_DIR=metrics_dir)
+    if args.server == "thread":
+        os.environ.update(env)
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)  # no per-request access log
+        from werkzeug.serving import make_server
+        from common import make_app
+        port = _free_port()
+        server = make_server("127.0.0.1", port, make_app(db_path), threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        _wait_ready("127.0.0.1", port)
+        return [("127.0.0.1", port)], lambda: server.shutdown()
+
+    procs, bases = [], []
+    for _ in range(args.workers):
+        port = _free_port()
+        procs.append(subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--serve", str(port)],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        ))
+        bases.append(("127.0.0.1", port))
+    for host, port in bases:
+        _wait_ready(host, port)
+
+    def stop():
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait()
+    return bases, stop
+
+
+def scrape_busy(bases, args) -> dict:
+    """The busy/lock-wait figures from /metrics ({} if it is not reachable)."""
+    host, port = bases[0]
+    try:
+        conn = http.client.HTTPConnection(host, port, timeout=args.timeout)
+        headers = {"Authorization": f"Bearer {args.metrics_token}"} if args.metrics_token else {}
+        conn.request("GET", "/metrics", headers=headers)
+        resp = conn.getresponse()
+        text = resp.read().decode()
+        conn.close()
+    except OSError:
+        return {}
+    if resp.status != 200:
+        return {}
+    vals = dict.fromkeys(BUSY_METRICS, 0.0)
+    for line in text.splitlines():
+        name, _, value = line.partition(" ")
+        if name in vals:
+            vals[name] += float(value)
+    return vals
+
+
+# ---- Report -------------------------------------------------------------------------
+def _pct(samples, pct):
+    if len(samples) < 2:
+        return samples[0] if samples else 0.0
+    return statistics.quantiles(samples, n=100, method="inclusive")[pct - 1]
+
+
+def summarize(samples, elapsed) -> dict:
+    report = {}
+    for kind in sorted({s[0] for s in samples}):
+        rows = [s for s in samples if s[0] == kind]
+        ms = [s[2] * 1000 for s in rows]
+        errors = {}
+        for s in rows:
+            if s[3]:
+                errors[s[3]] = errors.get(s[3], 0) + 1
+        report[kind] = {
+            "requests": len(rows), "rps": round(len(rows) / elapsed, 1),
+            "p50_ms": round(_pct(ms, 50), 2), "p95_ms": round(_pct(ms, 95), 2),
+            "p99_ms": round(_pct(ms, 99), 2), "max_ms": round(max(ms, default=0.0), 2),
+            "errors": errors,
+        }
+    return report
+
+
+def parse_mix(text) -> dict:
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind.strip() not in REQUESTS:
+            raise SystemExit(f"unknown request kind {kind!r} (have: {', '.join(REQUESTS)})")
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    p.add_argument("--db", help="existing DB to serve (default: generate one)")
+    p.add_argument("--years", type=int, default=3)
+    p.add_argument("--members", type=int, default=3)
+    p.add_argument("--seed", type=int, default=1234)
+    p.add_argument("--server", choices=("process", "thread"), default="process")
+    p.add_argument("--workers", type=int, default=2, help="server processes (--server process)")
+    p.add_argument("--target", help="base URL of a running server instead of starting one")
+    p.add_argument("--clients", type=int, default=16, help="client threads in total")
+    p.add_argument("--client-procs", type=int, default=1, help="processes the client threads are split over")
+    p.add_argument("--duration", type=float, default=15.0, help="seconds of load")
+    p.add_argument("--mix", default=DEFAULT_MIX, help=f"weights per request kind (default {DEFAULT_MIX})")
+    p.add_argument("--username", default="admin")
+    p.add_argument("--password", default="change-me")
+    p.add_argument("--metrics-token", default=os.environ.get("CESPOOL_METRICS_TOKEN", ""))
+    p.add_argument("--timeout", type=float, default=30.0, help="client socket timeout (s)")
+    p.add_argument("--out", help="write the report as JSON here")
+    args = p.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+
+    mix = parse_mix(args.mix)
+    stop = lambda: None
+    if args.target:
+        u = urlsplit(args.target)
+        bases = [(u.hostname, u.port or 80)]
+        keys = member_keys(args.members)
+    else:
+        db_path = args.db
+        if not db_path:
+            db_path = os.path.join(tempfile.mkdtemp(prefix="cespool-load-"), "data.db")
+            n = generate(db_path, args.years, args.members, args.seed)
+            print(f"generated {n} entries -> {db_path}")
+        import sqlite3
+        conn = sqlite3.connect(db_path)
+        keys = [r[0] for r in conn.execute(
+            "SELECT key FROM members WHERE group_id=1 AND active=1 ORDER BY key")]
+        conn.close()
+        bases, stop = start_servers(args, db_path, tempfile.mkdtemp(prefix="cespool-metrics-"))
+        print(f"{len(bases)} server(s) on ports {', '.join(str(b[1]) for b in bases)} ({args.server})")
+
+    try:
+        before = scrape_busy(bases, args)
+        procs = max(1, min(args.client_procs, args.clients))
+        per_proc = [args.clients // procs + (i < args.clients % procs) for i in range(procs)]
+        t0 = time.monotonic()
+        stop_at = t0 + args.duration
+        payloads = [(bases, args, keys, mix, n, args.seed + 1000 * i, stop_at)
+                    for i, n in enumerate(per_proc)]
+        if procs == 1:
+            samples = run_clients(*payloads[0])
+        else:
+            with multiprocessing.get_context("fork").Pool(procs) as pool:
+                samples = [s for chunk in pool.map(_client_proc, payloads) for s in chunk]
+        elapsed = time.monotonic() - t0
+        after = scrape_busy(bases, args)
+    finally:
+        stop()
+
+    report = summarize([s for s in samples if s[0] != "login"], elapsed)
+    login_errors = [s[3] for s in samples if s[0] == "login"]
+    total = sum(r["requests"] for r in report.values())
+    print(f"\n{args.clients} clients x {elapsed:.1f}s, mix {args.mix}: "
+          f"{total} requests, {total / elapsed:.1f} req/s")
+    print(f"{'kind':<10}{'reqs':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>10}  errors")
+    for kind, r in report.items():
+        errs = ", ".join(f"{k} x{v}" for k, v in r["errors"].items()) or "-"
+        print(f"{kind:<10}{r['requests']:>8}{r['rps']:>9.1f}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}"
+              f"{r['p99_ms']:>9.1f}{r['max_ms']:>10.1f}  {errs}")
+    if login_errors:
+        print(f"login failures: {len(login_errors)} ({login_errors[0]})")
+
+    busy = {}
+    if before and after:
+        busy = {k: after[k] - before[k] for k in BUSY_METRICS}
+        waits = busy["cespool_db_lock_wait_seconds_count"]
+        avg = busy["cespool_db_lock_wait_seconds_sum"] / waits * 1000 if waits else 0.0
+        print(f"server: {waits:.0f} write transactions, avg lock wait {avg:.1f} ms, "
+              f"{busy['cespool_db_busy_retries_total']:.0f} SQLITE_BUSY retries, "
+              f"{busy['cespool_db_busy_errors_total']:.0f} 'database is locked' errors")
+    else:
+        print("server: /metrics not reachable, no busy figures")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"meta": {"clients": args.clients, "client_procs": args.client_procs,
+                                "server": "target" if args.target else args.server,
+                                "workers": len(bases), "duration": round(elapsed, 2),
+                                "mix": mix, "throughput_rps": round(total / elapsed, 1)},
+                       "kinds": report, "server": busy}, f, indent=2)
+        print(f"wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Template render time per view.
+
+  python bench/bench_render.py --years 5
+  python bench/bench_render.py --db existing.db --repeat 200
+  CESPOOL_JINJA_CACHE=/tmp/jinja python bench/bench_render.py   # with bytecode cache
+
+  # the same measurement against an older tree, e.g. before the DictLoader change
+  mkdir /tmp/before && git archive <commit> | tar -x -C /tmp/before
+  CESPOOL_APP_DIR=/tmp/before python bench/bench_render.py --years 5
+
+Template time is the time spent getting the template object (lookup,
+compile for render_template_string) plus the time between Flask's
+before_render_template and template_rendered signals; the view's queries
+are not included. "cold" is the first request of each view in a freshly
+created app, "warm" the median of --repeat further requests and "request"
+the warm median end to end. The page cache is off by default so warm
+requests render rather than replay a stored page (--page-cache on to
+compare). The create_app() time (a new worker's startup, schema already
+current) shows what precompiling the templates costs with and without the
+bytecode cache.
+
+The dataset comes from generate_plain(), which only writes columns every
+schema version has, so the same --years/--members/--seed give the same
+rows for any CESPOOL_APP_DIR.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import APP_DIR, generate_plain, login, make_app
+
+VIEWS = [
+    "/today",
+    "/history",
+    "/stats/CA",
+    "/account",
+    "/admin/users",
+    "/admin/audit",
+    "/admin/diag",
+]
+
+
+class RenderTimer:
+    """Sums template lookup/compile and render time for everything a request renders."""
+
+    def __init__(self, app):
+        from flask import before_render_template, template_rendered
+        self.total = 0.0
+        self._t0 = None
+        env = app.jinja_env
+        for name in ("from_string", "get_or_select_template"):
+            setattr(env, name, self._timed(getattr(env, name)))
+        before_render_template.connect(self._start, app)
+        template_rendered.connect(self._stop, app)
+
+    def _timed(self, fn):
+        def _wrap(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.total += time.perf_counter() - t0
+        return _wrap
+
+    def _start(self, _app, **_kw):
+        self._t0 = time.perf_counter()
+
+    def _stop(self, _app, **_kw):
+        if self._t0 is not None:
+            self.total += time.perf_counter() - self._t0
+            self._t0 = None
+
+    def request(self, client, url):
+        """(render seconds, request seconds) for one GET."""
+        self.total = 0.0
+        t0 = time.perf_counter()
+        resp = client.get(url)
+        elapsed = time.perf_counter() - t0
+        if resp.status_code != 200:
+            raise SystemExit(f"GET {url} -> {resp.status_code}")
+        return self.total, elapsed
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--db", help="existing DB to render from (default: generate one)")
+    p.add_argument("--years", type=int, default=2)
+    p.add_argument("--members", type=int, default=3)
+    p.add_argument("--seed", type=int, default=1234)
+    p.add_argument("--repeat", type=int, default=100)
+    p.add_argument("--page-cache", choices=("on", "off"), default="off")
+    args = p.parse_args()
+
+    print(f"app: {APP_DIR}")
+    db_path = args.db
+    if not db_path:
+        db_path = os.path.join(tempfile.mkdtemp(prefix="cespool-bench-"), "data.db")
+        n = generate_plain(db_path, args.years, args.members, args.seed)
+        print(f"generated {n} entries -> {db_path}")
+
+    make_app(db_path)  # migrate first so the timing below is startup work only
+    t0 = time.perf_counter()
+    app = make_app(db_path)
+    print(f"create_app(): {(time.perf_counter() - t0) * 1000:.1f} ms "
+          f"(bytecode cache: {os.environ.get('CESPOOL_JINJA_CACHE') or 'off'})")
+    if args.page_cache == "off":
+        try:
+            from rendering import page_cache
+        except ImportError:
+            pass  # tree from before the page cache
+        else:
+            page_cache.max_bytes = 0  # put() refuses every page
+    timer = RenderTimer(app)
+    client = login(app)
+
+    print(f"{'view':<20}{'cold ms':>10}{'warm ms':>10}{'request ms':>12}")
+    for url in VIEWS:
+        cold, _ = timer.request(client, url)
+        warm, total = [], []
+        for _ in range(args.repeat):
+            r, t = timer.request(client, url)
+            warm.append(r)
+            total.append(t)
+        print(f"{url:<20}{cold * 1000:>10.2f}{statistics.median(warm) * 1000:>10.3f}"
+              f"{statistics.median(total) * 1000:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
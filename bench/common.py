@@ -0,0 +1,155 @@
+# bench/common.py
+"""
+Shared pieces for the bench/ scripts: a seeded synthetic dataset and a
+logged-in Flask test client.
+
+CESPOOL_APP_DIR=<dir> imports the app from another checkout (e.g. an
+older commit unpacked with git archive) instead of this one; only
+generate_plain() works against trees from before the versioned schema.
+"""
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.abspath(os.environ.get("CESPOOL_APP_DIR") or BASE_DIR)
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+from constants import MEMBERS, MEMBER_ORDER
+
+DEFAULT_END = date(2025, 6, 27)  # fixed so a given seed always yields the same rows
+
+
+def member_keys(n: int):
+    """The real members first, then synthetic M04, M05, ..."""
+    keys = list(MEMBER_ORDER)[:n]
+    keys += [f"M{i:02d}" for i in range(len(keys) + 1, n + 1)]
+    return keys
+
+
+def make_app(db_path: str):
+    """App bound to db_path (create_app() brings its schema up to date)."""
+    os.environ["CESPOOL_DB"] = db_path
+    from app_v2 import create_app
+    app = create_app()
+    app.testing = True
+    return app
+
+
+def legacy_day(d: date) -> str:
+    """A day the way the old import stored it: 'Jul 12, 2023, 12:00:00 AM'."""
+    return f"{d.strftime('%b')} {d.day}, {d.year}, 12:00:00 AM"
+
+
+def generate(db_path: str, years: int = 5, members: int = 3, seed: int = 1234,
+             end: date = DEFAULT_END, legacy: float = 0.0, groups: int = 1) -> int:
+    """
+    Fill a fresh SQLite file with `years` of weekday entries for `members`
+    riders: each is Off ~15% of days, one active member drives. A `legacy`
+    share of the days keeps the old import's 'day' text (day_iso normalized,
+    as the v2 migration leaves it). groups > 1 adds carpools g2, g3, ... of
+    the same shape next to the default one (same member keys, own rows).
+    Returns the number of entries written.
+    """
+    if os.path.exists(db_path):
+        raise SystemExit(f"{db_path} already exists; generate into a fresh file")
+    rng = random.Random(seed)
+    keys = member_keys(members)
+
+    app = make_app(db_path)
+    with app.app_context():
+        from db import get_db, transaction, entries_bulk_load, DEFAULT_GROUP_ID
+        from credits import rebuild_ledger
+        db = get_db()
+        group_ids = [DEFAULT_GROUP_ID]
+        for i in range(2, groups + 1):
+            cur = db.execute("INSERT INTO groups(slug, name) VALUES (?,?)", (f"g{i}", f"Carpool {i}"))
+            group_ids.append(cur.lastrowid)
+
+        rows = []
+        for group_id in group_ids:
+            day = end - timedelta(days=365 * years)
+            while day <= end:
+                if day.weekday() < 5:
+                    active = [k for k in keys if rng.random() >= 0.15]
+                    driver = rng.choice(active) if len(active) >= 2 else None
+                    ts = f"{day.isoformat()} {rng.randrange(6, 10):02d}:{rng.randrange(60):02d}:00"
+                    day_text = legacy_day(day) if rng.random() < legacy else day.isoformat()
+                    for k in keys:
+                        role = "O" if k not in active else ("D" if k == driver else "R")
+                        rows.append((group_id, day_text, day.isoformat(), k, role,
+                                     rng.choice(keys).lower(), ts))
+                day += timedelta(days=1)
+
+        with transaction(db), entries_bulk_load(db):
+            db.executemany(
+                "INSERT OR IGNORE INTO members(group_id, key, name, active) VALUES (?,?,?,1)",
+                [(g, k, MEMBERS.get(k, k)) for g in group_ids for k in keys],
+            )
+            db.executemany(
+                "INSERT INTO entries(group_id, day, day_iso, member_key, role, update_user, "
+                "update_ts, update_date) VALUES (?,?,?,?,?,?,?,DATE(?7))",
+                rows,
+            )
+            for group_id in group_ids:
+                rebuild_ledger(db, group_id)
+    return len(rows)
+
+
+def generate_plain(db_path: str, years: int = 5, members: int = 3, seed: int = 1234,
+                   end: date = DEFAULT_END) -> int:
+    """
+    generate()'s default-group rows written through the columns every
+    schema version has (members key/name, entries day/member_key/role/
+    update_user/update_ts/update_date), leaving derived data to the tree's
+    own schema setup, triggers and lazy builds. Works against any APP_DIR.
+    """
+    if os.path.exists(db_path):
+        raise SystemExit(f"{db_path} already exists; generate into a fresh file")
+    rng = random.Random(seed)
+    keys = member_keys(members)
+
+    rows = []
+    day = end - timedelta(days=365 * years)
+    while day <= end:
+        if day.weekday() < 5:
+            active = [k for k in keys if rng.random() >= 0.15]
+            driver = rng.choice(active) if len(active) >= 2 else None
+            ts = f"{day.isoformat()} {rng.randrange(6, 10):02d}:{rng.randrange(60):02d}:00"
+            for k in keys:
+                role = "O" if k not in active else ("D" if k == driver else "R")
+                rows.append((day.isoformat(), k, role, rng.choice(keys).lower(), ts))
+        day += timedelta(days=1)
+
+    app = make_app(db_path)
+    with app.app_context():
+        from db import get_db
+        db = get_db()  # creates (or migrates) the tree's schema
+        cols = {r[1] for r in db.execute("PRAGMA table_info(entries)").fetchall()}
+        if "update_date" not in cols:
+            # The original audit page reads update_date but its schema never created it
+            db.execute("ALTER TABLE entries ADD COLUMN update_date TEXT")
+        db.execute("BEGIN")
+        db.executemany(
+            "INSERT OR IGNORE INTO members(key, name, active) VALUES (?,?,1)",
+            [(k, MEMBERS.get(k, k)) for k in keys],
+        )
+        db.executemany(
+            "INSERT INTO entries(day, member_key, role, update_user, update_ts, update_date) "
+            "VALUES (?,?,?,?,?,DATE(?5))",
+            rows,
+        )
+        db.commit()
+    return len(rows)
+
+
+def login(app, username="admin", password="change-me"):
+    """Test client with a session for the seeded admin user."""
+    client = app.test_client()
+    client.environ_base["wsgi.url_scheme"] = "https"  # session cookies are Secure
+    resp = client.post("/login", data={"username": username, "password": password})
+    if resp.status_code != 302:
+        raise SystemExit(f"login as {username!r} failed ({resp.status_code})")
+    return client
@@ -6,6 +6,23 @@ APP_VERSION = "RCOE-Carpool-v2-modular-2025-08-22"
 APP_SECRET = os.environ.get("APP_SECRET", "dev-secret-change-me")
 # Default DB is now data.db (can be overridden by env var)
 DATABASE_URL = os.environ.get("DATABASE_URL", os.path.abspath("data.db"))
+# Open SQLite connections kept per worker process; size to the WSGI thread count
+DB_POOL_SIZE = int(os.environ.get("CESPOOL_DB_POOL", "8"))
+DB_POOL_TIMEOUT = 10.0  # seconds a request waits for a free connection
+# Logged-in users are cached per process; other workers see user edits within the TTL
+USER_CACHE_TTL = float(os.environ.get("CESPOOL_USER_CACHE_TTL", "60"))
+USER_CACHE_SIZE = 256
+# Rendered read-only pages kept per process (LRU), keyed on URL, flags and data version
+PAGE_CACHE_BYTES = int(os.environ.get("CESPOOL_PAGE_CACHE_MB", "16")) * 1024 * 1024
+PAGE_CACHE_ENTRIES = 512
+# Optional dir for compiled Jinja templates, so new workers skip compiling them
+JINJA_CACHE_DIR = os.environ.get("CESPOOL_JINJA_CACHE", "")
+# Opt-in per-request SQL timing: Server-Timing header + slowest queries on /admin/diag
+SQL_TRACE = os.environ.get("CESPOOL_SQL_TRACE", "") not in ("", "0")
+# /metrics: shared dir where each worker publishes its counters (unset: per process)
+METRICS_DIR = os.environ.get("CESPOOL_METRICS_DIR", "")
+METRICS_FLUSH_SECS = 1.0
+METRICS_TOKEN = os.environ.get("CESPOOL_METRICS_TOKEN", "")  # optional Bearer token for scrapers
 
 MEMBERS = {"CA": "Christian", "ER": "Eric", "SJ": "Sean"}
 MEMBER_ORDER = ["CA", "ER", "SJ"]
@@ -0,0 +1,397 @@
+# credits.py
+"""
+Credit & suggestion logic, per carpool group: the per-day rules, the
+persisted ledger, monthly checkpoints, and the in-process day-indexed
+timeline used for "as of day X" lookups. Everything that reads entries
+takes the group_id and only touches that group's rows.
+
+credits_before(db, group_id, day) is the lookup to use from routes/APIs.
+"""
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import date, timedelta
+from itertools import groupby
+
+from constants import MEMBER_ORDER
+from db import transaction, day_to_date, data_version, db_file, DEFAULT_GROUP_ID
+
+def day_credits(roles: dict) -> dict:
+    """
+    Credit deltas for a single day's {member_key -> role} map:
+      - Driver: +1 per rider that same day
+      - Rider:  -1
+      - Off:     0
+    """
+    drivers = [m for m, r in roles.items() if r == "D"]
+    riders  = [m for m, r in roles.items() if r == "R"]
+    out = {}
+    if not drivers and not riders:
+        return out
+    for drv in drivers:
+        out[drv] = out.get(drv, 0) + len(riders)
+    for r in riders:
+        out[r] = out.get(r, 0) - 1
+    return out
+
+def compute_credits_all(entries):
+    """
+    Compute credits across one group's entries (see day_credits for the rules).
+    Returns a dict { member_key -> credits } across *all* history provided.
+    """
+    credits = defaultdict(int)
+    by_day = defaultdict(dict)
+    for e in entries:
+        d = day_to_date(e["day"])
+        by_day[d][e["member_key"]] = e["role"]
+
+    for d in sorted(by_day.keys()):
+        for m, delta in day_credits(by_day[d]).items():
+            credits[m] += delta
+    return dict(credits)
+
+# ---------- Credit ledger (persisted running totals) ----------
+
+def rebuild_ledger(db, group_id: int) -> dict:
+    """
+    Recompute a group's credit_ledger rows from its entries.
+    Caller owns the transaction. Returns the new totals.
+    """
+    rows = db.execute(
+        "SELECT day_iso AS day, member_key, role FROM entries "
+        "WHERE group_id=? AND day_iso IS NOT NULL", (group_id,)
+    ).fetchall()
+    totals = compute_credits_all(rows)
+    db.execute("DELETE FROM credit_ledger WHERE group_id=?", (group_id,))
+    db.executemany(
+        "INSERT INTO credit_ledger(group_id, member_key, credits) VALUES (?,?,?)",
+        [(group_id, m, c) for m, c in sorted(totals.items())],
+    )
+    # An empty ledger is a valid result (no entries yet); remember it was built
+    db.execute("INSERT OR REPLACE INTO meta(key, value) VALUES (?, 1)", (_ledger_built_key(group_id),))
+    return totals
+
+def _ledger_built_key(group_id: int) -> str:
+    return f"ledger_built:{group_id}"
+
+def _ledger_built(db, group_id: int) -> bool:
+    return db.execute(
+        "SELECT 1 FROM meta WHERE key=?", (_ledger_built_key(group_id),)
+    ).fetchone() is not None
+
+def _read_ledger(db, group_id: int) -> dict:
+    return {r["member_key"]: r["credits"] for r in db.execute(
+        "SELECT member_key, credits FROM credit_ledger WHERE group_id=?", (group_id,)
+    ).fetchall()}
+
+def ledger_credits(db, group_id: int) -> dict:
+    """A group's per-member totals; builds its ledger on first use against an existing DB."""
+    totals = _read_ledger(db, group_id)
+    if totals or _ledger_built(db, group_id):
+        return totals
+    if db.in_transaction:
+        return rebuild_ledger(db, group_id)
+    # Write lock first: concurrent requests on a fresh DB would otherwise
+    # all read, then fail to upgrade to a writer (SQLITE_BUSY, no retry)
+    with transaction(db, immediate=True):
+        if _ledger_built(db, group_id):
+            return _read_ledger(db, group_id)
+        return rebuild_ledger(db, group_id)
+
+def apply_ledger_deltas(db, group_id: int, day_changes):
+    """
+    Shift ledger totals by the change in credits of each (old roles, new roles)
+    day pair: one ledger write for the summed change.
+    """
+    deltas = defaultdict(int)
+    for old_roles, new_roles in day_changes:
+        for m, c in day_credits(new_roles).items():
+            deltas[m] += c
+        for m, c in day_credits(old_roles).items():
+            deltas[m] -= c
+    db.executemany(
+        "INSERT INTO credit_ledger(group_id, member_key, credits) VALUES (?,?,?) "
+        "ON CONFLICT(group_id, member_key) DO UPDATE SET credits = credits + excluded.credits",
+        [(group_id, m, d) for m, d in sorted(deltas.items()) if d],
+    )
+
+def credits_before(db, group_id: int, cutoff_day: date) -> dict:
+    """
+    A group's credits from all days strictly before cutoff_day.
+      - timeline, if this process already built it for the current data
+      - current month or later: ledger totals minus the days on/after the cutoff
+        (usually empty or a handful of rows)
+      - older days: nearest monthly checkpoint plus the days since it
+    """
+    timeline = cached_timeline(db, group_id)
+    if timeline is not None:
+        return timeline.credits_before(cutoff_day)
+    if cutoff_day < date.today().replace(day=1):
+        return checkpoint_credits_before(db, group_id, cutoff_day)
+
+    credits = dict(ledger_credits(db, group_id))
+    rows = db.execute(
+        "SELECT day_iso, member_key, role FROM entries WHERE group_id=? AND day_iso >= ?",
+        (group_id, cutoff_day.isoformat())
+    ).fetchall()
+    tail = defaultdict(dict)
+    for e in rows:
+        tail[e["day_iso"]][e["member_key"]] = e["role"]
+    for roles in tail.values():
+        for m, delta in day_credits(roles).items():
+            credits[m] = credits.get(m, 0) - delta
+    return credits
+
+# ---------- Monthly checkpoints ----------
+
+def _next_month(d: date) -> date:
+    return (d.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def _add_days(credits: dict, rows) -> dict:
+    """Add the credits of `rows` (ordered by day_iso) into `credits` in place."""
+    for _day, group in groupby(rows, key=lambda r: r["day_iso"]):
+        roles = {r["member_key"]: r["role"] for r in group}
+        for m, delta in day_credits(roles).items():
+            credits[m] = credits.get(m, 0) + delta
+    return credits
+
+def _load_checkpoint(db, group_id: int, month: str) -> dict:
+    return {r["member_key"]: r["credits"] for r in db.execute(
+        "SELECT member_key, credits FROM credit_checkpoints WHERE group_id=? AND month=?",
+        (group_id, month)
+    ).fetchall()}
+
+def _build_checkpoints(db, group_id: int, first_month: date, target: date):
+    """Fill in a group's month checkpoints from the latest valid one up to `target`."""
+    base = db.execute(
+        "SELECT MAX(month) AS m FROM credit_checkpoints WHERE group_id=? AND month <= ?",
+        (group_id, target.isoformat())
+    ).fetchone()["m"]
+    if base == target.isoformat():
+        return
+    credits = _load_checkpoint(db, group_id, base) if base else {}
+    boundary = _next_month(date.fromisoformat(base) if base else first_month)
+    rows = db.execute(
+        "SELECT day_iso, member_key, role FROM entries "
+        "WHERE group_id=? AND day_iso >= ? AND day_iso < ? ORDER BY day_iso, id",
+        (group_id, base or "", target.isoformat())
+    ).fetchall()
+
+    snapshots, seen = [], set(credits)
+    def snapshot(month: date):
+        snapshots.extend((group_id, month.isoformat(), m, credits.get(m, 0)) for m in sorted(seen))
+
+    for day_iso, group in groupby(rows, key=lambda r: r["day_iso"]):
+        while boundary <= target and day_iso >= boundary.isoformat():
+            snapshot(boundary)
+            boundary = _next_month(boundary)
+        roles = {r["member_key"]: r["role"] for r in group}
+        seen.update(roles)
+        for m, delta in day_credits(roles).items():
+            credits[m] = credits.get(m, 0) + delta
+    while boundary <= target:
+        snapshot(boundary)
+        boundary = _next_month(boundary)
+
+    db.executemany(
+        "INSERT OR REPLACE INTO credit_checkpoints(group_id, month, member_key, credits) "
+        "VALUES (?,?,?,?)",
+        snapshots,
+    )
+
+def checkpoint_credits_before(db, group_id: int, cutoff_day: date) -> dict:
+    """
+    A group's credits before cutoff_day from the nearest month checkpoint plus the entries
+    since it. Missing checkpoints (never built, or dropped by a write to an
+    earlier day) are rebuilt from the previous valid one.
+    """
+    span = db.execute(
+        "SELECT MIN(day_iso) AS lo, MAX(day_iso) AS hi FROM entries WHERE group_id=?", (group_id,)
+    ).fetchone()
+    if not span["lo"]:
+        return {}
+    first_month = date.fromisoformat(span["lo"]).replace(day=1)
+    # No point checkpointing months past the data
+    target = min(cutoff_day.replace(day=1), _next_month(date.fromisoformat(span["hi"])))
+
+    start, credits = "", {}
+    if target > first_month:
+        start = target.isoformat()
+        credits = _load_checkpoint(db, group_id, start)
+        if not credits:
+            if db.in_transaction:
+                _build_checkpoints(db, group_id, first_month, target)
+            else:
+                # Write lock held while reading so a concurrent save can't slip
+                # an older-day change in between our read and our insert.
+                with transaction(db, immediate=True):
+                    _build_checkpoints(db, group_id, first_month, target)
+            credits = _load_checkpoint(db, group_id, start)
+
+    rows = db.execute(
+        "SELECT day_iso, member_key, role FROM entries "
+        "WHERE group_id=? AND day_iso >= ? AND day_iso < ? ORDER BY day_iso, id",
+        (group_id, start, cutoff_day.isoformat())
+    ).fetchall()
+    return _add_days(credits, rows)
+
+# ---------- Day-indexed timeline (suggestion engine) ----------
+
+class CreditTimeline:
+    """
+    Built from one ordered pass over a group's entries. For every day that has data it
+    keeps the credits and the last driver in effect *before* that day, so
+    any "as of day X" question is a bisect on the sorted day list.
+    """
+
+    def __init__(self, rows):
+        # rows: (day_iso, member_key, role) ordered by day_iso, id
+        self.days = []
+        self._credits = []
+        self._last_driver = []
+        running, last_driver = {}, None
+        for day_iso, group in groupby(rows, key=lambda r: r["day_iso"]):
+            self.days.append(day_iso)
+            self._credits.append(dict(running))
+            self._last_driver.append(last_driver)
+            roles = {}
+            for r in group:
+                roles[r["member_key"]] = r["role"]
+            for m, delta in day_credits(roles).items():
+                running[m] = running.get(m, 0) + delta
+            last_driver = next((m for m, r in roles.items() if r == "D"), last_driver)
+        self.final_credits = running
+        self.final_last_driver = last_driver
+
+    def _index(self, day: date) -> int:
+        return bisect_left(self.days, day.isoformat())
+
+    def credits_before(self, day: date) -> dict:
+        i = self._index(day)
+        return dict(self._credits[i] if i < len(self.days) else self.final_credits)
+
+    def last_driver_before(self, day: date):
+        i = self._index(day)
+        return self._last_driver[i] if i < len(self.days) else self.final_last_driver
+
+
+_timeline_lock = threading.Lock()
+_timelines = {}  # (db file, group id) -> (group data_version, CreditTimeline)
+_timeline_stats = {"hits": 0, "misses": 0}
+
+def cached_timeline(db, group_id: int):
+    """The group's timeline for its current data version if this process has it, else None."""
+    hit = _timelines.get((db_file(db), group_id))
+    if hit and hit[0] == data_version(db, group_id):
+        _timeline_stats["hits"] += 1
+        return hit[1]
+    _timeline_stats["misses"] += 1
+    return None
+
+def timeline_cache_stats() -> dict:
+    return {"size": len(_timelines), **_timeline_stats}
+
+def get_timeline(db, group_id: int) -> CreditTimeline:
+    """A group's timeline for its current data version; rebuilt only after its entries change."""
+    timeline = cached_timeline(db, group_id)
+    if timeline is not None:
+        return timeline
+    # Version is read before the rows: a write landing in between only makes
+    # the cached copy look stale early, never serves old rows as current.
+    version = data_version(db, group_id)
+    rows = db.execute(
+        "SELECT day_iso, member_key, role FROM entries "
+        "WHERE group_id=? AND day_iso IS NOT NULL ORDER BY day_iso, id", (group_id,)
+    ).fetchall()
+    timeline = CreditTimeline(rows)
+    with _timeline_lock:
+        _timelines[(db_file(db), group_id)] = (version, timeline)
+    return timeline
+
+def find_last_driver_overall(db, group_id: int, cutoff_day: date):
+    """
+    Find the group's last driver strictly before cutoff_day to help with rotation tie-breaks.
+    """
+    return get_timeline(db, group_id).last_driver_before(cutoff_day)
+
+def member_order(group_id: int) -> list:
+    """Fixed tie-break order: MEMBER_ORDER for the default group, none (keys) elsewhere."""
+    return MEMBER_ORDER if group_id == DEFAULT_GROUP_ID else []
+
+def suggest_driver(db, group_id: int, selected_day: date, roles_today: dict, credits=None):
+    """
+    Suggest a driver for selected_day using the group's credits:
+      1) Lowest credits among today's active (not Off)
+      2) If tie, rotate from last driver then use member_order()
+    Pass `credits` (as of selected_day) when the caller already has them.
+    Returns member_key or None if <2 active (No Carpool Today).
+    """
+    active = [m for m, r in roles_today.items() if r != "O"]
+    if len(active) < 2:
+        return None
+
+    if credits is None:
+        credits = get_timeline(db, group_id).credits_before(selected_day)
+    return pick_driver(roles_today, credits,
+                       lambda: find_last_driver_overall(db, group_id, selected_day),
+                       member_order(group_id))
+
+def suggest_range(db, group_id: int, days, shown: dict, stored: dict, credits: dict = None) -> dict:
+    """
+    suggest_driver for consecutive days in one pass. Credits and the last
+    driver are looked up once, before days[0], then rolled forward with each
+    day's *stored* roles (what credits_before would see for the next day).
+    shown/stored map day_iso -> {member_key: role}; returns day_iso -> key/None.
+    Pass credits if the caller already has credits_before(days[0]) (left as is).
+    """
+    if not days:
+        return {}
+    first = date.fromisoformat(days[0])
+    credits = dict(credits) if credits is not None else credits_before(db, group_id, first)
+    last_driver = unknown = object()
+
+    def _last_driver():
+        nonlocal last_driver
+        if last_driver is unknown:  # only ties need it; look it up at most once
+            last_driver = find_last_driver_overall(db, group_id, first)
+        return last_driver
+
+    order = member_order(group_id)
+    out = {}
+    for d in days:
+        out[d] = pick_driver(shown[d], credits, _last_driver, order)
+        roles = stored.get(d, {})
+        for m, delta in day_credits(roles).items():
+            credits[m] = credits.get(m, 0) + delta
+        last_driver = next((m for m, r in roles.items() if r == "D"), last_driver)
+    return out
+
+def pick_driver(roles_today: dict, credits: dict, last_driver, fixed_order=MEMBER_ORDER):
+    """
+    The suggestion rules on their own: lowest credits among active members,
+    ties rotated from the last driver (a callable, only evaluated on a tie)
+    and then fixed_order (others after it, by key). None if fewer than 2 are active.
+    """
+    active = [m for m, r in roles_today.items() if r != "O"]
+    if len(active) < 2:
+        return None
+
+    filtered = {m: credits.get(m, 0) for m in active}
+    min_score = min(filtered.values()) if filtered else 0
+    candidates = [m for m, sc in filtered.items() if sc == min_score]
+    if len(candidates) == 1:
+        return candidates[0]
+
+    # Tie-break with last driver rotation, then fixed_order (newer members after, by key)
+    last_driver = last_driver()
+    order = [m for m in fixed_order if m in active] + sorted(m for m in active if m not in fixed_order)
+    if last_driver in order:
+        start = (order.index(last_driver) + 1) % len(order)
+        for i in range(len(order)):
+            pick = order[(start + i) % len(order)]
+            if pick in candidates:
+                return pick
+    for m in order:
+        if m in candidates:
+            return m
+    return sorted(candidates)[0] if candidates else None
@@ -1,8 +1,16 @@
 # db.py
 import os
+import queue
 import sqlite3
+import sys
+import threading
+import time
+import weakref
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import date, datetime
 from hashlib import sha256
-from flask import g, current_app
+from flask import g, current_app, has_request_context, request, after_this_request
 
 # ---- DB path resolution (portable + overrideable) ---------------------------
 # Order of precedence (first match wins):
@@ -40,36 +48,371 @@ def _resolve_db_path() -> str:
     return os.path.join(os.path.dirname(__file__), "data.db")
 
 
+def db_path() -> str:
+    """The SQLite file get_db() would connect to right now."""
+    return _resolve_db_path()
+
+
+# ---- Day values ---------------------------------------------------------------
+# entries.day holds ISO 'YYYY-MM-DD' for everything written by the app, plus
+# legacy imports like 'Jul 12, 2023, 12:00:00 AM'. entries.day_iso is the
+# normalized copy that queries filter, join and sort on.
+def parse_day_value(val):
+    """Parse a stored 'day' value into a date; None if the format is unknown."""
+    if isinstance(val, date):
+        return val
+    s = str(val or "")
+    try:
+        return date.fromisoformat(s[:10])
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(s.replace(",", ""), "%b %d %Y %I:%M:%S %p").date()
+    except ValueError:
+        return None
+
+
+def day_to_date(val) -> date:
+    """
+    Normalize DB 'day' values into a date object.
+    Supports:
+      - ISO 'YYYY-MM-DD...'
+      - 'Jul 12, 2023, 12:00:00 AM' (commas stripped first)
+    Falls back to today on parse failure (rare).
+    """
+    return parse_day_value(val) or date.today()
+
+
+BUSY_TIMEOUT_MS = 5000  # how long a statement waits for another writer's lock
+# Pause before each BEGIN IMMEDIATE retry: SQLite's own busy-handler schedule
+BUSY_DELAYS = (0.001, 0.002, 0.005, 0.01, 0.015, 0.02, 0.025, 0.025, 0.025, 0.05, 0.05, 0.1)
+
+
 def _connect(db_path: str) -> sqlite3.Connection:
+    from constants import SQL_TRACE  # lazy import to avoid circulars
     conn = sqlite3.connect(
         db_path,
         detect_types=sqlite3.PARSE_DECLTYPES,
         check_same_thread=False,
         timeout=10.0,
         isolation_level=None,  # autocommit-style; explicit transactions still work
+        factory=TracedConnection if SQL_TRACE else CountingConnection,
     )
     conn.row_factory = sqlite3.Row
     # Pragmas: reasonable defaults for a small Flask app
     conn.execute("PRAGMA journal_mode=WAL;")
     conn.execute("PRAGMA synchronous=NORMAL;")
-    conn.execute("PRAGMA busy_timeout=5000;")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS};")
     conn.execute("PRAGMA foreign_keys=ON;")
     return conn
 
 
+# ---- SQL tracing -------------------------------------------------------------
+# Every pooled connection counts its execute()/executemany() calls, which
+# get_db() zeroes per request for /metrics. With CESPOOL_SQL_TRACE=1
+# connections are TracedConnection objects: get_db() also hangs a
+# RequestTrace on them, every call is timed and SQLite's trace callback
+# counts each statement it runs (trigger bodies and executemany() rows
+# included). Off, no trace object or callback is set up at all.
+TRACE_WINDOW = 2000      # recent timed queries kept for slowest_queries()
+TRACE_REPEAT_WARN = 10   # log a request that runs the same SQL this many times
+
+_trace_log = deque(maxlen=TRACE_WINDOW)  # (seconds, sql, path, unix time)
+
+
+class RequestTrace:
+    """Statements SQLite ran and execute() timings for one request."""
+
+    def __init__(self, path: str = "", endpoint: str = ""):
+        self.path = path
+        self.endpoint = endpoint
+        self.statements = 0
+        self.calls = []  # (sql, seconds) per execute()/executemany()
+
+    def on_statement(self, _sql):
+        self.statements += 1
+
+    def seconds(self) -> float:
+        return sum(secs for _sql, secs in self.calls)
+
+    def repeats(self) -> dict:
+        """SQL text executed more than once in this request -> count (N+1 loops show up here)."""
+        counts = Counter(sql for sql, _secs in self.calls)
+        return {sql: n for sql, n in counts.items() if n > 1}
+
+
+class CountingConnection(sqlite3.Connection):
+    """Counts execute()/executemany() calls (one increment each, no callback)."""
+    queries = 0
+    endpoint = ""
+
+    def execute(self, sql, parameters=()):
+        self.queries += 1
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self.queries += 1
+        return super().executemany(sql, seq_of_parameters)
+
+
+class TracedConnection(CountingConnection):
+    """Times execute()/executemany() into self.trace while one is attached."""
+    trace = None
+
+    def execute(self, sql, parameters=()):
+        trace = self.trace
+        if trace is None:
+            return super().execute(sql, parameters)
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            trace.calls.append((sql, time.perf_counter() - t0))
+
+    def executemany(self, sql, seq_of_parameters):
+        trace = self.trace
+        if trace is None:
+            return super().executemany(sql, seq_of_parameters)
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            trace.calls.append((sql, time.perf_counter() - t0))
+
+
+def _start_trace(conn: sqlite3.Connection):
+    path, endpoint = (request.path, request.endpoint or "") if has_request_context() else ("", "")
+    conn.queries, conn.endpoint = 0, endpoint
+    if not isinstance(conn, TracedConnection):
+        return
+    trace = RequestTrace(path, endpoint)
+    conn.set_trace_callback(trace.on_statement)
+    conn.trace = trace
+    g.sql_trace = trace
+
+
+def _finish_trace(conn: sqlite3.Connection, error=None, trace=None):
+    """
+    Count the request's queries for /metrics; when traced, detach its trace
+    (g.sql_trace unless given), add its timings to the rolling log and warn
+    on repeats.
+    """
+    import metrics  # lazy import to avoid circulars
+    metrics.inc("cespool_db_queries_total", conn.queries, endpoint=conn.endpoint)
+    if isinstance(error, sqlite3.OperationalError) and "locked" in str(error):
+        metrics.inc("cespool_db_busy_errors_total")
+    if trace is None:
+        trace = g.pop("sql_trace", None)
+    if trace is None or not isinstance(conn, TracedConnection):
+        return
+    conn.set_trace_callback(None)
+    conn.trace = None
+    now = time.time()
+    _trace_log.extend((secs, sql, trace.path, now) for sql, secs in trace.calls)
+    for sql, n in trace.repeats().items():
+        if n >= TRACE_REPEAT_WARN:
+            current_app.logger.warning("%s ran the same query %d times: %s",
+                                       trace.path or "(no request)", n, " ".join(sql.split()))
+
+
+def server_timing(total_seconds: float) -> str:
+    """Server-Timing header value for the current request's trace."""
+    trace = g.get("sql_trace")
+    parts = [f"app;dur={total_seconds * 1000:.2f}"]
+    if trace is not None:
+        desc = f"{len(trace.calls)} queries, {trace.statements} statements"
+        repeats = trace.repeats()
+        if repeats:
+            desc += f", {len(repeats)} repeated ({sum(repeats.values())} runs)"
+        parts.append(f'db;dur={trace.seconds() * 1000:.2f};desc="{desc}"')
+    return ", ".join(parts)
+
+
+def slowest_queries(limit: int = 20) -> list:
+    """
+    The rolling log (last TRACE_WINDOW traced queries in this process) grouped
+    by SQL text, slowest single run first.
+    """
+    by_sql = {}
+    for secs, sql, path, when in list(_trace_log):
+        s = by_sql.get(sql)
+        if s is None:
+            s = by_sql[sql] = {"sql": " ".join(sql.split()), "calls": 0, "total_ms": 0.0,
+                               "max_ms": 0.0, "path": path, "when": when}
+        s["calls"] += 1
+        s["total_ms"] += secs * 1000
+        if secs * 1000 >= s["max_ms"]:
+            s.update(max_ms=secs * 1000, path=path, when=when)
+    return sorted(by_sql.values(), key=lambda s: s["max_ms"], reverse=True)[:limit]
+
+
+def trace_window() -> int:
+    """Queries currently in the rolling log."""
+    return len(_trace_log)
+
+
+# ---- Connection pool ----------------------------------------------------------
+# One small pool per DB path, per process. Connections stay open (pragmas and
+# page cache warm) and are handed to one request at a time.
+# Queued in place of a connection that was closed: whoever takes it (a
+# waiting thread, if any) opens a fresh connection in that slot
+_VACANT = object()
+
+
+class ConnectionPool:
+    def __init__(self, db_path: str, size: int, timeout: float):
+        self.db_path = db_path
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()  # LIFO: the warmest connection goes out first
+        self._lock = threading.Lock()
+        self._opened = 0  # slots handed out, _VACANT ones included
+        self._vacant = 0  # _VACANT markers in _idle
+        self._lent = set()  # id() of connections checked out right now
+        self.stats = {"hits": 0, "opens": 0, "waits": 0, "timeouts": 0, "discarded": 0}
+
+    def _open(self) -> sqlite3.Connection:
+        t0 = time.perf_counter()
+        try:
+            conn = _connect(self.db_path)
+            have = schema_version(conn)
+        except Exception:
+            self._vacate()
+            raise
+        if have < SCHEMA_VERSION:
+            # Migrations run at startup (create_app / manage.py migrate), never here
+            conn.close()
+            self._vacate()
+            raise RuntimeError(
+                f"{self.db_path} is at schema v{have}, app needs v{SCHEMA_VERSION}; "
+                "run `python manage.py migrate`"
+            )
+        import metrics  # lazy import to avoid circulars
+        metrics.observe("cespool_db_connect_seconds", time.perf_counter() - t0)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        conn = self._checkout()
+        with self._lock:
+            self._lent.add(id(conn))
+        return conn
+
+    def _vacate(self):
+        """Give up a slot's connection; the next taker of the slot opens a new one."""
+        with self._lock:
+            self._vacant += 1
+        self._idle.put(_VACANT)
+
+    def _take(self, conn, hit: bool = False) -> sqlite3.Connection:
+        if conn is _VACANT:
+            with self._lock:
+                self._vacant -= 1
+                self.stats["opens"] += 1
+            return self._open()
+        if hit:
+            with self._lock:
+                self.stats["hits"] += 1
+        return conn
+
+    def _checkout(self) -> sqlite3.Connection:
+        try:
+            return self._take(self._idle.get_nowait(), hit=True)
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_open = self._opened < self.size
+            if can_open:
+                self._opened += 1
+                self.stats["opens"] += 1
+            else:
+                self.stats["waits"] += 1
+        if can_open:
+            return self._open()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self.stats["timeouts"] += 1
+            raise sqlite3.OperationalError(
+                f"no free DB connection after {self.timeout:.0f}s (pool size {self.size})"
+            ) from None
+        return self._take(conn)
+
+    def release(self, conn: sqlite3.Connection):
+        """
+        Reset per-request state and put the connection back (or drop it if
+        broken). Releasing a connection that is not checked out is a no-op, so
+        a second release can never hand one connection to two requests.
+        """
+        with self._lock:
+            if id(conn) not in self._lent:
+                return
+            self._lent.discard(id(conn))
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = sqlite3.Row
+            conn.set_trace_callback(None)
+            if isinstance(conn, TracedConnection):
+                conn.trace = None
+        except sqlite3.Error:
+            conn.close()
+            with self._lock:
+                self.stats["discarded"] += 1
+            self._vacate()  # wakes a thread waiting in _checkout, if any
+            return
+        self._idle.put(conn)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"path": self.db_path, "size": self.size, "open": self._opened - self._vacant,
+                    "idle": self._idle.qsize() - self._vacant, "in_use": len(self._lent),
+                    **self.stats}
+
+
+_pools: dict = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+
+
+def _pool_for(db_path: str) -> ConnectionPool:
+    global _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # Forked worker: the parent's connections must not be shared
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(db_path)
+        if pool is None:
+            from constants import DB_POOL_SIZE, DB_POOL_TIMEOUT  # lazy import to avoid circulars
+            pool = _pools[db_path] = ConnectionPool(db_path, DB_POOL_SIZE, DB_POOL_TIMEOUT)
+        return pool
+
+
+def pool_stats() -> list:
+    """Hits/opens/waits per pool in this process, for sizing against worker threads."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [p.snapshot() for p in pools]
+
+
 def get_db():
-    """Get a per-request SQLite connection; ensure schema/migrations exist."""
+    """The request's SQLite connection, borrowed from the pool on first use."""
     if "db" not in g:
-        db_path = _resolve_db_path()
-        g.db = _connect(db_path)
-        _ensure_schema(g.db)
-        _migrate_v2(g.db)
+        pool = _pool_for(_resolve_db_path())
+        g.db = pool.acquire()
+        g.db_pool = pool
+        _start_trace(g.db)
     return g.db
 
 
-def _ensure_schema(db: sqlite3.Connection):
-    db.executescript(
-        """
+# ---- Versioned migrations (tracked in PRAGMA user_version) --------------------
+# Run once per process from create_app() (and by `manage.py migrate`), never
+# from get_db(). Each step is idempotent against DBs from before versioning.
+def _create_baseline(db: sqlite3.Connection):
+    """Tables and seed rows of the original schema (no-ops on a DB that has them)."""
+    # One statement at a time: executescript() would COMMIT the migration's transaction
+    for stmt in """
         CREATE TABLE IF NOT EXISTS users (
           id INTEGER PRIMARY KEY AUTOINCREMENT,
           username TEXT UNIQUE NOT NULL,
@@ -91,8 +434,14 @@ def _ensure_schema(db: sqlite3.Connection):
           update_ts   TEXT DEFAULT (CURRENT_TIMESTAMP),
           UNIQUE(day, member_key)
         );
-        """
-    )
+        -- Running credit totals per member, kept in step with entries by the save path
+        CREATE TABLE IF NOT EXISTS credit_ledger (
+          member_key TEXT PRIMARY KEY,
+          credits INTEGER NOT NULL DEFAULT 0
+        );
+        """.split(";"):
+        if stmt.strip():
+            db.execute(stmt)
 
     # Seed default members (optional)
     have = db.execute("SELECT COUNT(*) AS n FROM members").fetchone()["n"]
@@ -117,7 +466,10 @@ def _ensure_schema(db: sqlite3.Connection):
             ("admin", sha256(b"change-me").hexdigest()),
         )
 
-    db.commit()
+
+def _migrate_v1(db: sqlite3.Connection):
+    _create_baseline(db)
+    _migrate_v2(db)
 
 
 def _migrate_v2(db: sqlite3.Connection):
@@ -138,10 +490,728 @@ def _migrate_v2(db: sqlite3.Connection):
                 update_ts   = COALESCE(update_ts, CURRENT_TIMESTAMP)
             """
         )
-        db.commit()
+
+
+def _migrate_day_iso(db: sqlite3.Connection):
+    """
+    Add entries.day_iso, fill it from the mixed-format 'day' column, merge
+    rows that only differed by day format, and index (day_iso, member_key).
+    """
+    cols = {r["name"] for r in db.execute("PRAGMA table_info(entries)").fetchall()}
+    if "day_iso" not in cols:
+        db.execute("ALTER TABLE entries ADD COLUMN day_iso TEXT")
+
+    rows = db.execute("SELECT id, day, member_key FROM entries ORDER BY id").fetchall()
+    normalized, unparsed = [], 0
+    keep = {}  # (day_iso, member_key) -> id of the row that wins
+    for r in rows:
+        d = parse_day_value(r["day"])
+        if d is None:
+            unparsed += 1
+            continue
+        normalized.append((d.isoformat(), r["id"]))
+        # Credits used to be computed in id order with later rows overwriting
+        # earlier ones for the same date, so the highest id is the live value.
+        keep[(d.isoformat(), r["member_key"])] = r["id"]
+    db.executemany("UPDATE entries SET day_iso=? WHERE id=?", normalized)
+
+    keep_ids = set(keep.values())
+    dupes = [(i,) for _, i in normalized if i not in keep_ids]
+    db.executemany("DELETE FROM entries WHERE id=?", dupes)
+
+    db.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_entries_day_iso_member "
+        "ON entries(day_iso, member_key)"
+    )
+    # Safety net for ISO rows inserted by hand/other tools without day_iso
+    db.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_entries_day_iso AFTER INSERT ON entries
+        WHEN NEW.day_iso IS NULL
+          AND NEW.day GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'
+        BEGIN
+          UPDATE entries SET day_iso = substr(NEW.day, 1, 10) WHERE id = NEW.id;
+        END
+        """
+    )
+    if dupes or unparsed:
+        print(f"day_iso migration: merged {len(dupes)} duplicate rows, "
+              f"{unparsed} rows with unparseable day left NULL", file=sys.stderr)
+
+
+def _migrate_data_version(db: sqlite3.Connection):
+    """meta.data_version: a counter bumped by triggers on every entries write."""
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)"
+    )
+    db.execute("INSERT OR IGNORE INTO meta(key, value) VALUES ('data_version', 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        db.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_entries_version_{event.lower()}
+            AFTER {event} ON entries
+            BEGIN
+              UPDATE meta SET value = value + 1 WHERE key = 'data_version';
+            END
+            """
+        )
+
+
+def _migrate_credit_checkpoints(db: sqlite3.Connection):
+    """
+    credit_checkpoints: cumulative credits per member for all days before each
+    month start. Triggers drop every checkpoint after a changed day.
+    """
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS credit_checkpoints (
+          month TEXT NOT NULL,          -- 'YYYY-MM-01'
+          member_key TEXT NOT NULL,
+          credits INTEGER NOT NULL,
+          PRIMARY KEY (month, member_key)
+        )
+        """
+    )
+    db.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_entries_checkpoints_insert
+        AFTER INSERT ON entries
+        BEGIN
+          DELETE FROM credit_checkpoints WHERE month > NEW.day_iso;
+        END
+        """
+    )
+    db.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_entries_checkpoints_update
+        AFTER UPDATE OF day_iso, member_key, role ON entries
+        BEGIN
+          DELETE FROM credit_checkpoints WHERE month > OLD.day_iso;
+          DELETE FROM credit_checkpoints WHERE month > NEW.day_iso;
+        END
+        """
+    )
+    db.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_entries_checkpoints_delete
+        AFTER DELETE ON entries
+        BEGIN
+          DELETE FROM credit_checkpoints WHERE month > OLD.day_iso;
+        END
+        """
+    )
+
+
+# v5's column set (entries.update_date only arrives in v6)
+_AUDIT_FTS_COLUMNS_V5 = ("day", "member_key", "role", "update_user", "update_ts")
+# What entries_fts indexes now: the same fields the LIKE fallback searches
+AUDIT_FTS_COLUMNS = _AUDIT_FTS_COLUMNS_V5 + ("update_date",)
+
+
+def _migrate_audit_search(db: sqlite3.Connection):
+    """
+    Index for audit ordering, plus an FTS5 trigram index over the audit text
+    kept in sync by triggers. SQLite builds without FTS5/trigram (< 3.34)
+    skip the FTS part; /admin/audit falls back to LIKE there.
+    """
+    # Expression matches the ORDER BY in audit_page_query so it can walk the index
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS ix_entries_update_ts ON entries(COALESCE(update_ts, ''))"
+    )
+    _create_audit_fts(db)
+
+
+def _create_audit_fts(db: sqlite3.Connection):
+    """entries_fts, its sync triggers and a full rebuild (skipped without FTS5 trigram)."""
+    cols = ", ".join(_AUDIT_FTS_COLUMNS_V5)
+    new = ", ".join(f"new.{c}" for c in _AUDIT_FTS_COLUMNS_V5)
+    old = ", ".join(f"old.{c}" for c in _AUDIT_FTS_COLUMNS_V5)
+    try:
+        db.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5("
+            f"{cols}, content='entries', content_rowid='id', tokenize='trigram')"
+        )
+    except sqlite3.OperationalError as e:
+        print(f"audit search: FTS5 trigram unavailable ({e}); using LIKE", file=sys.stderr)
+        return
+    db.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_entries_fts_insert AFTER INSERT ON entries
+        BEGIN
+          INSERT INTO entries_fts(rowid, {cols}) VALUES (new.id, {new});
+        END
+        """
+    )
+    db.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_entries_fts_delete AFTER DELETE ON entries
+        BEGIN
+          INSERT INTO entries_fts(entries_fts, rowid, {cols}) VALUES ('delete', old.id, {old});
+        END
+        """
+    )
+    db.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_entries_fts_update AFTER UPDATE ON entries
+        BEGIN
+          INSERT INTO entries_fts(entries_fts, rowid, {cols}) VALUES ('delete', old.id, {old});
+          INSERT INTO entries_fts(rowid, {cols}) VALUES (new.id, {new});
+        END
+        """
+    )
+    db.execute("INSERT INTO entries_fts(entries_fts) VALUES ('rebuild')")
+
+
+def has_audit_fts(db: sqlite3.Connection) -> bool:
+    return db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='entries_fts'"
+    ).fetchone() is not None
+
+
+# Bumps the data version and records when (unix time) it happened
+_BUMP_DATA_VERSION = (
+    "UPDATE meta SET value = CASE key WHEN 'data_version' THEN value + 1 "
+    "ELSE CAST(strftime('%s', 'now') AS INTEGER) END "
+    "WHERE key IN ('data_version', 'data_changed')"
+)
+
+
+def _migrate_data_stamp(db: sqlite3.Connection):
+    """
+    meta.data_changed (unix time of the last data change, for Last-Modified)
+    set by the version triggers, which now also fire on members edits
+    since member names/activity show on the same pages.
+    """
+    db.execute(
+        "INSERT OR IGNORE INTO meta(key, value) "
+        "VALUES ('data_changed', CAST(strftime('%s', 'now') AS INTEGER))"
+    )
+    for table in ("entries", "members"):
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            name = f"trg_{table}_version_{event.lower()}"
+            db.execute(f"DROP TRIGGER IF EXISTS {name}")
+            db.execute(
+                f"""
+                CREATE TRIGGER {name}
+                AFTER {event} ON {table}
+                BEGIN
+                  {_BUMP_DATA_VERSION};
+                END
+                """
+            )
+
+
+def _migrate_update_date(db: sqlite3.Connection):
+    """Add entries.update_date (the save path and audit page use it), backfilled from update_ts."""
+    cols = {r["name"] for r in db.execute("PRAGMA table_info(entries)").fetchall()}
+    if "update_date" not in cols:
+        db.execute("ALTER TABLE entries ADD COLUMN update_date TEXT")
+    db.execute("UPDATE entries SET update_date = DATE(update_ts) WHERE update_date IS NULL")
+
+
+DEFAULT_GROUP_ID = 1  # the carpool every row written before v8 belongs to
+
+# Bumps a group's data version and records when (unix time) it happened
+_BUMP_GROUP_VERSION = (
+    "UPDATE groups SET data_version = data_version + 1, "
+    "data_changed = CAST(strftime('%s', 'now') AS INTEGER)"
+)
+
+
+def _rebuild_table(db: sqlite3.Connection, table: str, create_sql: str, columns):
+    """
+    Swap `table` for the one create_sql makes as '<table>_new', copying
+    `columns` across (new columns take their defaults). The old table's
+    indexes and triggers go with it; AUTOINCREMENT keeps its high-water mark.
+    """
+    seq = db.execute("SELECT seq FROM sqlite_sequence WHERE name=?", (table,)).fetchone()
+    db.execute(create_sql)
+    cols = ", ".join(columns)
+    db.execute(f"INSERT INTO {table}_new({cols}) SELECT {cols} FROM {table}")
+    db.execute(f"DROP TABLE {table}")
+    db.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    if seq:
+        db.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name=?", (seq[0], table))
+
+
+def _migrate_groups(db: sqlite3.Connection):
+    """
+    Several carpools in one DB: a groups table (with its own data version in
+    place of meta's), group_id on users/members/entries and the credit
+    tables, keys unique per group, and every entries index led by group_id.
+    Existing rows become the default group. Rebuilding entries drops its
+    triggers, so they are recreated here, scoped to the row's group.
+    """
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS groups (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          slug TEXT UNIQUE NOT NULL,
+          name TEXT NOT NULL,
+          data_version INTEGER NOT NULL DEFAULT 0,
+          data_changed INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    # Carry the current stamp over so existing ETags stay valid
+    db.execute(
+        "INSERT OR IGNORE INTO groups(id, slug, name, data_version, data_changed) "
+        "SELECT ?, 'default', 'Carpool', "
+        "COALESCE((SELECT value FROM meta WHERE key='data_version'), 0), "
+        "COALESCE((SELECT value FROM meta WHERE key='data_changed'), 0)",
+        (DEFAULT_GROUP_ID,),
+    )
+
+    # No REFERENCES here: ADD COLUMN can't give a foreign key a non-NULL default
+    db.execute(f"ALTER TABLE users ADD COLUMN group_id INTEGER NOT NULL DEFAULT {DEFAULT_GROUP_ID}")
+
+    _rebuild_table(db, "members", f"""
+        CREATE TABLE members_new (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          group_id INTEGER NOT NULL DEFAULT {DEFAULT_GROUP_ID} REFERENCES groups(id),
+          key TEXT NOT NULL,
+          name TEXT NOT NULL,
+          active INTEGER NOT NULL DEFAULT 1,
+          UNIQUE(group_id, key)
+        )
+        """, ("id", "key", "name", "active"))
+    _rebuild_table(db, "entries", f"""
+        CREATE TABLE entries_new (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          group_id INTEGER NOT NULL DEFAULT {DEFAULT_GROUP_ID} REFERENCES groups(id),
+          day TEXT NOT NULL,
+          member_key TEXT NOT NULL,
+          role TEXT NOT NULL CHECK(role IN ('D','R','O')),
+          update_user TEXT DEFAULT 'admin',
+          update_ts   TEXT DEFAULT (CURRENT_TIMESTAMP),
+          day_iso TEXT,
+          update_date TEXT,
+          UNIQUE(group_id, day, member_key)
+        )
+        """, ("id", "day", "member_key", "role", "update_user", "update_ts", "day_iso", "update_date"))
+    _rebuild_table(db, "credit_ledger", f"""
+        CREATE TABLE credit_ledger_new (
+          group_id INTEGER NOT NULL DEFAULT {DEFAULT_GROUP_ID},
+          member_key TEXT NOT NULL,
+          credits INTEGER NOT NULL DEFAULT 0,
+          PRIMARY KEY (group_id, member_key)
+        )
+        """, ("member_key", "credits"))
+    _rebuild_table(db, "credit_checkpoints", f"""
+        CREATE TABLE credit_checkpoints_new (
+          group_id INTEGER NOT NULL DEFAULT {DEFAULT_GROUP_ID},
+          month TEXT NOT NULL,
+          member_key TEXT NOT NULL,
+          credits INTEGER NOT NULL,
+          PRIMARY KEY (group_id, month, member_key)
+        )
+        """, ("month", "member_key", "credits"))
+
+    # Day grids, credit scans and upserts / audit order / per-member stats
+    db.execute(
+        "CREATE UNIQUE INDEX ux_entries_group_day_member ON entries(group_id, day_iso, member_key)"
+    )
+    db.execute(
+        "CREATE INDEX ix_entries_group_update_ts ON entries(group_id, COALESCE(update_ts, ''))"
+    )
+    db.execute("CREATE INDEX ix_entries_group_member ON entries(group_id, member_key, role)")
+
+    db.execute(
+        """
+        CREATE TRIGGER trg_entries_day_iso AFTER INSERT ON entries
+        WHEN NEW.day_iso IS NULL
+          AND NEW.day GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'
+        BEGIN
+          UPDATE entries SET day_iso = substr(NEW.day, 1, 10) WHERE id = NEW.id;
+        END
+        """
+    )
+    for table in ("entries", "members"):
+        for event, groups in (("INSERT", "NEW.group_id"), ("DELETE", "OLD.group_id"),
+                              ("UPDATE", "OLD.group_id, NEW.group_id")):
+            name = f"trg_{table}_version_{event.lower()}"
+            db.execute(f"DROP TRIGGER IF EXISTS {name}")
+            db.execute(
+                f"""
+                CREATE TRIGGER {name}
+                AFTER {event} ON {table}
+                BEGIN
+                  {_BUMP_GROUP_VERSION} WHERE id IN ({groups});
+                END
+                """
+            )
+    db.execute(
+        """
+        CREATE TRIGGER trg_entries_checkpoints_insert
+        AFTER INSERT ON entries
+        BEGIN
+          DELETE FROM credit_checkpoints WHERE group_id = NEW.group_id AND month > NEW.day_iso;
+        END
+        """
+    )
+    db.execute(
+        """
+        CREATE TRIGGER trg_entries_checkpoints_update
+        AFTER UPDATE OF group_id, day_iso, member_key, role ON entries
+        BEGIN
+          DELETE FROM credit_checkpoints WHERE group_id = OLD.group_id AND month > OLD.day_iso;
+          DELETE FROM credit_checkpoints WHERE group_id = NEW.group_id AND month > NEW.day_iso;
+        END
+        """
+    )
+    db.execute(
+        """
+        CREATE TRIGGER trg_entries_checkpoints_delete
+        AFTER DELETE ON entries
+        BEGIN
+          DELETE FROM credit_checkpoints WHERE group_id = OLD.group_id AND month > OLD.day_iso;
+        END
+        """
+    )
+    _create_audit_fts(db)
+
+
+# entries_fts rowid = group_id << AUDIT_FTS_GROUP_SHIFT | entries.id, so each
+# group's postings are one rowid range that a MATCH can be bounded to
+AUDIT_FTS_GROUP_SHIFT = 32
+_AUDIT_FTS_ROWID = f"(({{t}}.group_id << {AUDIT_FTS_GROUP_SHIFT}) + {{t}}.id)"
+
+
+def audit_fts_range(group_id: int) -> tuple:
+    """(lo, hi) entries_fts rowids for one group; entries.id is rowid - lo."""
+    lo = int(group_id) << AUDIT_FTS_GROUP_SHIFT
+    return lo, lo + (1 << AUDIT_FTS_GROUP_SHIFT) - 1
+
+
+def _fill_audit_fts(db: sqlite3.Connection, group_id: int = None):
+    """(Re)index entries in entries_fts: one group's range, or everything."""
+    cols = ", ".join(AUDIT_FTS_COLUMNS)
+    if group_id is None:
+        db.execute("DELETE FROM entries_fts")
+        where, params = "", ()
+    else:
+        db.execute("DELETE FROM entries_fts WHERE rowid BETWEEN ? AND ?", audit_fts_range(group_id))
+        where, params = " WHERE group_id = ?", (group_id,)
+    db.execute(
+        f"INSERT INTO entries_fts(rowid, {cols}) "
+        f"SELECT {_AUDIT_FTS_ROWID.format(t='entries')}, {cols} FROM entries{where}",
+        params,
+    )
+
+
+def _migrate_group_fts(db: sqlite3.Connection):
+    """
+    (Re)build entries_fts over AUDIT_FTS_COLUMNS as its own (small) FTS5
+    table keyed by group + entry id, so audit search and bulk imports only
+    touch the current group's postings. The external-content table it
+    replaced (v9) had to be rowid = entries.id; v11 reruns it to add
+    update_date.
+    """
+    if not has_audit_fts(db):
+        return  # no FTS5 trigram here; audit search stays on LIKE
+    for event in ("insert", "delete", "update"):
+        db.execute(f"DROP TRIGGER IF EXISTS trg_entries_fts_{event}")
+    db.execute("DROP TABLE entries_fts")
+    cols = ", ".join(AUDIT_FTS_COLUMNS)
+    new = ", ".join(f"NEW.{c}" for c in AUDIT_FTS_COLUMNS)
+    new_id, old_id = _AUDIT_FTS_ROWID.format(t="NEW"), _AUDIT_FTS_ROWID.format(t="OLD")
+    db.execute(f"CREATE VIRTUAL TABLE entries_fts USING fts5({cols}, tokenize='trigram')")
+    db.execute(
+        f"""
+        CREATE TRIGGER trg_entries_fts_insert AFTER INSERT ON entries
+        BEGIN
+          INSERT INTO entries_fts(rowid, {cols}) VALUES ({new_id}, {new});
+        END
+        """
+    )
+    db.execute(
+        f"""
+        CREATE TRIGGER trg_entries_fts_delete AFTER DELETE ON entries
+        BEGIN
+          DELETE FROM entries_fts WHERE rowid = {old_id};
+        END
+        """
+    )
+    db.execute(
+        f"""
+        CREATE TRIGGER trg_entries_fts_update AFTER UPDATE ON entries
+        BEGIN
+          DELETE FROM entries_fts WHERE rowid = {old_id};
+          INSERT INTO entries_fts(rowid, {cols}) VALUES ({new_id}, {new});
+        END
+        """
+    )
+    _fill_audit_fts(db)
+
+
+def _migrate_users_version(db: sqlite3.Connection):
+    """
+    meta.users_version: bumped by triggers on every users write, so each
+    process's login cache can tell its User objects are stale.
+    """
+    db.execute("INSERT OR IGNORE INTO meta(key, value) VALUES ('users_version', 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        db.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_users_version_{event.lower()}
+            AFTER {event} ON users
+            BEGIN
+              UPDATE meta SET value = value + 1 WHERE key = 'users_version';
+            END
+            """
+        )
+
+
+# (version, description, fn) -- append only; never renumber released entries
+MIGRATIONS = [
+    (1, "baseline tables + seed rows, entries.update_user / update_ts", _migrate_v1),
+    (2, "entries.day_iso + unique (day_iso, member_key) index", _migrate_day_iso),
+    (3, "meta.data_version + entries triggers", _migrate_data_version),
+    (4, "credit_checkpoints + invalidation triggers", _migrate_credit_checkpoints),
+    (5, "update_ts index + entries_fts audit search", _migrate_audit_search),
+    (6, "entries.update_date", _migrate_update_date),
+    (7, "meta.data_changed + members version triggers", _migrate_data_stamp),
+    (8, "groups + group_id on users/members/entries, group-led indexes", _migrate_groups),
+    (9, "entries_fts keyed by (group_id, id) for group-bounded search", _migrate_group_fts),
+    (10, "meta.users_version + users triggers", _migrate_users_version),
+    (11, "entries_fts also indexes update_date", _migrate_group_fts),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(db: sqlite3.Connection) -> int:
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def run_migrations(db: sqlite3.Connection) -> list:
+    """
+    Apply pending MIGRATIONS in order, each in its own transaction.
+    Returns [(version, description, seconds)] for the steps this call applied.
+    """
+    applied = []
+    if schema_version(db) >= SCHEMA_VERSION:
+        return applied
+    for version, desc, fn in MIGRATIONS:
+        t0 = time.perf_counter()
+        with transaction(db, immediate=True):
+            # re-read under the write lock in case another worker got here first
+            if schema_version(db) >= version:
+                continue
+            fn(db)
+            db.execute(f"PRAGMA user_version = {int(version)}")
+        applied.append((version, desc, time.perf_counter() - t0))
+    return applied
+
+
+def migrate_db(db_path: str = None, log=None) -> list:
+    """
+    Bring the DB file up to SCHEMA_VERSION on a short-lived connection and
+    log each step's timing (to stderr, so CLI output stays clean).
+    """
+    log = log or (lambda msg: print(msg, file=sys.stderr))
+    db_path = db_path or _resolve_db_path()
+    t0 = time.perf_counter()
+    conn = _connect(db_path)
+    try:
+        start = schema_version(conn)
+        applied = run_migrations(conn)
+    finally:
+        conn.close()
+    for version, desc, secs in applied:
+        log(f"migration v{version} ({desc}): {secs * 1000:.1f} ms")
+    if applied:
+        log(f"schema v{start} -> v{SCHEMA_VERSION} in {(time.perf_counter() - t0) * 1000:.1f} ms")
+    return applied
+
+
+def _begin_immediate(db: sqlite3.Connection) -> int:
+    """
+    BEGIN IMMEDIATE, retrying here rather than in SQLite's busy handler so
+    each SQLITE_BUSY is counted. Gives up after BUSY_TIMEOUT_MS like the
+    handler would. Returns the number of retries.
+    """
+    db.execute("PRAGMA busy_timeout=0")
+    try:
+        deadline = time.monotonic() + BUSY_TIMEOUT_MS / 1000
+        retries = 0
+        while True:
+            try:
+                db.execute("BEGIN IMMEDIATE")
+                return retries
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) or time.monotonic() >= deadline:
+                    raise
+            time.sleep(BUSY_DELAYS[min(retries, len(BUSY_DELAYS) - 1)])
+            retries += 1
+    finally:
+        db.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+
+
+@contextmanager
+def transaction(db: sqlite3.Connection, immediate: bool = False):
+    """
+    Explicit BEGIN/COMMIT on our autocommit connections; rolls back on error.
+    immediate=True takes the write lock up front (no deferred-upgrade BUSY).
+    """
+    if immediate:
+        import metrics  # lazy import to avoid circulars
+        t0 = time.perf_counter()
+        retries = _begin_immediate(db)
+        metrics.observe_lock_wait(time.perf_counter() - t0, retries)
+    else:
+        db.execute("BEGIN")
+    try:
+        yield db
+    except Exception:
+        db.rollback()
+        raise
+    db.commit()
+
+
+@contextmanager
+def entries_bulk_load(db: sqlite3.Connection, group_id: int = None):
+    """
+    For bulk writes to entries inside an open transaction(). Drops the per-row
+    derived-data triggers (version bump, checkpoint invalidation, FTS sync)
+    for the duration, then refreshes those tables once and restores the
+    triggers. On error the caller's rollback puts the triggers back.
+    With group_id the refresh covers that group only, so every write made
+    inside must stay within it; without, every group is refreshed.
+    The credit ledger is the caller's to rebuild.
+    """
+    if not db.in_transaction:
+        raise RuntimeError("entries_bulk_load() needs an open transaction")
+    triggers = db.execute(
+        "SELECT name, sql FROM sqlite_master "
+        "WHERE type='trigger' AND tbl_name='entries' AND name != 'trg_entries_day_iso'"
+    ).fetchall()
+    for t in triggers:
+        db.execute(f'DROP TRIGGER "{t["name"]}"')
+    yield db
+    for t in triggers:
+        db.execute(t["sql"])
+    if group_id is None:
+        db.execute(_BUMP_GROUP_VERSION)
+        db.execute("DELETE FROM credit_checkpoints")
+    else:
+        db.execute(_BUMP_GROUP_VERSION + " WHERE id = ?", (group_id,))
+        db.execute("DELETE FROM credit_checkpoints WHERE group_id = ?", (group_id,))
+    if has_audit_fts(db):
+        _fill_audit_fts(db, group_id)
+
+
+def iter_rows(cur: sqlite3.Cursor, size: int = 500):
+    """Yield a cursor's rows in fetchmany() batches so big results never sit in memory."""
+    while True:
+        batch = cur.fetchmany(size)
+        if not batch:
+            return
+        yield from batch
+
+
+def active_members(db: sqlite3.Connection, group_id: int) -> list:
+    """key, name rows of a group's active members, in the column order every grid uses."""
+    return db.execute(
+        "SELECT key, name FROM members WHERE group_id=? AND active=1 ORDER BY key", (group_id,)
+    ).fetchall()
+
+
+def group_id_for(db: sqlite3.Connection, slug: str) -> int:
+    """id of the group with this slug; ValueError if there is none."""
+    row = db.execute("SELECT id FROM groups WHERE slug=?", (slug,)).fetchone()
+    if row is None:
+        raise ValueError(f"no such group: {slug!r}")
+    return row["id"]
+
+
+def role_pivot_columns(keys, default: str = None) -> tuple:
+    """
+    SELECT-list for a day x member role grid over entries grouped by day_iso:
+    one conditional aggregate per member key, aliased m0, m1, ... in the
+    order given (keys stay bind parameters, never identifiers). A member with
+    no entry that day gets `default`. Returns (sql, params).
+    """
+    cols, params = [], []
+    for i, key in enumerate(keys):
+        if default is None:
+            cols.append(f"MAX(CASE WHEN member_key = ? THEN role END) AS m{i}")
+            params.append(key)
+        else:
+            cols.append(f"COALESCE(MAX(CASE WHEN member_key = ? THEN role END), ?) AS m{i}")
+            params.extend((key, default))
+    return ", ".join(cols), params
+
+
+def data_version(db: sqlite3.Connection, group_id: int) -> int:
+    """Changes whenever the group's entries or members change, in this or any other process."""
+    row = db.execute("SELECT data_version FROM groups WHERE id=?", (group_id,)).fetchone()
+    return row["data_version"] if row else 0
+
+
+def users_version(db: sqlite3.Connection) -> int:
+    """Changes whenever any users row changes, in this or any other process."""
+    row = db.execute("SELECT value FROM meta WHERE key='users_version'").fetchone()
+    return row["value"] if row else 0
+
+
+def data_stamp(db: sqlite3.Connection, group_id: int) -> tuple:
+    """(data_version, unix time of that change) for a group in one row read; never touches entries."""
+    row = db.execute(
+        "SELECT data_version, data_changed FROM groups WHERE id=?", (group_id,)
+    ).fetchone()
+    return (row["data_version"], row["data_changed"]) if row else (0, 0)
+
+
+def db_file(db: sqlite3.Connection) -> str:
+    """Path of the connection's main database file ('' for in-memory)."""
+    for r in db.execute("PRAGMA database_list").fetchall():
+        if r["name"] == "main":
+            return r["file"] or ""
+    return ""
+
+
+def hold_db_for_stream(body):
+    """
+    Wrap a streamed response body (run it under stream_with_context) so the
+    request's connection stays open until the last chunk is sent. It goes back
+    to the pool when the body finishes or when the response is closed,
+    whichever comes first; the close also covers HEAD requests and clients
+    that drop before the first chunk, where the body never runs.
+    """
+    # Taken off g now: teardown runs before the body starts and must not release it
+    conn, pool, trace = g.pop("db", None), g.pop("db_pool", None), g.pop("sql_trace", None)
+    if conn is None:
+        return body
+    app = current_app._get_current_object()
+    lock = threading.Lock()
+
+    def release():
+        nonlocal conn
+        with lock:
+            held, conn = conn, None
+        if held is not None:
+            with app.app_context():  # the close callback runs outside the request
+                _finish_trace(held, trace=trace)
+                pool.release(held)
+
+    @after_this_request
+    def _release_on_close(response):
+        response.call_on_close(release)
+        # Backstop for servers that drop a response without calling close()
+        weakref.finalize(response, release)
+        return response
+
+    def _body():
+        try:
+            yield from body
+        finally:
+            release()
+    return _body()
 
 
 def close_db(_error=None):
     db = g.pop("db", None)
+    pool = g.pop("db_pool", None)
     if db is not None:
-        db.close()
+        _finish_trace(db, _error)
+        pool.release(db)
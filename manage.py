@@ -8,9 +8,17 @@ Examples:
   python manage.py set-user --username admin --password "ChangeMeNow!" --admin 1
   python manage.py migrate
   python manage.py seed-members
+  python manage.py groups
+  python manage.py add-group --slug east --name "East carpool" --member AB=Alice --member CD=Carol
+  python manage.py set-user --username alice --password "pw" --group east
+  python manage.py rebuild-ledger --group east
+  python manage.py export --format csv --out entries.csv --start 2024-01-01
+  python manage.py import --csv entries.csv --dry-run
   python manage.py backup --out data.backup.db
   python manage.py wal-checkpoint
   python manage.py vacuum
+  python manage.py profile --route /history --args start=2023-01-01 --repeat 50
+  python manage.py profile --route /today --synthetic 5 --out today --tracemalloc
 """
 import os
 import sys
@@ -24,7 +32,7 @@ if BASE_DIR not in sys.path:
 
 # Import your app + db utilities
 from app_v2 import create_app
-from db import get_db, close_db
+from db import get_db, close_db, transaction, entries_bulk_load, parse_day_value, group_id_for
 
 def with_app_context(fn):
     """Decorator to run a function inside Flask app context and return its result."""
@@ -43,15 +51,28 @@ def cmd_stats(args):
     entries = db.execute("SELECT COUNT(*) FROM entries").fetchone()[0] if "entries" in tables else 0
     users = db.execute("SELECT COUNT(*) FROM users").fetchone()[0] if "users" in tables else 0
     members = db.execute("SELECT COUNT(*) FROM members").fetchone()[0] if "members" in tables else 0
+    groups = db.execute("SELECT COUNT(*) FROM groups").fetchone()[0] if "groups" in tables else 0
     print("DB path:", main_path)
     print("Tables:", ", ".join(tables) or "(none)")
-    print("Counts: entries=%s users=%s members=%s" % (entries, users, members))
+    print("Counts: entries=%s users=%s members=%s groups=%s" % (entries, users, members, groups))
+
+def _group(db, args):
+    """--group slug -> id, or None after printing the known slugs."""
+    try:
+        return group_id_for(db, args.group)
+    except ValueError as e:
+        slugs = [r["slug"] for r in db.execute("SELECT slug FROM groups ORDER BY slug").fetchall()]
+        print(f"{e} (groups: {', '.join(slugs)})")
+        return None
 
 @with_app_context
 def cmd_users(args):
     db = get_db()
     try:
-        rows = db.execute("SELECT id, username, is_admin FROM users ORDER BY username").fetchall()
+        rows = db.execute(
+            "SELECT u.id, u.username, u.is_admin, g.slug FROM users u "
+            "LEFT JOIN groups g ON g.id = u.group_id ORDER BY u.username"
+        ).fetchall()
     except Exception as e:
         print("users table not found:", e)
         return 1
@@ -59,10 +80,10 @@ def cmd_users(args):
         print("(no users)")
         return 0
     w = max(5, max(len(r["username"]) for r in rows))
-    print(f"{'id':>3}  {'username':<{w}}  admin")
-    print("-" * (10 + w))
+    print(f"{'id':>3}  {'username':<{w}}  admin  group")
+    print("-" * (17 + w))
     for r in rows:
-        print(f"{r['id']:>3}  {r['username']:<{w}}  {'yes' if r['is_admin'] else 'no'}")
+        print(f"{r['id']:>3}  {r['username']:<{w}}  {'yes' if r['is_admin'] else 'no ':<5}  {r['slug']}")
     return 0
 
 @with_app_context
@@ -71,31 +92,85 @@ def cmd_set_user(args):
     if not args.username or not args.password:
         print("username and password required")
         return 2
+    group_id = _group(db, args)
+    if group_id is None:
+        return 2
     pw_hash = sha256(args.password.encode()).hexdigest()
     is_admin = 1 if args.admin else 0
     db.execute(
-        "INSERT OR REPLACE INTO users(username, password_hash, is_admin) VALUES(?,?,?)",
-        (args.username, pw_hash, is_admin),
+        "INSERT OR REPLACE INTO users(username, password_hash, is_admin, group_id) VALUES(?,?,?,?)",
+        (args.username, pw_hash, is_admin, group_id),
     )
-    db.commit()
-    print(f"user '{args.username}' saved (admin={bool(is_admin)})")
+    db.commit()  # the users triggers bump users_version; running workers drop their cached login
+    print(f"user '{args.username}' saved (admin={bool(is_admin)}, group={args.group})")
     return 0
 
 @with_app_context
-def cmd_migrate(args):
-    # touching get_db() runs your _ensure_schema + _migrate_v2
+def cmd_groups(args):
+    """List carpool groups with their member, user and entry counts."""
     db = get_db()
-    # nudge a pragma to force open/commit
-    db.execute("PRAGMA user_version")
-    db.commit()
-    print("schema/migrations ensured")
+    rows = db.execute(
+        "SELECT id, slug, name, "
+        "(SELECT COUNT(*) FROM members m WHERE m.group_id = g.id AND m.active = 1) AS members, "
+        "(SELECT COUNT(*) FROM users u WHERE u.group_id = g.id) AS users, "
+        "(SELECT COUNT(*) FROM entries e WHERE e.group_id = g.id) AS entries "
+        "FROM groups g ORDER BY id"
+    ).fetchall()
+    w = max(4, max(len(r["slug"]) for r in rows))
+    print(f"{'id':>3}  {'slug':<{w}}  {'members':>7}  {'users':>5}  {'entries':>8}  name")
+    print("-" * (42 + w))
+    for r in rows:
+        print(f"{r['id']:>3}  {r['slug']:<{w}}  {r['members']:>7}  {r['users']:>5}  "
+              f"{r['entries']:>8}  {r['name']}")
     return 0
 
+@with_app_context
+def cmd_add_group(args):
+    """Create a carpool group (or rename it) and add/update its members."""
+    db = get_db()
+    members = []
+    for spec in args.member or []:
+        key, sep, name = spec.partition("=")
+        if not sep or not key.strip() or not name.strip():
+            print(f"bad --member {spec!r}; expected KEY=Name")
+            return 2
+        members.append((key.strip().upper(), name.strip()))
+    with transaction(db, immediate=True):
+        db.execute(
+            "INSERT INTO groups(slug, name) VALUES (?,?) "
+            "ON CONFLICT(slug) DO UPDATE SET name=excluded.name",
+            (args.slug, args.name or args.slug),
+        )
+        group_id = group_id_for(db, args.slug)
+        db.executemany(
+            "INSERT INTO members(group_id, key, name, active) VALUES (?,?,?,1) "
+            "ON CONFLICT(group_id, key) DO UPDATE SET name=excluded.name, active=1",
+            [(group_id, k, n) for k, n in members],
+        )
+    print(f"group '{args.slug}' (id {group_id}) saved with {len(members)} member(s) added/updated")
+    return 0
+
+@with_app_context
+def cmd_migrate(args):
+    """Apply pending schema migrations (create_app() has already run them) and report the version."""
+    from db import MIGRATIONS, SCHEMA_VERSION, migrate_db, schema_version
+    migrate_db(log=print)
+    have = schema_version(get_db())
+    for version, desc, _fn in MIGRATIONS:
+        print(f"  v{version} {'applied' if version <= have else 'PENDING'}: {desc}")
+    print(f"schema at v{have} (latest v{SCHEMA_VERSION})")
+    return 0 if have >= SCHEMA_VERSION else 1
+
 @with_app_context
 def cmd_seed_members(args):
-    """Re-run the member seeding if table is empty."""
+    """Re-run the member seeding if the group has no members."""
     db = get_db()
-    have = db.execute("SELECT COUNT(*) AS n FROM members").fetchone()["n"]
+    group_id = _group(db, args)
+    if group_id is None:
+        return 2
+    have = db.execute(
+        "SELECT COUNT(*) AS n FROM members WHERE group_id=?", (group_id,)
+    ).fetchone()["n"]
     if have:
         print(f"members already present (count={have}); nothing to do")
         return 0
@@ -105,11 +180,186 @@ def cmd_seed_members(args):
     except Exception:
         MEMBERS = {}
     for k, v in MEMBERS.items():
-        db.execute("INSERT OR IGNORE INTO members(key, name, active) VALUES (?,?,1)", (k, v))
+        db.execute(
+            "INSERT OR IGNORE INTO members(group_id, key, name, active) VALUES (?,?,?,1)",
+            (group_id, k, v),
+        )
     db.commit()
     print(f"seeded {len(MEMBERS)} members")
     return 0
 
+@with_app_context
+def cmd_rebuild_ledger(args):
+    """Report where a group's credit_ledger drifted from compute_credits_all, then rebuild it."""
+    from credits import compute_credits_all, rebuild_ledger
+    db = get_db()
+    group_id = _group(db, args)
+    if group_id is None:
+        return 2
+    before = {r["member_key"]: r["credits"] for r in db.execute(
+        "SELECT member_key, credits FROM credit_ledger WHERE group_id=?", (group_id,)
+    ).fetchall()}
+    # Same rows the ledger counts: entries whose day never parsed are left out
+    rows = db.execute(
+        "SELECT day_iso AS day, member_key, role FROM entries "
+        "WHERE group_id=? AND day_iso IS NOT NULL", (group_id,)
+    ).fetchall()
+    expected = compute_credits_all(rows)
+    skipped = db.execute(
+        "SELECT COUNT(*) FROM entries WHERE group_id=? AND day_iso IS NULL", (group_id,)
+    ).fetchone()[0]
+    if skipped:
+        print(f"skipped {skipped} entries with an unparseable day (not in the ledger)")
+
+    drift = sorted(k for k in set(before) | set(expected) if before.get(k, 0) != expected.get(k, 0))
+    for k in drift:
+        print(f"drift: {k} ledger={before.get(k, 0)} expected={expected.get(k, 0)}")
+
+    with transaction(db):
+        totals = rebuild_ledger(db, group_id)
+    print(f"ledger rebuilt for {len(totals)} members ({len(drift)} drifted)")
+    return 0
+
+@with_app_context
+def cmd_export(args):
+    """Stream a group's entries to a CSV/NDJSON file (or stdout) with history()'s filters."""
+    import time
+    from datetime import date
+    from types import SimpleNamespace
+    from routes_history import EXPORT_FORMATS, export_query
+    try:
+        start = date.fromisoformat(args.start).isoformat() if args.start else None
+        end = date.fromisoformat(args.end).isoformat() if args.end else None
+    except ValueError as e:
+        print("bad date:", e, file=sys.stderr)
+        return 2
+    db = get_db()
+    group_id = _group(db, args)
+    if group_id is None:
+        return 2
+    encode, _mimetype = EXPORT_FORMATS[args.format]
+    sql, params = export_query(group_id, start, end,
+                               (args.member or "").upper(), (args.role or "").upper())
+
+    cur = db.execute(sql, params)
+    rows = 0
+    def fetchmany(size):
+        nonlocal rows
+        batch = cur.fetchmany(size)
+        rows += len(batch)
+        return batch
+
+    out = open(args.out, "w", newline="", encoding="utf-8") if args.out else sys.stdout
+    t0 = time.perf_counter()
+    nbytes = 0
+    try:
+        for chunk in encode(SimpleNamespace(fetchmany=fetchmany)):
+            out.write(chunk)
+            nbytes += len(chunk)
+    finally:
+        if args.out:
+            out.close()
+    secs = time.perf_counter() - t0
+    print(f"exported {rows} rows ({nbytes} chars) in {secs:.2f}s "
+          f"= {rows / secs if secs else 0:,.0f} rows/s", file=sys.stderr)
+    return 0
+
+IMPORT_BATCH = 5000
+IMPORT_MAX_ERRORS = 20
+
+class _Rollback(Exception):
+    """Raised inside the import transaction to discard it (errors or --dry-run)."""
+
+@with_app_context
+def cmd_import(args):
+    """
+    Upsert a group's entries from a CSV with columns day, member_key, role
+    and optional update_user, update_ts (the `export` format). Days may be ISO or the
+    legacy 'Jul 12, 2023, 12:00:00 AM' form. Everything goes in one
+    transaction; any invalid row aborts the whole import.
+    """
+    import csv
+    import time
+    from constants import ROLE_CHOICES
+    from credits import rebuild_ledger
+
+    db = get_db()
+    group_id = _group(db, args)
+    if group_id is None:
+        return 2
+    known_members = {r["key"] for r in db.execute(
+        "SELECT key FROM members WHERE group_id=?", (group_id,)
+    ).fetchall()}
+    upsert = (
+        "INSERT INTO entries(group_id, day, day_iso, member_key, role, update_user, update_ts, update_date) "
+        "VALUES (?6,?1,?1,?2,?3,?4,COALESCE(?5, CURRENT_TIMESTAMP),DATE(COALESCE(?5, CURRENT_TIMESTAMP))) "
+        "ON CONFLICT(group_id, day_iso, member_key) DO UPDATE SET "
+        "day=excluded.day, role=excluded.role, update_user=excluded.update_user, "
+        "update_ts=excluded.update_ts, update_date=excluded.update_date"
+    )
+
+    t0 = time.perf_counter()
+    total, inserted, errors = 0, 0, []
+    with open(args.csv, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        missing = {"day", "member_key", "role"} - set(reader.fieldnames or [])
+        if missing:
+            print("missing CSV columns:", ", ".join(sorted(missing)))
+            return 2
+        try:
+            with transaction(db, immediate=True), entries_bulk_load(db, group_id):
+                count = lambda: db.execute(
+                    "SELECT COUNT(*) FROM entries WHERE group_id=?", (group_id,)
+                ).fetchone()[0]
+                before = count()
+                batch = []
+                for lineno, rec in enumerate(reader, start=2):
+                    d = parse_day_value((rec.get("day") or "").strip())
+                    member = (rec.get("member_key") or "").strip().upper()
+                    role = (rec.get("role") or "").strip().upper()
+                    if d is None:
+                        errors.append(f"line {lineno}: unrecognized day {rec.get('day')!r}")
+                    elif member not in known_members:
+                        errors.append(f"line {lineno}: unknown member {member!r}")
+                    elif role not in ROLE_CHOICES:
+                        errors.append(f"line {lineno}: role {role!r} not one of {sorted(ROLE_CHOICES)}")
+                    if errors:
+                        if len(errors) >= IMPORT_MAX_ERRORS:
+                            break
+                        continue
+                    batch.append((d.isoformat(), member, role,
+                                  (rec.get("update_user") or "").strip() or "import",
+                                  (rec.get("update_ts") or "").strip() or None, group_id))
+                    if len(batch) >= IMPORT_BATCH:
+                        db.executemany(upsert, batch)
+                        total += len(batch)
+                        batch = []
+                if errors:
+                    raise _Rollback()
+                if batch:
+                    db.executemany(upsert, batch)
+                    total += len(batch)
+                inserted = count() - before
+                # Derived tables are rebuilt once: the ledger here, the rest
+                # (checkpoints, FTS, data version) when entries_bulk_load exits.
+                rebuild_ledger(db, group_id)
+                if args.dry_run:
+                    raise _Rollback()
+        except _Rollback:
+            pass
+
+    secs = time.perf_counter() - t0
+    if errors:
+        for e in errors:
+            print(e)
+        more = "+" if len(errors) >= IMPORT_MAX_ERRORS else ""
+        print(f"import aborted: {len(errors)}{more} invalid rows; nothing written")
+        return 1
+    print(f"{'dry run: would import' if args.dry_run else 'imported'} {total} rows "
+          f"({inserted} new, {total - inserted} updated) in {secs:.2f}s "
+          f"= {total / secs if secs else 0:,.0f} rows/s")
+    return 0
+
 @with_app_context
 def cmd_backup(args):
     """Make a SQLite online backup to the given output file."""
@@ -137,6 +387,132 @@ def cmd_vacuum(args):
     db.execute("VACUUM")
     print("VACUUM done")
 
+PROFILE_SAMPLE_MS = 1.0  # CPU time between stack samples for the collapsed-stack file
+
+
+def _fold_stack(frame) -> str:
+    """'outer;...;inner' for a frame, the collapsed-stack format flamegraph tools read."""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+def cmd_profile(args):
+    """
+    Profile one route through the Flask test client: cProfile over --repeat
+    requests (top functions printed, .prof written with --out), a second
+    stack-sampled pass for <out>.collapsed (flamegraph.pl / speedscope), and
+    optional tracemalloc peaks per request. Runs against the configured DB,
+    or a fresh synthetic one with --synthetic YEARS.
+    """
+    import cProfile
+    import pstats
+    import signal
+    import statistics
+    import tempfile
+    import time
+    import tracemalloc
+
+    if args.synthetic:
+        sys.path.insert(0, os.path.join(BASE_DIR, "bench"))
+        from common import generate
+        path = os.path.join(tempfile.mkdtemp(prefix="cespool-profile-"), "data.db")
+        n = generate(path, args.synthetic, args.members, legacy=args.legacy)
+        print(f"synthetic dataset: {n} entries ({args.synthetic}y x {args.members} members) -> {path}")
+        os.environ["CESPOOL_DB"] = path
+
+    app = create_app()
+    app.testing = True
+    if not args.page_cache:
+        from rendering import page_cache
+        page_cache.max_bytes = 0  # every request runs the view
+    with app.app_context():
+        user = get_db().execute(
+            "SELECT id, username, is_admin FROM users WHERE username=?", (args.user,)
+        ).fetchone()
+    if user is None:
+        print(f"no user {args.user!r} (see `manage.py users`)")
+        return 1
+
+    client = app.test_client()
+    client.environ_base["wsgi.url_scheme"] = "https"  # session cookies are Secure
+    with client.session_transaction() as sess:
+        # What a successful /login leaves in the session
+        sess.update(_user_id=str(user["id"]), _fresh=True, user_id=user["id"],
+                    username=user["username"], is_admin=user["is_admin"])
+        if args.member:
+            sess["member_key"] = args.member.upper()
+
+    query = "&".join(args.args or [])
+    url = f"{args.route}?{query}" if query else args.route
+    form = dict(kv.split("=", 1) for kv in args.form or [])
+
+    def call():
+        if form:
+            resp = client.post(url, data=form)
+        else:
+            resp = client.get(url)
+        resp.get_data()
+        return resp.status_code
+
+    status = call()  # warm-up: pool, templates, caches
+    print(f"{'POST' if form else 'GET'} {url} -> {status}, {args.repeat} requests")
+    if status >= 400:
+        return 1
+
+    prof = cProfile.Profile()
+    t0 = time.perf_counter()
+    prof.enable()
+    for _ in range(args.repeat):
+        call()
+    prof.disable()
+    elapsed = time.perf_counter() - t0
+    print(f"{elapsed / args.repeat * 1000:.2f} ms/request under cProfile\n")
+    stats = pstats.Stats(prof)
+    stats.strip_dirs().sort_stats(args.sort).print_stats(args.top)
+
+    if args.out:
+        prof.dump_stats(f"{args.out}.prof")
+        # SIGPROF fires every PROFILE_SAMPLE_MS of CPU time; its handler runs in
+        # this thread and sees the interrupted frame (Unix only)
+        counts = {}
+
+        def _sample(_signum, frame):
+            key = _fold_stack(frame)
+            counts[key] = counts.get(key, 0) + 1
+
+        old_handler = signal.signal(signal.SIGPROF, _sample)
+        signal.setitimer(signal.ITIMER_PROF, PROFILE_SAMPLE_MS / 1000, PROFILE_SAMPLE_MS / 1000)
+        try:
+            for _ in range(args.repeat):
+                call()
+        finally:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, old_handler)
+        with open(f"{args.out}.collapsed", "w") as f:
+            for stack, n in sorted(counts.items()):
+                f.write(f"{stack} {n}\n")
+        print(f"wrote {args.out}.prof (snakeviz, pstats) and {args.out}.collapsed "
+              f"({sum(counts.values())} samples; flamegraph.pl, speedscope)")
+
+    if args.tracemalloc:
+        peaks = []
+        tracemalloc.start()
+        for _ in range(args.repeat):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            call()
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.stop()
+        kib = sorted(p / 1024 for p in peaks)
+        print(f"tracemalloc peak per request: min {kib[0]:.1f} KiB, "
+              f"median {statistics.median(kib):.1f} KiB, max {kib[-1]:.1f} KiB")
+    return 0
+
+
 def main():
     p = argparse.ArgumentParser(prog="manage.py", description="CESpool maintenance CLI")
     sub = p.add_subparsers(dest="cmd", required=True)
@@ -148,10 +524,39 @@ def main():
     sp.add_argument("--username", required=True)
     sp.add_argument("--password", required=True)
     sp.add_argument("--admin", type=int, choices=[0,1], default=0, help="1=admin, 0=non-admin")
+    sp.add_argument("--group", default="default", help="slug of the user's carpool group")
     sp.set_defaults(func=cmd_set_user)
 
+    sub.add_parser("groups", help="List carpool groups").set_defaults(func=cmd_groups)
+    gp = sub.add_parser("add-group", help="Create/rename a carpool group and add members to it")
+    gp.add_argument("--slug", required=True)
+    gp.add_argument("--name", help="display name (default: the slug)")
+    gp.add_argument("--member", action="append", metavar="KEY=Name", help="member to add (repeatable)")
+    gp.set_defaults(func=cmd_add_group)
+
     sub.add_parser("migrate", help="Ensure schema + run lightweight migrations").set_defaults(func=cmd_migrate)
-    sub.add_parser("seed-members", help="Seed members table if empty").set_defaults(func=cmd_seed_members)
+    sp = sub.add_parser("seed-members", help="Seed a group's members if it has none")
+    sp.add_argument("--group", default="default")
+    sp.set_defaults(func=cmd_seed_members)
+    sp = sub.add_parser("rebuild-ledger", help="Recompute a group's credit ledger and verify it")
+    sp.add_argument("--group", default="default")
+    sp.set_defaults(func=cmd_rebuild_ledger)
+
+    ep = sub.add_parser("export", help="Stream entries as CSV or NDJSON")
+    ep.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    ep.add_argument("--out", help="output file (default: stdout)")
+    ep.add_argument("--start", help="YYYY-MM-DD, inclusive")
+    ep.add_argument("--end", help="YYYY-MM-DD, inclusive")
+    ep.add_argument("--member", help="member key, e.g. CA")
+    ep.add_argument("--role", choices=["D", "R", "O"])
+    ep.add_argument("--group", default="default")
+    ep.set_defaults(func=cmd_export)
+
+    ip = sub.add_parser("import", help="Bulk upsert entries from CSV in one transaction")
+    ip.add_argument("--csv", required=True, help="CSV with day,member_key,role[,update_user,update_ts]")
+    ip.add_argument("--dry-run", action="store_true", help="validate and time it, then roll back")
+    ip.add_argument("--group", default="default", help="slug of the group the rows belong to")
+    ip.set_defaults(func=cmd_import)
 
     bp = sub.add_parser("backup", help="Write a safe online backup of the DB")
     bp.add_argument("--out", default="data.backup.db")
@@ -160,6 +565,23 @@ def main():
     sub.add_parser("wal-checkpoint", help="Checkpoint WAL (TRUNCATE)").set_defaults(func=cmd_wal_checkpoint)
     sub.add_parser("vacuum", help="VACUUM the database").set_defaults(func=cmd_vacuum)
 
+    pp = sub.add_parser("profile", help="Profile a route through the test client (cProfile, flamegraph, tracemalloc)")
+    pp.add_argument("--route", required=True, help="path, e.g. /history")
+    pp.add_argument("--args", nargs="*", metavar="K=V", help="query string arguments")
+    pp.add_argument("--form", nargs="*", metavar="K=V", help="POST these form fields instead of GET")
+    pp.add_argument("--repeat", type=int, default=20)
+    pp.add_argument("--user", default="admin", help="profile as this user (no password needed)")
+    pp.add_argument("--member", help="member key for the session, e.g. CA (for /account)")
+    pp.add_argument("--synthetic", type=int, metavar="YEARS", help="profile against a fresh generated DB")
+    pp.add_argument("--members", type=int, default=3, help="members in the synthetic DB")
+    pp.add_argument("--legacy", type=float, default=0.2, help="share of legacy-format days in the synthetic DB")
+    pp.add_argument("--page-cache", action="store_true", help="leave the page cache on (repeats become hits)")
+    pp.add_argument("--sort", default="cumulative", help="pstats sort key")
+    pp.add_argument("--top", type=int, default=25)
+    pp.add_argument("--out", help="write <out>.prof and <out>.collapsed")
+    pp.add_argument("--tracemalloc", action="store_true", help="report allocation peak per request")
+    pp.set_defaults(func=cmd_profile)
+
     args = p.parse_args()
     sys.exit(args.func(args))
 
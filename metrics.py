@@ -0,0 +1,262 @@
+# metrics.py
+"""
+Prometheus text-format metrics at /metrics, kept in-process (no client
+library, no collector service).
+
+Each worker counts into its own registry. With CESPOOL_METRICS_DIR set, a
+worker also writes its registry to <dir>/<pid>-<start>.json (at most once per
+METRICS_FLUSH_SECS, and at exit) and /metrics sums every file there, so any
+worker answers for all of them. Files of exited workers are kept so counters
+never go backwards; empty the directory when the whole server restarts.
+Without the directory /metrics reports the answering process only.
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+
+from flask import Blueprint, Response, abort, g, request
+
+from constants import METRICS_DIR, METRICS_FLUSH_SECS, METRICS_TOKEN
+
+metricsbp = Blueprint("metricsbp", __name__)
+
+# Views whose requests are counted and timed (blueprint names)
+TRACKED_BLUEPRINTS = ("todaybp", "historybp", "adminbp", "accountbp", "authbp")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONNECT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+LOCK_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    "cespool_http_requests_total": (
+        "counter", "Requests to the app's views, by endpoint, method and status.", None),
+    "cespool_http_request_duration_seconds": (
+        "histogram", "Time until the response starts (first chunk of a streamed page), by endpoint.",
+        LATENCY_BUCKETS),
+    "cespool_db_connect_seconds": (
+        "histogram", "Opening a pooled SQLite connection (connect, pragmas, schema check).",
+        CONNECT_BUCKETS),
+    "cespool_db_queries_total": (
+        "counter", "SQL queries (execute()/executemany() calls) run for requests, by endpoint.", None),
+    "cespool_db_lock_wait_seconds": (
+        "histogram", "BEGIN IMMEDIATE waiting for the write lock.", LOCK_WAIT_BUCKETS),
+    "cespool_db_busy_retries_total": (
+        "counter", "BEGIN IMMEDIATE retries after SQLITE_BUSY (another writer held the lock).", None),
+    "cespool_db_busy_errors_total": (
+        "counter", "Requests that failed with 'database is locked' (busy_timeout ran out).", None),
+    "cespool_cache_hits_total": ("counter", "Cache lookups answered from the cache.", None),
+    "cespool_cache_misses_total": ("counter", "Cache lookups that had to do the work.", None),
+    "cespool_cache_hit_ratio": ("gauge", "hits / (hits + misses) since the workers started.", None),
+}
+
+
+# ---- Per-process registry ----------------------------------------------------
+_lock = threading.Lock()
+_counters = {}  # (name, labels) -> value; labels is a sorted tuple of (key, value)
+_histograms = {}  # (name, labels) -> [per-bucket counts..., +Inf count, sum]
+_state = {"file": None, "flushed": 0.0, "atexit": False}
+
+
+def _reset():
+    _counters.clear()
+    _histograms.clear()
+    _state.update(file=None, flushed=0.0)  # atexit handlers survive fork
+
+
+# A forked worker starts from zero instead of re-reporting the parent's counts
+os.register_at_fork(after_in_child=_reset)
+
+
+def inc(name: str, value: float = 1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, seconds: float, **labels):
+    buckets = METRICS[name][2]
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [0] * (len(buckets) + 2)
+        i = 0
+        while i < len(buckets) and seconds > buckets[i]:
+            i += 1
+        h[i] += 1
+        h[-1] += seconds
+
+
+def observe_lock_wait(seconds: float, retries: int = 0):
+    """Time spent in BEGIN IMMEDIATE (db.transaction(immediate=True)) and its SQLITE_BUSY retries."""
+    observe("cespool_db_lock_wait_seconds", seconds)
+    if retries:
+        inc("cespool_db_busy_retries_total", retries)
+
+
+def _cache_counters() -> list:
+    """Hit/miss totals of this process's caches, read from their own stats."""
+    from auth import user_cache_stats  # lazy imports to avoid circulars
+    from credits import timeline_cache_stats
+    from db import pool_stats
+    from rendering import page_cache
+
+    page, user, timeline = page_cache.snapshot(), user_cache_stats(), timeline_cache_stats()
+    pools = pool_stats()
+    caches = [
+        ("page", page["hits"], page["misses"]),
+        ("user", user["hits"], user["misses"]),
+        ("credit_timeline", timeline["hits"], timeline["misses"]),
+        ("db_pool", sum(p["hits"] for p in pools), sum(p["opens"] + p["waits"] for p in pools)),
+    ]
+    out = []
+    for cache, hits, misses in caches:
+        out.append(["cespool_cache_hits_total", {"cache": cache}, hits])
+        out.append(["cespool_cache_misses_total", {"cache": cache}, misses])
+    return out
+
+
+def snapshot() -> dict:
+    """This process's metrics as JSON-friendly lists (what goes into the shared dir)."""
+    with _lock:
+        counters = [[name, dict(labels), v] for (name, labels), v in _counters.items()]
+        histograms = [[name, dict(labels), list(h)] for (name, labels), h in _histograms.items()]
+    return {"pid": os.getpid(), "time": time.time(),
+            "counters": counters + _cache_counters(), "histograms": histograms}
+
+
+# ---- Shared directory (multi-process) ----------------------------------------
+def _own_file() -> str:
+    if _state["file"] is None:
+        _state["file"] = os.path.join(METRICS_DIR, f"{os.getpid()}-{int(time.time() * 1000)}.json")
+    return _state["file"]
+
+
+def flush(force: bool = False):
+    """Write this process's snapshot to the shared dir (throttled unless force)."""
+    if not METRICS_DIR:
+        return
+    now = time.monotonic()
+    if not force and now - _state["flushed"] < METRICS_FLUSH_SECS:
+        return
+    _state["flushed"] = now
+    path = _own_file()
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(snapshot(), f)
+    os.replace(tmp, path)  # readers never see a half-written file
+
+
+def _all_snapshots() -> list:
+    if not METRICS_DIR:
+        return [snapshot()]
+    flush(force=True)
+    snaps = []
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+        try:
+            with open(path) as f:
+                snaps.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # a worker replacing its file right now; it is in the next scrape
+    return snaps
+
+
+# ---- Exposition -----------------------------------------------------------------
+def _fmt_labels(labels: dict, extra: dict = None) -> str:
+    items = sorted(labels.items()) + sorted((extra or {}).items())
+    if not items:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+
+def _fmt_value(v: float) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def render_text() -> str:
+    """Every process's metrics summed, in Prometheus text format 0.0.4."""
+    counters, histograms = {}, {}
+    processes = 0
+    for snap in _all_snapshots():
+        processes += 1
+        for name, labels, v in snap["counters"]:
+            key = (name, tuple(sorted(labels.items())))
+            counters[key] = counters.get(key, 0) + v
+        for name, labels, h in snap["histograms"]:
+            key = (name, tuple(sorted(labels.items())))
+            have = histograms.get(key)
+            histograms[key] = h if have is None else [a + b for a, b in zip(have, h)]
+
+    for (name, labels), hits in list(counters.items()):
+        if name == "cespool_cache_hits_total":
+            misses = counters.get(("cespool_cache_misses_total", labels), 0)
+            if hits + misses:
+                counters[("cespool_cache_hit_ratio", labels)] = hits / (hits + misses)
+
+    lines = [
+        "# HELP cespool_processes Worker processes included in this scrape.",
+        "# TYPE cespool_processes gauge",
+        f"cespool_processes {processes}",
+    ]
+    for name, (mtype, help_text, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {mtype}")
+        if mtype != "histogram":
+            for (n, labels), v in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{name}{_fmt_labels(dict(labels))} {_fmt_value(v)}")
+            continue
+        for (n, labels), h in sorted(histograms.items()):
+            if n != name:
+                continue
+            labels = dict(labels)
+            cumulative = 0
+            for bound, count in zip(buckets + ("+Inf",), h):
+                cumulative += count
+                le = bound if isinstance(bound, str) else repr(bound)
+                lines.append(f"{name}_bucket{_fmt_labels(labels, {'le': le})} {cumulative}")
+            lines.append(f"{name}_sum{_fmt_labels(labels)} {_fmt_value(h[-1])}")
+            lines.append(f"{name}_count{_fmt_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+# ---- Request hooks ----------------------------------------------------------------
+def _request_started():
+    g.request_t0 = time.perf_counter()
+
+
+def _request_finished(resp):
+    t0 = g.get("request_t0")
+    if t0 is not None and request.blueprint in TRACKED_BLUEPRINTS:
+        endpoint = request.endpoint
+        inc("cespool_http_requests_total", endpoint=endpoint, method=request.method,
+            status=str(resp.status_code))
+        observe("cespool_http_request_duration_seconds", time.perf_counter() - t0,
+                endpoint=endpoint)
+    flush()
+    return resp
+
+
+def init_app(app):
+    """Count and time requests to the tracked blueprints and serve /metrics."""
+    app.before_request(_request_started)
+    app.after_request(_request_finished)
+    app.register_blueprint(metricsbp)
+    if METRICS_DIR:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        if not _state["atexit"]:
+            atexit.register(flush, force=True)
+            _state["atexit"] = True
+
+
+@metricsbp.route("/metrics")
+def metrics():
+    # Optional shared secret for the scraper (Authorization: Bearer <token>)
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        abort(403)
+    return Response(render_text(), mimetype="text/plain; version=0.0.4")
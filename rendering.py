@@ -0,0 +1,181 @@
+# rendering.py
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timezone
+from functools import wraps
+from hashlib import sha1
+
+from flask import Response, current_app, g, make_response, request, session, stream_with_context
+from flask_login import current_user
+
+from constants import PAGE_CACHE_BYTES, PAGE_CACHE_ENTRIES
+from db import get_db, data_stamp, db_path, hold_db_for_stream
+from auth import current_group_id
+
+STREAM_BUFFER = 64  # template output events per chunk sent to the client
+
+
+def stream_page(name: str, **context) -> Response:
+    """
+    Render a registered template as a streamed response: the page header goes out
+    right away and table rows follow as they are produced. Pass generators
+    (e.g. over db.iter_rows) for the big collections to keep memory flat.
+    """
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER)
+    resp = Response(stream_with_context(hold_db_for_stream(stream)), mimetype="text/html")
+    resp.headers["X-Accel-Buffering"] = "no"  # keep nginx from collecting the whole body
+    return resp
+
+
+# ---- Conditional GET (ETag / Last-Modified) ----------------------------------
+
+def view_key() -> tuple:
+    """
+    Everything besides the data that changes a read-only page: the user's
+    group, the path, the query args (order-insensitive), the admin flag
+    behind the nav and the 7-day edit lock, and today's date (default day,
+    lock cutoff).
+    """
+    return (
+        current_group_id(),
+        request.path,
+        tuple(sorted(request.args.items(multi=True))),
+        bool(getattr(current_user, "is_admin", False)),
+        date.today().isoformat(),
+    )
+
+
+def request_stamp() -> tuple:
+    """
+    db.data_stamp() of the user's group, read once per request
+    (conditional_get and cached_page share it).
+    """
+    if "data_stamp" not in g:
+        g.data_stamp = data_stamp(get_db(), current_group_id())
+    return g.data_stamp
+
+
+def _cacheable_request() -> bool:
+    # A pending flash message is shown (and consumed) by the next render
+    return request.method in ("GET", "HEAD") and not session.get("_flashes")
+
+
+def conditional_get(view):
+    """
+    ETag/Last-Modified for a read-only view, from db.data_stamp(). A reload
+    with nothing changed gets a 304 after one read of the meta table, before
+    the view runs. The stamp lives in the DB, so every worker agrees on it.
+    """
+    @wraps(view)
+    def _wrap(*args, **kwargs):
+        if not _cacheable_request():
+            return view(*args, **kwargs)
+        version, changed = request_stamp()
+        etag = sha1(repr((version, view_key())).encode()).hexdigest()[:20]
+        midnight = time.mktime(date.today().timetuple())
+        last_modified = datetime.fromtimestamp(max(changed, midnight), tz=timezone.utc)
+
+        if request.if_none_match:
+            fresh = request.if_none_match.contains_weak(etag)
+        else:
+            fresh = bool(request.if_modified_since and request.if_modified_since >= last_modified)
+        resp = Response(status=304) if fresh else make_response(view(*args, **kwargs))
+        if resp.status_code in (200, 304):
+            resp.set_etag(etag, weak=True)
+            resp.last_modified = last_modified
+            # Per-session content: browsers may keep it but must revalidate
+            resp.headers["Cache-Control"] = "private, no-cache"
+            resp.vary.add("Cookie")
+        return resp
+    return _wrap
+
+
+# ---- Rendered-page cache -----------------------------------------------------
+# Identical read-only pages are shared between users with the same view_key().
+# Entries carry the data version they were rendered at. Versions are per
+# (db path, group) scope: a write bumps its group's version, and the first
+# request that sees the new one drops that scope's stale pages only.
+
+class PageCache:
+    def __init__(self, max_bytes: int, max_entries: int):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._pages = OrderedDict()  # (scope, view key) -> (version, mimetype, body)
+        self._versions = {}          # scope -> newest version seen
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+
+    def _drop(self, key):
+        _v, _m, body = self._pages.pop(key)
+        self._bytes -= len(body)
+
+    def _check_version(self, scope: tuple, version: int):
+        if self._versions.get(scope) != version:
+            stale = [k for k, v in self._pages.items() if k[0] == scope and v[0] != version]
+            for k in stale:
+                self._drop(k)
+            self.stats["invalidations"] += len(stale)
+            self._versions[scope] = version
+
+    def get(self, scope: tuple, key: tuple, version: int):
+        with self._lock:
+            self._check_version(scope, version)
+            hit = self._pages.get((scope, key))
+            if hit is None:
+                self.stats["misses"] += 1
+                return None
+            self._pages.move_to_end((scope, key))
+            self.stats["hits"] += 1
+            return hit[1], hit[2]
+
+    def put(self, scope: tuple, key: tuple, version: int, mimetype: str, body: bytes):
+        if len(body) > self.max_bytes // 4:
+            return  # one huge page shouldn't flush everything else
+        with self._lock:
+            self._check_version(scope, version)
+            if (scope, key) in self._pages:
+                self._drop((scope, key))
+            self._pages[(scope, key)] = (version, mimetype, body)
+            self._bytes += len(body)
+            self.stats["stores"] += 1
+            while self._pages and (self._bytes > self.max_bytes or len(self._pages) > self.max_entries):
+                self._drop(next(iter(self._pages)))
+                self.stats["evictions"] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {"entries": len(self._pages), "bytes": self._bytes,
+                    "max_bytes": self.max_bytes, "max_entries": self.max_entries,
+                    "hit_ratio": self.stats["hits"] / lookups if lookups else None,
+                    **self.stats}
+
+
+page_cache = PageCache(PAGE_CACHE_BYTES, PAGE_CACHE_ENTRIES)
+
+
+def cached_page(view):
+    """
+    Serve a read-only view from page_cache when the same page (view_key())
+    was rendered at the current data version; store plain 200 HTML otherwise.
+    Streamed responses and requests with pending flashes are left alone.
+    """
+    @wraps(view)
+    def _wrap(*args, **kwargs):
+        if not _cacheable_request():
+            return view(*args, **kwargs)
+        scope, key, (version, _changed) = (db_path(), current_group_id()), view_key(), request_stamp()
+        hit = page_cache.get(scope, key, version)
+        if hit is not None:
+            mimetype, body = hit
+            return Response(body, mimetype=mimetype)
+        resp = make_response(view(*args, **kwargs))
+        if resp.status_code == 200 and not resp.is_streamed:
+            page_cache.put(scope, key, version, resp.mimetype, resp.get_data())
+        return resp
+    return _wrap
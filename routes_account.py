@@ -1,37 +1,25 @@
 # routes_account.py
-from flask import Blueprint, render_template_string, session, request, redirect, url_for, flash
-from datetime import date, datetime
+from flask import Blueprint, render_template, session, request, redirect, url_for, flash
+from datetime import date
 from hashlib import sha256
 
-from db import get_db
-from auth import login_required
-from constants import MILES_PER_RIDE, MEMBERS, GAS_PRICE, AVG_MPG
-from templates import BASE_TMPL
+from db import get_db, active_members
+from auth import login_required, invalidate_user_cache, current_group_id
+from constants import MILES_PER_RIDE, GAS_PRICE, AVG_MPG
+from credits import credits_before
 
 accountbp = Blueprint("accountbp", __name__)
 
-def _day_to_date(val):
-    if isinstance(val, date): return val
-    s = str(val or "")
-    try:
-        return datetime.strptime(s[:10], "%Y-%m-%d").date()
-    except Exception:
-        pass
-    try:
-        return datetime.strptime(s.replace(",", ""), "%b %d %Y %I:%M:%S %p").date()
-    except Exception:
-        pass
-    return date.today()
-
-def _infer_member_key():
+def _infer_member_key(members):
+    names = {m["key"]: m["name"] for m in members}
     # Prefer explicit member_key if already stored
     mk = (session.get("member_key") or "").strip().upper()
-    if mk in MEMBERS:
+    if mk in names:
         return mk
     # Fallback: infer from username
     uname = (session.get("username") or "").strip().lower()
     if uname:
-        for k, v in MEMBERS.items():
+        for k, v in names.items():
             if v.strip().lower() == uname:
                 session["member_key"] = k
                 return k
@@ -63,46 +51,32 @@ def account():
             (sha256(pw1.encode()).hexdigest(), username)
         )
         db.commit()
+        invalidate_user_cache()
         flash("Password updated.")
         return redirect(url_for("accountbp.account"))
 
     # --- Build stats (only days with a Driver, up to today) ---
-    user_key = _infer_member_key()
+    group_id = current_group_id()
+    members = active_members(db, group_id)
+    user_key = _infer_member_key(members)
     # If still unknown, show a one-time picker
     if not user_key:
-        pick_tmpl = """
-        {% extends 'BASE_TMPL' %}{% block content %}
-          <h3>Account</h3>
-          <div class="card">
-            <h5>Who are you?</h5>
-            <form method="post" action="{{ url_for('accountbp.account') }}">
-              <label class="form-label">Member</label>
-              <select name="member_key" class="form-select" required>
-                {% for k, v in members.items() %}
-                  <option value="{{k}}">{{k}} — {{v}}</option>
-                {% endfor %}
-              </select>
-              <input type="hidden" name="pw1" value="">
-              <input type="hidden" name="pw2" value="">
-              <button class="btn btn-primary mt-2">Continue</button>
-            </form>
-          </div>
-        {% endblock %}
-        """
         # store pick if posted
         mk = (request.form.get("member_key") or "").strip().upper()
-        if mk in MEMBERS:
+        if mk in {m["key"] for m in members}:
             session["member_key"] = mk
             return redirect(url_for("accountbp.account"))
-        return render_template_string(pick_tmpl, BASE_TMPL=BASE_TMPL, members=MEMBERS)
+        return render_template("ACCOUNT_PICK_TMPL", members=members)
 
     # Pull all entries up to today (entries: day, member_key, role)
-    rows = db.execute("SELECT day, member_key, role FROM entries WHERE day <= DATE('now')").fetchall()
+    rows = db.execute(
+        "SELECT day_iso, member_key, role FROM entries WHERE group_id = ? AND day_iso <= DATE('now')",
+        (group_id,)
+    ).fetchall()
 
     by_day = {}
     for r in rows:
-        d = _day_to_date(r["day"])
-        by_day.setdefault(d, {})[r["member_key"]] = r["role"]
+        by_day.setdefault(r["day_iso"], {})[r["member_key"]] = r["role"]
     valid_days = {d: roles for d, roles in by_day.items() if "D" in roles.values()}
 
     drives = rides = offs = 0
@@ -112,42 +86,16 @@ def account():
         elif role == "R": rides += 1
         elif role == "O": offs += 1
 
+    # Same figure the Today page shows next to the name
+    credits = credits_before(db, group_id, date.today()).get(user_key, 0)
+
     miles = rides * MILES_PER_RIDE
     gallons = miles / AVG_MPG if AVG_MPG else 0
     gas_savings = gallons * GAS_PRICE
 
-    tmpl = """
-    {% extends 'BASE_TMPL' %}{% block content %}
-      <h3>Account</h3>
-
-
-        <div class="ms-3 card p-3 mb-3">
-        <h3>Stats</h3>
-            <div style="margin-left: 2em;">
-                <p><strong>Drives: </strong> {{ drives }}</p>
-                <p><strong>Rides: </strong> {{ rides }}</p>
-                <p><strong>Off: </strong> {{ offs }}</p>
-                <p><strong>Miles (est. as passenger): </strong> {{ miles }}</p>
-                <p><strong>Gas Savings (est.): </strong>
-                   ${{ "%.2f"|format(gas_savings) }}
-                   <div style="margin-left: 2em;">
-                    <p><i><small>( {{ miles }} ÷ {{ avg_mpg }} mpg × ${{ gas_price }}/gal and {{ miles_per_ride }} miles per day saved.</i></small>)
-                    </p></div>
-            </div
-      </div>
-
-      <form method="post" class="card">
-        <h5>Change password</h5>
-        <label>New password<br><input type="password" name="pw1" required></label><br><br>
-        <label>Confirm password<br><input type="password" name="pw2" required></label><br><br>
-        <button class="btn btn-primary">Change password</button>
-      </form>
-    {% endblock %}
-    """
-    return render_template_string(
-        tmpl,
-        BASE_TMPL=BASE_TMPL,
-        drives=drives, rides=rides, offs=offs,
+    return render_template(
+        "ACCOUNT_TMPL",
+        drives=drives, rides=rides, offs=offs, credits=credits,
         miles=miles, gas_savings=gas_savings,
         avg_mpg=AVG_MPG, gas_price=GAS_PRICE, miles_per_ride=MILES_PER_RIDE
     )
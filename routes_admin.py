@@ -1,50 +1,37 @@
 # routes_admin.py
 import os
+import re
+import sqlite3
 import time
-from collections import defaultdict
-from datetime import datetime, date
 
 from flask import (
-    Blueprint, render_template_string, request, redirect,
-    url_for, session, abort, flash
+    Blueprint, render_template, request, redirect,
+    url_for, abort, flash
 )
 
-from db import get_db
-from auth import login_required
+from constants import SQL_TRACE
+from db import (
+    audit_fts_range, get_db, has_audit_fts, iter_rows, pool_stats, slowest_queries,
+    trace_window,
+    active_members, role_pivot_columns,
+)
+from rendering import stream_page, page_cache
+from routes_history import iso_arg
+from auth import (
+    login_required, invalidate_user_cache, user_cache_stats, current_group_id, current_user,
+)
 
 adminbp = Blueprint("adminbp", __name__)
 
 
-# --- Utilities ----------------------------------------------------------------
-def _day_to_date(val) -> date:
-    """Parse various day formats to a date; fallback to today."""
-    if isinstance(val, date):
-        return val
-    s = str(val or "")
-    # Prefer ISO yyyy-mm-dd
-    try:
-        return datetime.strptime(s[:10], "%Y-%m-%d").date()
-    except Exception:
-        pass
-    # Secondary format like: "Aug 24 2025 01:23:45 PM"
-    try:
-        return datetime.strptime(s.replace(",", ""), "%b %d %Y %I:%M:%S %p").date()
-    except Exception:
-        pass
-    return date.today()
-
-
 # --- Admin guard for this blueprint -------------------------------------------
 @adminbp.before_request
 def _require_admin():
     # must be logged in
-    if not session.get("user_id"):
+    if not current_user.is_authenticated:
         return redirect(url_for("authbp.login", next=request.path))
-    # must be admin
-    try:
-        if int(session.get("is_admin", 0)) != 1:
-            abort(403)
-    except Exception:
+    # must be admin (from the users row via load_user, so a demotion applies at once)
+    if not current_user.is_admin:
         abort(403)
 
 
@@ -53,11 +40,12 @@ def _require_admin():
 @login_required
 def admin_users():
     """
-    Add new users, reset passwords, and toggle admin.
+    Add new users, reset passwords, and toggle admin, within the admin's group.
     NOTE: uses raw SHA-256 to match your current DB; you can
     later switch to PBKDF2 in both auth.py and here.
     """
     db = get_db()
+    group_id = current_group_id()
 
     if request.method == "POST":
         action = (request.form.get("action") or "").strip()
@@ -77,19 +65,28 @@ def admin_users():
         from hashlib import sha256
         pw_hash = sha256(password.encode()).hexdigest()
 
+        # Usernames are global (one login page); never take over another group's user
+        owner = db.execute("SELECT group_id FROM users WHERE username=?", (username,)).fetchone()
+        if owner is not None and owner["group_id"] != group_id:
+            flash(f"Username '{username}' is taken.", "error")
+            return redirect(url_for("adminbp.admin_users"))
+
         if action == "add":
             db.execute(
-                "INSERT OR REPLACE INTO users(username, password_hash, is_admin) VALUES (?,?,?)",
-                (username, pw_hash, is_admin),
+                "INSERT OR REPLACE INTO users(username, password_hash, is_admin, group_id) "
+                "VALUES (?,?,?,?)",
+                (username, pw_hash, is_admin, group_id),
             )
             db.commit()
+            invalidate_user_cache()
             flash(f"User '{username}' saved.", "info")
         elif action == "reset":
             db.execute(
-                "UPDATE users SET password_hash=?, is_admin=? WHERE username=?",
-                (pw_hash, is_admin, username),
+                "UPDATE users SET password_hash=?, is_admin=? WHERE username=? AND group_id=?",
+                (pw_hash, is_admin, username, group_id),
             )
             db.commit()
+            invalidate_user_cache()
             flash(f"User '{username}' updated.", "info")
         else:
             flash("Unknown action.", "error")
@@ -97,215 +94,130 @@ def admin_users():
         return redirect(url_for("adminbp.admin_users"))
 
     users = db.execute(
-        "SELECT id, username, is_admin FROM users ORDER BY username"
+        "SELECT id, username, is_admin FROM users WHERE group_id=? ORDER BY username", (group_id,)
     ).fetchall()
 
-    tmpl = """
-    {% extends 'BASE_TMPL' %}{% block content %}
-      <h3>Users</h3>
-
-      <div class='card'>
-        <h5>Add / Update</h5>
-        <form method='post' class="row gy-2 align-items-end">
-          <input type='hidden' name='action' value='add'>
-          <div class="col-auto">
-            <label class="form-label">Username
-              <input class="form-control" name='username' required>
-            </label>
-          </div>
-          <div class="col-auto">
-            <label class="form-label">Password
-              <input class="form-control" name='password' type='password' required>
-            </label>
-          </div>
-          <div class="col-auto form-check mt-4">
-            <input class="form-check-input" type='checkbox' name='is_admin' id="add_admin">
-            <label class="form-check-label" for="add_admin">Admin</label>
-          </div>
-          <div class="col-auto">
-            <button class="btn btn-primary">Save</button>
-          </div>
-        </form>
-      </div>
-
-      <br>
-
-      <div class='card'>
-        <h5>Reset Password / Toggle Admin</h5>
-        <form method='post' class="row gy-2 align-items-end">
-          <input type='hidden' name='action' value='reset'>
-          <div class="col-auto">
-            <label class="form-label">Username
-              <select class="form-select" name='username'>
-                {% for u in users %}
-                  <option value='{{u["username"]}}'>{{u["username"]}}</option>
-                {% endfor %}
-              </select>
-            </label>
-          </div>
-          <div class="col-auto">
-            <label class="form-label">New Password
-              <input class="form-control" name='password' type='password' required>
-            </label>
-          </div>
-          <div class="col-auto form-check mt-4">
-            <input class="form-check-input" type='checkbox' name='is_admin' id="reset_admin">
-            <label class="form-check-label" for="reset_admin">Admin</label>
-          </div>
-          <div class="col-auto">
-            <button class="btn btn-primary">Update</button>
-          </div>
-        </form>
-      </div>
-
-      <br>
-
-      <table class="table table-sm">
-        <thead><tr><th>User</th><th>Admin</th></tr></thead>
-        <tbody>
-          {% for u in users %}
-            <tr>
-              <td>{{ u['username'] }}</td>
-              <td>{{ 'Yes' if u['is_admin'] else 'No' }}</td>
-            </tr>
-          {% endfor %}
-          {% if not users %}
-            <tr><td colspan="2" class="text-center text-muted">No users</td></tr>
-          {% endif %}
-        </tbody>
-      </table>
-    {% endblock %}
-    """
-    from templates import BASE_TMPL
-    return render_template_string(tmpl, users=users, BASE_TMPL=BASE_TMPL)
+    return render_template("ADMIN_USERS_TMPL", users=users)
 
 
 # --- Audit view ----------------------------------------------------------------
+AUDIT_PAGE_SIZE = 100
+
+# Same text the search used to match against, built in SQL for the LIKE fallback
+_AUDIT_BLOB = (
+    "(day || ' ' || member_key || ' ' || role || ' ' || COALESCE(update_user,'') || ' ' || "
+    "COALESCE(update_date,'') || ' ' || COALESCE(update_ts,''))"
+)
+
+
+def _parse_cursor(val: str):
+    """'<update_ts>|<id>' -> (update_ts, id), or None."""
+    ts, sep, rid = (val or "").rpartition("|")
+    return (ts, int(rid)) if sep and rid.isdigit() else None
+
+
+def audit_page_query(db, group_id, q="", member="", role="", start=None, end=None,
+                     before=None, after=None, limit=AUDIT_PAGE_SIZE):
+    """
+    SQL + params for one page of a group's audit rows, newest update first,
+    walking the (group_id, update_ts) index. Search uses the group's slice of
+    the entries_fts trigram index for 3+ chars and a LIKE over the same
+    fields otherwise (or when FTS is unavailable).
+    `start`/`end` are ISO day strings. `before`/`after` are (update_ts, id)
+    keyset cursors; `after` pages come back ascending. Pass limit=None for
+    every match.
+    """
+    sql = """
+        SELECT id, day, day_iso, member_key, role,
+               COALESCE(update_user,'') AS update_user,
+               COALESCE(update_date,'') AS update_date,
+               COALESCE(update_ts,'')   AS update_ts
+        FROM entries
+        WHERE group_id = ?
+    """
+    params = [group_id]
+    if member:
+        sql += " AND member_key = ?"
+        params.append(member)
+    if role in ("D", "R", "O"):
+        sql += " AND role = ?"
+        params.append(role)
+    if start:
+        sql += " AND day_iso >= ?"
+        params.append(start)
+    if end:
+        sql += " AND day_iso <= ?"
+        params.append(end)
+    if q:
+        if len(q) >= 3 and has_audit_fts(db):
+            # Bounded to the group's rowid range, so other groups' postings are skipped
+            lo, hi = audit_fts_range(group_id)
+            sql += (" AND id IN (SELECT rowid - ? FROM entries_fts"
+                    " WHERE entries_fts MATCH ? AND rowid BETWEEN ? AND ?)")
+            params.extend([lo, '"' + q.replace('"', '""') + '"', lo, hi])
+        else:
+            sql += f" AND {_AUDIT_BLOB} LIKE ? ESCAPE '\\'"
+            params.append("%" + re.sub(r"([%_\\])", r"\\\1", q) + "%")
+    # The plain range term lets SQLite seek the index; the row value breaks ties
+    if before:
+        sql += " AND COALESCE(update_ts, '') <= ? AND (COALESCE(update_ts, ''), id) < (?, ?)"
+        params.extend([before[0], *before])
+    elif after:
+        sql += " AND COALESCE(update_ts, '') >= ? AND (COALESCE(update_ts, ''), id) > (?, ?)"
+        params.extend([after[0], *after])
+    direction = "ASC" if after else "DESC"
+    sql += f" ORDER BY COALESCE(update_ts, '') {direction}, id {direction}"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit + 1)
+    return sql, params
+
+
 @adminbp.route("/admin/audit")
 @login_required
 def admin_audit():
     db = get_db()
+    group_id = current_group_id()
 
     # Query params
     q = (request.args.get("q") or "").strip()
     member = (request.args.get("member") or "").strip().upper()
     role = (request.args.get("role") or "").strip().upper()
-    start = (request.args.get("start") or "").strip()  # YYYY-MM-DD
-    end   = (request.args.get("end") or "").strip()    # YYYY-MM-DD
-
-    rows = db.execute("""
-        SELECT day, member_key, role,
-               COALESCE(update_user,'') AS update_user,
-               COALESCE(update_date,'') AS update_date,
-               COALESCE(update_ts,'')   AS update_ts
-        FROM entries
-    """).fetchall()
-
-    # Convert + filter in Python (supports non-ISO day formats)
-    out = []
-    start_d = datetime.strptime(start, "%Y-%m-%d").date() if start else None
-    end_d   = datetime.strptime(end,   "%Y-%m-%d").date() if end   else None
-
-    for r in rows:
-        d = _day_to_date(r["day"])
-        if member and r["member_key"] != member:
-            continue
-        if role in ("D", "R", "O") and r["role"] != role:
-            continue
-        if start_d and d < start_d:
-            continue
-        if end_d and d > end_d:
-            continue
-        if q:
-            blob = f"{r['day']} {r['member_key']} {r['role']} {r['update_user']} {r['update_date']} {r['update_ts']}"
-            if q.lower() not in blob.lower():
-                continue
-        out.append(r)
-
-    # Sort by update_ts (desc), then by day (desc)
-    def _sort_key(r):
-        uts = str(r["update_ts"] or "")
-        try:
-            ts = datetime.strptime(uts[:19], "%Y-%m-%d %H:%M:%S")
-        except Exception:
-            ts = datetime.min
-        return (ts, _day_to_date(r["day"]))
-    out.sort(key=_sort_key, reverse=True)
-
-    tmpl = """
-    {% extends 'BASE_TMPL' %}{% block content %}
-      <h3>Audit History</h3>
-
-      <form class="row g-2 align-items-end mb-3" method="get">
-        <div class="col-auto">
-          <label class="form-label">Member</label>
-          <select name="member" class="form-select">
-            <option value="">(all)</option>
-            <option value="CA" {{ 'selected' if request.args.get('member')=='CA' else '' }}>CA</option>
-            <option value="ER" {{ 'selected' if request.args.get('member')=='ER' else '' }}>ER</option>
-            <option value="SJ" {{ 'selected' if request.args.get('member')=='SJ' else '' }}>SJ</option>
-          </select>
-        </div>
-        <div class="col-auto">
-          <label class="form-label">Role</label>
-          <select name="role" class="form-select">
-            <option value="">(all)</option>
-            <option value="D" {{ 'selected' if request.args.get('role')=='D' else '' }}>Driver</option>
-            <option value="R" {{ 'selected' if request.args.get('role')=='R' else '' }}>Rider</option>
-            <option value="O" {{ 'selected' if request.args.get('role')=='O' else '' }}>Off</option>
-          </select>
-        </div>
-        <div class="col-auto">
-          <label class="form-label">From</label>
-          <input class="form-control" type="date" name="start" value="{{ request.args.get('start','') }}">
-        </div>
-        <div class="col-auto">
-          <label class="form-label">To</label>
-          <input class="form-control" type="date" name="end" value="{{ request.args.get('end','') }}">
-        </div>
-        <div class="col-auto">
-          <label class="form-label">Search</label>
-          <input class="form-control" name="q" value="{{ request.args.get('q','') }}" placeholder="day/user/date/timestamp">
-        </div>
-        <div class="col-auto">
-          <button class="btn btn-primary">Filter</button>
-          <a class="btn btn-secondary" href="{{ url_for('adminbp.admin_audit') }}">Reset</a>
-        </div>
-      </form>
-
-      <div class="table-scroll">
-        <table class="table table-sm table-sticky align-middle">
-          <thead>
-            <tr>
-              <th>Day</th>
-              <th>Member</th>
-              <th>Role</th>
-              <th>Update User</th>
-              <th>Update Date</th>
-              <th>Update Timestamp</th>
-            </tr>
-          </thead>
-          <tbody>
-            {% for r in rows %}
-              <tr>
-                <td>{{ r['day'] }}</td>
-                <td>{{ r['member_key'] }}</td>
-                <td>{{ 'Driver' if r['role']=='D' else 'Rider' if r['role']=='R' else 'Off' }}</td>
-                <td>{{ r['update_user'] }}</td>
-                <td>{{ r['update_date'] }}</td>
-                <td><code>{{ r['update_ts'] }}</code></td>
-              </tr>
-            {% endfor %}
-            {% if not rows %}
-              <tr><td colspan="6" class="text-center text-muted">No results</td></tr>
-            {% endif %}
-          </tbody>
-        </table>
-      </div>
-    {% endblock %}
-    """
-    from templates import BASE_TMPL
-    return render_template_string(tmpl, rows=out, BASE_TMPL=BASE_TMPL)
+    start  = iso_arg("start")  # YYYY-MM-DD; invalid dates are ignored
+    end    = iso_arg("end")
+    before = _parse_cursor(request.args.get("before"))
+    after = None if before else _parse_cursor(request.args.get("after"))
+    stream_all = request.args.get("all") == "1"
+
+    filters = {k: request.args[k] for k in ("q", "member", "role", "start", "end") if request.args.get(k)}
+    older_url = newer_url = None
+
+    # All filtering, ordering and paging happens in SQL
+    if stream_all:
+        # Every match, rendered while it is fetched
+        sql, params = audit_page_query(db, group_id, q, member, role, start, end, limit=None)
+        out = iter_rows(db.execute(sql, params))
+    else:
+        sql, params = audit_page_query(db, group_id, q, member, role, start, end, before, after)
+        out = db.execute(sql, params).fetchall()
+        has_more = len(out) > AUDIT_PAGE_SIZE
+        out = out[:AUDIT_PAGE_SIZE]
+        if after:
+            out.reverse()
+
+    if not stream_all and out:
+        if has_more or after:
+            last = out[-1]
+            older_url = url_for("adminbp.admin_audit", before=f"{last['update_ts']}|{last['id']}", **filters)
+        if before or (after and has_more):
+            first = out[0]
+            newer_url = url_for("adminbp.admin_audit", after=f"{first['update_ts']}|{first['id']}", **filters)
+
+    ctx = dict(rows=out, older_url=older_url, newer_url=newer_url,
+               stream_all=stream_all, filters=filters, members=active_members(db, group_id))
+    if stream_all:
+        return stream_page("AUDIT_TMPL", **ctx)
+    return render_template("AUDIT_TMPL", **ctx)
 
 
 # --- Diagnostics ---------------------------------------------------------------
@@ -313,6 +225,7 @@ def admin_audit():
 @login_required
 def admin_diag():
     db = get_db()
+    group_id = current_group_id()
 
     # Find SQLite main path
     main_path = None
@@ -328,94 +241,76 @@ def admin_diag():
     size = os.path.getsize(main_path) if exists else 0
     mtime = os.path.getmtime(main_path) if exists else 0
 
-    rows = db.execute(
-        "SELECT day, member_key, role, update_user, update_ts FROM entries"
-    ).fetchall()
-    n_entries = len(rows)
-
-    # Compute day stats
-    by_day = defaultdict(lambda: {"CA": None, "ER": None, "SJ": None})
-    day_set = set()
-    for r in rows:
-        d = r["day"]
-        d = _day_to_date(d) if not isinstance(d, date) else d
-        day_set.add(d)
-        by_day[d][r["member_key"]] = r["role"]
-
-    n_days = len(day_set)
-    min_day = f"{min(day_set):%Y-%m-%d}" if day_set else "n/a"
-    max_day = f"{max(day_set):%Y-%m-%d}" if day_set else "n/a"
-
-    per_year = []
-    year_map = defaultdict(int)
-    for d in day_set:
-        year_map[d.year] += 1
-    for y in sorted(year_map):
-        per_year.append({"y": y, "days": year_map[y]})
-
-    newest_days = sorted(day_set, reverse=True)[:25]
-    oldest_days = sorted(day_set)[:25]
-    newest = [
-        {"day": f"{d:%Y-%m-%d}", "CA": by_day[d]["CA"], "ER": by_day[d]["ER"], "SJ": by_day[d]["SJ"]}
-        for d in newest_days
-    ]
-    oldest = [
-        {"day": f"{d:%Y-%m-%d}", "CA": by_day[d]["CA"], "ER": by_day[d]["ER"], "SJ": by_day[d]["SJ"]}
-        for d in oldest_days
-    ]
+    # Every figure below is an aggregate or an indexed LIMIT over the admin's
+    # group (storage/engine health is for the whole file); each one is timed
+    timings = []
+
+    def q(label, sql, params=()):
+        t0 = time.perf_counter()
+        rows = db.execute(sql, params).fetchall()
+        timings.append({"label": label, "ms": (time.perf_counter() - t0) * 1000, "rows": len(rows)})
+        return rows
+
+    scope = (group_id,)
+    n_entries = q("entry count", "SELECT COUNT(*) FROM entries WHERE group_id=?", scope)[0][0]
+    # MIN and MAX on their own are single index seeks
+    min_day = q("first day", "SELECT MIN(day_iso) FROM entries WHERE group_id=?", scope)[0][0] or "n/a"
+    max_day = q("last day", "SELECT MAX(day_iso) FROM entries WHERE group_id=?", scope)[0][0] or "n/a"
+    n_unparsed = q("rows without day_iso",
+                   "SELECT COUNT(*) FROM entries WHERE group_id=? AND day_iso IS NULL", scope)[0][0]
+
+    per_year = [{"y": int(r[0]), "days": r[1]} for r in q(
+        "days per year",
+        "SELECT substr(day_iso, 1, 4) AS y, COUNT(*) FROM "
+        "(SELECT DISTINCT day_iso FROM entries WHERE group_id=? AND day_iso IS NOT NULL) "
+        "GROUP BY y ORDER BY y", scope
+    )]
+    n_days = sum(r["days"] for r in per_year)
+
+    keys = [m["key"] for m in active_members(db, group_id)]
+    cols, col_params = role_pivot_columns(keys)
+
+    def edge_days(label, order):
+        # 25 days off one end of the (group_id, day_iso, member_key) index, pivoted per member
+        rows = q(label,
+                 f"WITH d AS (SELECT DISTINCT day_iso FROM entries "
+                 f"WHERE group_id=? AND day_iso IS NOT NULL ORDER BY day_iso {order} LIMIT 25) "
+                 f"SELECT {', '.join(['day_iso'] + ([cols] if cols else []))} "
+                 f"FROM entries JOIN d USING (day_iso) WHERE group_id=? "
+                 f"GROUP BY day_iso ORDER BY day_iso {order}",
+                 [group_id] + col_params + [group_id])
+        return [{"day": r[0], **dict(zip(keys, tuple(r)[1:]))} for r in rows]
+
+    newest = edge_days("newest 25 days", "DESC")
+    oldest = edge_days("oldest 25 days", "ASC")
+
+    # Storage / engine health
+    pragma = lambda name: q(f"PRAGMA {name}", f"PRAGMA {name}")[0][0]
+    page_size, page_count, freelist = pragma("page_size"), pragma("page_count"), pragma("freelist_count")
+    wal_path = f"{main_path}-wal" if main_path else ""
+    health = {
+        "sqlite_version": sqlite3.sqlite_version,
+        "schema_version": pragma("user_version"),
+        "journal_mode": pragma("journal_mode"),
+        "synchronous": {0: "OFF", 1: "NORMAL", 2: "FULL", 3: "EXTRA"}.get(pragma("synchronous")),
+        "page_size": page_size,
+        "page_count": page_count,
+        "freelist_count": freelist,
+        "freelist_pct": 100.0 * freelist / page_count if page_count else 0.0,
+        "wal_bytes": os.path.getsize(wal_path) if wal_path and os.path.exists(wal_path) else 0,
+        "cache_size": pragma("cache_size"),  # negative = KiB, positive = pages
+        "mmap_size": pragma("mmap_size"),
+    }
 
     def fmt_ts(ts):
         return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts)) if ts else "n/a"
 
-    tmpl = """
-    {% extends 'BASE_TMPL' %}{% block content %}
-      <h3>Diagnostics</h3>
-      <div class="card">
-        <div class="row">
-          <div class="col-12 col-md-6">
-            <table class="table table-sm">
-              <tbody>
-                <tr><th>SQLite main path</th><td><code>{{ main_path }}</code></td></tr>
-                <tr><th>File exists</th><td>{{ 'Yes' if exists else 'No' }}</td></tr>
-                <tr><th>Size (bytes)</th><td>{{ size }}</td></tr>
-                <tr><th>Modified</th><td>{{ mtime_fmt }}</td></tr>
-                <tr><th>Total entries</th><td>{{ n_entries }}</td></tr>
-                <tr><th>Distinct days</th><td>{{ n_days }}</td></tr>
-                <tr><th>Range</th><td>{{ min_day }} → {{ max_day }}</td></tr>
-              </tbody>
-            </table>
-          </div>
-          <div class="col-12 col-md-6">
-            <h5>Counts per year</h5>
-            <ul class="mb-0">
-              {% for r in per_year %}<li>{{ r['y'] }} — {{ r['days'] }}</li>{% endfor %}
-            </ul>
-          </div>
-        </div>
-      </div>
-      <br>
-      <div class="row gy-3">
-        <div class="col-12 col-md-6">
-          <div class="card">
-            <h5>Newest 25 days</h5>
-            <pre>{{ newest }}</pre>
-          </div>
-        </div>
-        <div class="col-12 col-md-6">
-          <div class="card">
-            <h5>Oldest 25 days</h5>
-            <pre>{{ oldest }}</pre>
-          </div>
-        </div>
-      </div>
-    {% endblock %}
-    """
-    from templates import BASE_TMPL
-    return render_template_string(
-        tmpl,
-        BASE_TMPL=BASE_TMPL,
+    return render_template(
+        "DIAG_TMPL",
         main_path=main_path, exists=exists, size=size,
-        mtime_fmt=fmt_ts(mtime), n_entries=n_entries, n_days=n_days,
-        min_day=min_day, max_day=max_day, per_year=per_year,
-        newest=newest, oldest=oldest,
+        mtime_fmt=fmt_ts(mtime), n_entries=n_entries, n_days=n_days, n_unparsed=n_unparsed,
+        min_day=min_day, max_day=max_day, per_year=per_year, health=health, timings=timings,
+        newest=newest, oldest=oldest, pools=pool_stats(), user_cache=user_cache_stats(),
+        page_cache=page_cache.snapshot(),
+        sql_trace=SQL_TRACE, slow_queries=slowest_queries(), trace_window=trace_window(),
     )
@@ -1,130 +1,219 @@
 # routes_history.py
-from flask import Blueprint, render_template_string, abort
-from templates import HISTORY_TMPL, STATS_TMPL
-from constants import MEMBERS
-from db import get_db
-from auth import login_required
+import csv
+import io
+import json
 
-from flask import render_template_string, request   # <-- ensure this is imported
+from flask import Blueprint, Response, render_template, abort, stream_with_context
+from db import get_db, iter_rows, hold_db_for_stream, active_members, role_pivot_columns
+from rendering import stream_page, conditional_get, cached_page
+from auth import login_required, current_group_id
+
+from flask import request, url_for
 from datetime import datetime, date
-from collections import defaultdict
 
 historybp = Blueprint("historybp", __name__)
 
-def _day_to_date(val) -> date:
-    if isinstance(val, date): return val
-    s = str(val or "")
-    try:
-        return datetime.strptime(s[:10], "%Y-%m-%d").date()
-    except Exception:
-        pass
+HISTORY_PAGE_SIZE = 60  # days per page
+
+
+def iso_arg(name: str):
+    """A yyyy-mm-dd query arg as ISO text, or None if missing/invalid."""
+    s = (request.args.get(name) or "").strip()
     try:
-        return datetime.strptime(s.replace(",", ""), "%b %d %Y %I:%M:%S %p").date()
-    except Exception:
-        pass
-    return date.today()
+        return datetime.strptime(s, "%Y-%m-%d").date().isoformat() if s else None
+    except ValueError:
+        return None
+
+
+def history_page_query(group_id, keys, start=None, end=None, member="", role="", before=None,
+                       after=None, limit=HISTORY_PAGE_SIZE):
+    """
+    SQL + params for one page of a group's day x member role grid, newest first:
+    day_iso, then one column per member in `keys` order (m0, m1, ...).
+    Missing entries count as Rider, same as the grid shows them. Keyset
+    cursors: `before` pages to older days, `after` to newer ones (returned
+    ascending; the caller flips them). Fetches limit+1 rows to detect more;
+    limit=None returns every matching day.
+    """
+    cols, params = role_pivot_columns(keys, default="R")
+
+    where = ["group_id = ?", "day_iso IS NOT NULL"]
+    params.append(group_id)
+    for cond, val in (("day_iso >= ?", start), ("day_iso <= ?", end),
+                      ("day_iso < ?", before), ("day_iso > ?", after)):
+        if val:
+            where.append(cond)
+            params.append(val)
+
+    having = []
+    if member:
+        if role in ("D", "R", "O"):
+            # Unknown member + role can never match, same as before
+            having.append(f"m{keys.index(member)} = ?" if member in keys else "0")
+            if member in keys:
+                params.append(role)
+    elif role in ("D", "R", "O") and keys:
+        # No member filter; include only days where at least one member matches the role
+        having.append("(" + " OR ".join(f"m{i} = ?" for i in range(len(keys))) + ")")
+        params.extend([role] * len(keys))
+
+    sql = (
+        f"SELECT {', '.join(['day_iso'] + ([cols] if cols else []))} FROM entries "
+        f"WHERE {' AND '.join(where)} GROUP BY day_iso "
+        + (f"HAVING {' AND '.join(having)} " if having else "")
+        + f"ORDER BY day_iso {'ASC' if after else 'DESC'}"
+    )
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit + 1)
+    return sql, params
+
+
+def _history_row(r) -> dict:
+    d = date.fromisoformat(r[0])
+    return {"day_fmt": f"{d:%a} {d:%Y-%m-%d}", "day_iso": r[0], "roles": tuple(r)[1:]}
+
 
 @historybp.route("/history")
 @login_required
+@conditional_get
+@cached_page
 def history():
     db = get_db()
-    rows = db.execute("SELECT day, member_key, role FROM entries").fetchall()
 
-    # Build per-day role map
-    by_day = defaultdict(lambda: {"CA": None, "ER": None, "SJ": None})
-    for r in rows:
-        d = _day_to_date(r["day"])
-        by_day[d][r["member_key"]] = r["role"]
-
-    # Filters from query string
-    start  = (request.args.get("start")  or "").strip()
-    end    = (request.args.get("end")    or "").strip()
+    # Filters from query string (all applied in SQL)
+    start  = iso_arg("start")
+    end    = iso_arg("end")
     member = (request.args.get("member") or "").strip().upper()
     role   = (request.args.get("role")   or "").strip().upper()
+    before = iso_arg("before")
+    after  = None if before else iso_arg("after")
+    stream_all = request.args.get("all") == "1"
+    group_id = current_group_id()
+    members = active_members(db, group_id)
+    keys = [m["key"] for m in members]
+
+    # Cursor links keep the active filters
+    filters = {k: request.args[k] for k in ("start", "end", "member", "role") if request.args.get(k)}
+    older_url = newer_url = None
+
+    if stream_all:
+        # Every matching day, rendered while it is fetched
+        sql, params = history_page_query(group_id, keys, start, end, member, role, limit=None)
+        rows_fmt = (_history_row(r) for r in iter_rows(db.execute(sql, params)))
+    else:
+        sql, params = history_page_query(group_id, keys, start, end, member, role, before, after)
+        rows = db.execute(sql, params).fetchall()
+        has_more = len(rows) > HISTORY_PAGE_SIZE
+        rows = rows[:HISTORY_PAGE_SIZE]
+        if after:
+            rows.reverse()
+        rows_fmt = [_history_row(r) for r in rows]
+
+    if not stream_all and rows_fmt:
+        if has_more or after:
+            older_url = url_for("historybp.history", before=rows_fmt[-1]["day_iso"], **filters)
+        if before or (after and has_more):
+            newer_url = url_for("historybp.history", after=rows_fmt[0]["day_iso"], **filters)
+
+    ctx = dict(rows=rows_fmt, older_url=older_url, newer_url=newer_url,
+               stream_all=stream_all, filters=filters,
+               members=[(m["key"], m["name"]) for m in members])
+    if stream_all:
+        return stream_page("HISTORY_TMPL", **ctx)
+    return render_template("HISTORY_TMPL", **ctx)
+
+# ---- Export (CSV / NDJSON, streamed) ----------------------------------------
+
+EXPORT_COLUMNS = ("day", "member_key", "role", "update_user", "update_ts")
+EXPORT_BATCH = 1000  # rows per fetchmany() and per chunk written
+
+
+def export_query(group_id, start=None, end=None, member="", role=""):
+    """SQL + params for a group's raw entries in day order, with history()'s date/member/role filters."""
+    sql = (
+        "SELECT day_iso AS day, member_key, role, "
+        "COALESCE(update_user,'') AS update_user, COALESCE(update_ts,'') AS update_ts "
+        "FROM entries WHERE group_id = ? AND day_iso IS NOT NULL"
+    )
+    params = [group_id]
+    for cond, val in (("day_iso >= ?", start), ("day_iso <= ?", end),
+                      ("member_key = ?", member),
+                      ("role = ?", role if role in ("D", "R", "O") else None)):
+        if val:
+            sql += f" AND {cond}"
+            params.append(val)
+    return sql + " ORDER BY day_iso, member_key", params
+
+
+def iter_csv(cur, size=EXPORT_BATCH):
+    """CSV text for a cursor over export_query(), one chunk per fetchmany() batch."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    while True:
+        batch = cur.fetchmany(size)
+        if not batch:
+            break
+        writer.writerows(batch)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def iter_ndjson(cur, size=EXPORT_BATCH):
+    """One JSON object per line for a cursor over export_query(), chunked like iter_csv."""
+    while True:
+        batch = cur.fetchmany(size)
+        if not batch:
+            break
+        yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, r))) + "\n" for r in batch)
+
+
+EXPORT_FORMATS = {
+    "csv": (iter_csv, "text/csv"),
+    "ndjson": (iter_ndjson, "application/x-ndjson"),
+}
+
+
+@historybp.route("/export/entries.<fmt>")
+@login_required
+def export_entries(fmt):
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+    encode, mimetype = EXPORT_FORMATS[fmt]
+    sql, params = export_query(
+        current_group_id(),
+        iso_arg("start"), iso_arg("end"),
+        (request.args.get("member") or "").strip().upper(),
+        (request.args.get("role") or "").strip().upper(),
+    )
+    body = encode(get_db().execute(sql, params))
+    # No Content-Length on a generator body, so the server sends it chunked
+    resp = Response(stream_with_context(hold_db_for_stream(body)), mimetype=mimetype)
+    resp.headers["Content-Disposition"] = f"attachment; filename=entries.{fmt}"
+    resp.headers["Cache-Control"] = "no-store"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
 
-    start_d = datetime.strptime(start, "%Y-%m-%d").date() if start else None
-    end_d   = datetime.strptime(end,   "%Y-%m-%d").date() if end   else None
-
-    # Build formatted rows with Rider defaults and apply filters
-    rows_fmt = []
-    for d in sorted(by_day.keys(), reverse=True):
-        if start_d and d < start_d: continue
-        if end_d and d > end_d:     continue
-
-        roles = by_day[d]
-        ca = roles["CA"] if roles["CA"] is not None else "R"
-        er = roles["ER"] if roles["ER"] is not None else "R"
-        sj = roles["SJ"] if roles["SJ"] is not None else "R"
-
-        # Apply member/role filters
-        if member:
-            val = {"CA": ca, "ER": er, "SJ": sj}.get(member)
-            # If the selected member doesn't match the selected role (when provided), skip
-            if role in ("D","R","O") and val != role:
-                continue
-        elif role in ("D","R","O"):
-            # No member filter; include only days where at least one member matches the role
-            if not (ca == role or er == role or sj == role):
-                continue
-
-        rows_fmt.append({
-            "day_fmt": f"{d:%a} {d:%Y-%m-%d}",
-            "CA": ca, "ER": er, "SJ": sj
-        })
-
-    # Inline template with filter controls (so we don't depend on HISTORY_TMPL here)
-    tmpl = """
-    {% extends "BASE_TMPL" %}{% block content %}
-      <h3>History</h3>
-    
-      <form class="row g-2 align-items-end mb-3" method="get">
-        <div class="col-auto">
-          <label class="form-label">From</label>
-          <input class="form-control" type="date" name="start" value="{{ request.args.get('start','') }}">
-        </div>
-        <div class="col-auto">
-          <label class="form-label">To</label>
-          <input class="form-control" type="date" name="end" value="{{ request.args.get('end','') }}">
-        </div>
-        
-        <div class="col-auto">
-          <button class="btn btn-primary">Filter</button>
-          <a class="btn btn-secondary" href="{{ url_for('historybp.history') }}">Reset</a>
-        </div>
-      </form>
-
-      <div class="table-scroll">
-        <table class="table table-sm table-sticky">
-          <thead><tr><th>Date</th><th>Christian</th><th>Eric</th><th>Sean</th></tr></thead>
-          <tbody>
-            {% for r in rows %}
-            <tr>
-              <td>{{ r['day_fmt'] }}</td>
-              <td>{{ r['CA'] or '' }}</td>
-              <td>{{ r['ER'] or '' }}</td>
-              <td>{{ r['SJ'] or '' }}</td>
-            </tr>
-            {% endfor %}
-            {% if not rows %}
-              <tr><td colspan="4" class="text-center text-muted">No results</td></tr>
-            {% endif %}
-          </tbody>
-        </table>
-      </div>
-    {% endblock %}
-    """
-    from templates import BASE_TMPL
-    return render_template_string(tmpl, rows=rows_fmt, BASE_TMPL=BASE_TMPL)
 
 @historybp.route("/stats/<member_key>")
 @login_required
+@conditional_get
+@cached_page
 def member_stats(member_key):
-    if member_key not in MEMBERS:
-        abort(404)
     db = get_db()
+    group_id = current_group_id()
+    member = db.execute(
+        "SELECT name FROM members WHERE group_id=? AND key=?", (group_id, member_key)
+    ).fetchone()
+    if member is None:
+        abort(404)
     counts = db.execute(
-        "SELECT role, COUNT(*) AS n FROM entries WHERE member_key=? GROUP BY role",
-        (member_key,)
+        "SELECT role, COUNT(*) AS n FROM entries WHERE group_id=? AND member_key=? GROUP BY role",
+        (group_id, member_key)
     ).fetchall()
     counts = {r["role"]: r["n"] for r in counts}
-    return render_template_string(STATS_TMPL, member_key=member_key, member_name=MEMBERS[member_key], counts=counts)
+    return render_template("STATS_TMPL", member_key=member_key, member_name=member["name"], counts=counts)
@@ -1,17 +1,22 @@
 # routes_today.py
-from flask import Blueprint, request, render_template_string, redirect, url_for, session, flash
+from flask import Blueprint, request, render_template, redirect, url_for, session, flash
 from datetime import date, datetime, timedelta
-from collections import defaultdict
 
-from constants import MEMBERS, MEMBER_ORDER, ROLE_CHOICES
-from templates import TODAY_TMPL
-from db import get_db
-from auth import login_required
+from constants import ROLE_CHOICES
+from db import get_db, transaction, active_members
+from auth import login_required, current_group_id, current_user
+from rendering import conditional_get, cached_page
+from credits import (
+    ledger_credits, apply_ledger_deltas, credits_before, suggest_driver, suggest_range,
+)
 
 todaybp = Blueprint("todaybp", __name__)
 
 # ---------- Date helpers ----------
 
+WEEK_DAYS = 7       # default length of the /week range
+MAX_RANGE_DAYS = 31
+
 def parse_day(s: str) -> date:
     """Parse an ISO yyyy-mm-dd string from the form/query; fallback to today."""
     try:
@@ -19,110 +24,56 @@ def parse_day(s: str) -> date:
     except Exception:
         return date.today()
 
-def day_to_date(val) -> date:
-    """
-    Normalize DB 'day' values into a date object.
-    Supports:
-      - ISO 'YYYY-MM-DD...'
-      - 'Jul 12, 2023, 12:00:00 AM' (commas stripped first)
-    Falls back to today on parse failure (rare).
-    """
-    if isinstance(val, date):
-        return val
-    s = str(val or "")
-    # Try ISO first
-    try:
-        return datetime.strptime(s[:10], "%Y-%m-%d").date()
-    except Exception:
-        pass
-    # Try viewer-style (commas removed)
-    try:
-        return datetime.strptime(s.replace(",", ""), "%b %d %Y %I:%M:%S %p").date()
-    except Exception:
-        pass
-    return date.today()
+def is_locked(day: date) -> bool:
+    """Only admins can modify entries older than 7 days."""
+    return day <= (date.today() - timedelta(days=7)) and not getattr(current_user, "is_admin", False)
 
-# ---------- Credit & suggestion logic (single unified carpool) ----------
+# ---------- Saving ----------
 
-def compute_credits_all(entries):
-    """
-    Compute credits across the ONE unified carpool:
-      - Driver: +1 per rider that same day
-      - Rider:  -1
-      - Off:     0
-    Returns a dict { member_key -> credits } across *all* history provided.
-    """
-    credits = defaultdict(int)
-    by_day = defaultdict(dict)
-    for e in entries:
-        d = day_to_date(e["day"])
-        by_day[d][e["member_key"]] = e["role"]
-
-    for d in sorted(by_day.keys()):
-        roles = by_day[d]
-        drivers = [m for m, r in roles.items() if r == "D"]
-        riders  = [m for m, r in roles.items() if r == "R"]
-        if not drivers and not riders:
-            continue
-        for drv in drivers:
-            credits[drv] += len(riders)
-        for r in riders:
-            credits[r] -= 1
-    return dict(credits)
-
-def find_last_driver_overall(db, cutoff_day: date):
-    """
-    Find the last driver strictly before cutoff_day to help with rotation tie-breaks.
-    """
-    rows = db.execute("SELECT day, member_key, role FROM entries").fetchall()
-    by_day = {}
-    for e in rows:
-        d = day_to_date(e["day"])
-        if d >= cutoff_day:
-            continue
-        by_day.setdefault(d, {})[e["member_key"]] = e["role"]
-
-    last_day, last_driver = None, None
-    for d in sorted(by_day.keys()):
-        driver = next((m for m, r in by_day[d].items() if r == "D"), None)
-        if driver is not None and (last_day is None or d > last_day):
-            last_day, last_driver = d, driver
-    return last_driver
-
-def suggest_driver(db, selected_day: date, roles_today: dict):
+UPSERT_ENTRY_SQL = (
+    "INSERT INTO entries(group_id, day, day_iso, member_key, role, update_user, update_ts, update_date) "
+    "VALUES(?1, ?2, ?2, ?3, ?4, ?5, CURRENT_TIMESTAMP, DATE('now')) "
+    "ON CONFLICT(group_id, day_iso, member_key) DO UPDATE SET "
+    "day=excluded.day, "
+    "role=excluded.role, "
+    "update_user=excluded.update_user, "
+    "update_ts=CURRENT_TIMESTAMP, "
+    "update_date=DATE('now')"
+)
+
+
+def save_roles(db, group_id: int, posted: dict, username: str) -> int:
     """
-    Suggest a driver for selected_day using unified credits:
-      1) Lowest credits among today's active (not Off)
-      2) If tie, rotate from last driver then use MEMBER_ORDER
-    Returns member_key or None if <2 active (No Carpool Today).
+    Write the roles in `posted` ({day_iso: {member_key: role}}) that differ
+    from what the group has stored, as one BEGIN IMMEDIATE transaction: a single
+    executemany for entries plus one ledger update, so a day, a week or a
+    whole group costs one commit. Version/checkpoint/search triggers fire in
+    the same transaction, which invalidates the credit timeline cache too.
+    Returns the number of entries written.
     """
-    active = [m for m, r in roles_today.items() if r != "O"]
-    if len(active) < 2:
-        return None
-
-    rows = db.execute("SELECT day, member_key, role FROM entries").fetchall()
-    rows = [r for r in rows if day_to_date(r["day"]) < selected_day]
-    credits = compute_credits_all(rows)
-
-    filtered = {m: credits.get(m, 0) for m in active}
-    min_score = min(filtered.values()) if filtered else 0
-    candidates = [m for m, sc in filtered.items() if sc == min_score]
-    if len(candidates) == 1:
-        return candidates[0]
-
-    # Tie-break with last driver rotation, then MEMBER_ORDER
-    last_driver = find_last_driver_overall(db, selected_day)
-    order = [m for m in MEMBER_ORDER if m in active]
-    if last_driver in order:
-        start = (order.index(last_driver) + 1) % len(order)
-        for i in range(len(order)):
-            pick = order[(start + i) % len(order)]
-            if pick in candidates:
-                return pick
-    for m in order:
-        if m in candidates:
-            return m
-    return sorted(candidates)[0] if candidates else None
+    days = sorted(posted)
+    if not days:
+        return 0
+    with transaction(db, immediate=True):
+        ledger_credits(db, group_id)  # builds the ledger first if this DB predates it
+        # Re-read under the write lock so the ledger delta matches what we replace
+        existing = {d: {} for d in days}
+        for r in db.execute(
+            f"SELECT day_iso, member_key, role FROM entries "
+            f"WHERE group_id = ? AND day_iso IN ({','.join('?' * len(days))})", [group_id, *days]
+        ).fetchall():
+            existing[r["day_iso"]][r["member_key"]] = r["role"]
+
+        writes, day_changes = [], []
+        for d in days:
+            changed = {k: v for k, v in posted[d].items() if existing[d].get(k) != v}
+            if changed:
+                writes.extend((group_id, d, k, v, username) for k, v in changed.items())
+                day_changes.append((existing[d], {**existing[d], **changed}))
+        if writes:
+            db.executemany(UPSERT_ENTRY_SQL, writes)
+            apply_ledger_deltas(db, group_id, day_changes)
+    return len(writes)
 
 # ---------- Routes ----------
 
@@ -133,9 +84,13 @@ def root():
 
 @todaybp.route("/today", methods=["GET", "POST"])
 @login_required
+@conditional_get
+@cached_page
 def today():
     db = get_db()
-    members = db.execute("SELECT key, name FROM members WHERE active=1 ORDER BY key").fetchall()
+    group_id = current_group_id()
+    members = active_members(db, group_id)
+    names = {m["key"]: m["name"] for m in members}
 
     selected_day = parse_day(
         (request.args.get("day") if request.method == "GET" else request.form.get("day"))
@@ -143,17 +98,15 @@ def today():
     )
 
     existing = {r["member_key"]: r["role"] for r in db.execute(
-        "SELECT member_key, role FROM entries WHERE day LIKE ?",  # LIKE to be format-agnostic
-        (f"{selected_day.isoformat()}%",)
+        "SELECT member_key, role FROM entries WHERE group_id = ? AND day_iso = ?",
+        (group_id, selected_day.isoformat())
     ).fetchall()}
 
     # Default roles: 'R' (Rider) for new/future days (assume carpool is in play)
     roles_form = {m["key"]: existing.get(m["key"], "R") for m in members}
 
     # Editing lock: only admins can modify entries older than 7 days
-    can_edit = True
-    if selected_day <= (date.today() - timedelta(days=7)) and not session.get("is_admin"):
-        can_edit = False
+    can_edit = not is_locked(selected_day)
 
     # Handle POST (saves)
     if request.method == "POST":
@@ -166,37 +119,17 @@ def today():
         if not set(roles_posted.values()).issubset(ROLE_CHOICES):
             return ("Bad role value", 400)
 
-        # Load current (if any) for this day; we already fetched 'existing' above,
-        # so use that to avoid re-query and only write changes.
-        writes = []
-        for key, role in roles_posted.items():
-            if existing.get(key) != role:
-                writes.append((key, role))
-
-        if not writes:
+        # Skip the write lock entirely when nothing changed
+        if all(existing.get(k) == v for k, v in roles_posted.items()):
             flash("No changes to save.")
             return redirect(url_for("todaybp.today", day=selected_day.isoformat()))
 
-        for key, role in writes:
-            db.execute(
-                "INSERT INTO entries(day, member_key, role, update_user, update_ts, update_date) "
-                "VALUES(?,?,?,?,CURRENT_TIMESTAMP, DATE('now')) "
-                "ON CONFLICT(day, member_key) DO UPDATE SET "
-                "role=excluded.role, "
-                "update_user=excluded.update_user, "
-                "update_ts=CURRENT_TIMESTAMP, "
-                "update_date=DATE('now')",
-                (selected_day.isoformat(), key, role, session.get('username', 'unknown'))
-            )
-
-        db.commit()
+        save_roles(db, group_id, {selected_day.isoformat(): roles_posted}, session.get("username", "unknown"))
         flash("Saved.")
         return redirect(url_for("todaybp.today", day=selected_day.isoformat()))
 
-    # Credits up to yesterday (exclude the selected day); filter in Python for date-format safety
-    rows_prev = db.execute("SELECT day, member_key, role FROM entries").fetchall()
-    rows_prev = [r for r in rows_prev if day_to_date(r["day"]) < selected_day]
-    credits = compute_credits_all(rows_prev)
+    # Credits up to yesterday (exclude the selected day), read from the ledger
+    credits = credits_before(db, group_id, selected_day)
 
     # Determine "No Carpool Today" and suggestion
     active = [k for k, v in roles_form.items() if v != "O"]
@@ -207,15 +140,15 @@ def today():
     driver_is_explicit = False
     if not no_carpool:
         if explicit_driver:
-            suggestion_name = MEMBERS.get(explicit_driver, explicit_driver)
+            suggestion_name = names.get(explicit_driver, explicit_driver)
             driver_is_explicit = True
         else:
-            pick = suggest_driver(db, selected_day, roles_form)
+            pick = suggest_driver(db, group_id, selected_day, roles_form, credits)
             if pick:
-                suggestion_name = MEMBERS.get(pick, pick)
+                suggestion_name = names.get(pick, pick)
 
-    return render_template_string(
-        TODAY_TMPL,
+    return render_template(
+        "TODAY_TMPL",
         selected_day=selected_day.isoformat(),
         members=members,
         roles=roles_form,
@@ -225,3 +158,71 @@ def today():
         can_edit=can_edit,
         no_carpool=no_carpool,           # renders the "No Carpool Today" banner
     )
+
+
+@todaybp.route("/week", methods=["GET", "POST"])
+@login_required
+def week():
+    """Role grid for a range of days (default: this week from Monday), saved in one POST."""
+    db = get_db()
+    group_id = current_group_id()
+    members = active_members(db, group_id)
+    names = {m["key"]: m["name"] for m in members}
+    args = request.args if request.method == "GET" else request.form
+
+    start = parse_day(args.get("start") or (date.today() - timedelta(days=date.today().weekday())).isoformat())
+    try:
+        n_days = min(max(int(args.get("days", WEEK_DAYS)), 1), MAX_RANGE_DAYS)
+    except ValueError:
+        n_days = WEEK_DAYS
+    days = [(start + timedelta(days=i)).isoformat() for i in range(n_days)]
+
+    if request.method == "POST":
+        # One form field per cell: "<day_iso>|<member_key>"; locked days render
+        # disabled (not submitted) and are ignored here in any case
+        posted = {}
+        for d in days:
+            if is_locked(date.fromisoformat(d)):
+                continue
+            roles = {m["key"]: request.form[f"{d}|{m['key']}"]
+                     for m in members if f"{d}|{m['key']}" in request.form}
+            if roles:
+                posted[d] = roles
+        if any(not set(r.values()).issubset(ROLE_CHOICES) for r in posted.values()):
+            return ("Bad role value", 400)
+
+        n = save_roles(db, group_id, posted, session.get("username", "unknown"))
+        flash(f"Saved {n} change{'s' if n != 1 else ''}." if n else "No changes to save.")
+        return redirect(url_for("todaybp.week", start=start.isoformat(), days=n_days))
+
+    stored = {d: {} for d in days}
+    for r in db.execute(
+        "SELECT day_iso, member_key, role FROM entries WHERE group_id = ? AND day_iso BETWEEN ? AND ?",
+        (group_id, days[0], days[-1])
+    ).fetchall():
+        stored[r["day_iso"]][r["member_key"]] = r["role"]
+    # Same defaults as /today: unsaved days show everyone as Rider
+    shown = {d: {m["key"]: stored[d].get(m["key"], "R") for m in members} for d in days}
+    credits = credits_before(db, group_id, start)
+    picks = suggest_range(db, group_id, days, shown, stored, credits)
+
+    rows = []
+    for d in days:
+        day = date.fromisoformat(d)
+        explicit = next((k for k, v in shown[d].items() if v == "D"), None)
+        pick = explicit or picks[d]
+        rows.append({
+            "day": d, "day_fmt": f"{day:%a} {day:%Y-%m-%d}", "roles": shown[d],
+            "locked": is_locked(day), "saved": bool(stored[d]),
+            "suggestion": names.get(pick, pick) if pick else None,
+            "driver_is_explicit": bool(explicit),
+        })
+
+    return render_template(
+        "WEEK_TMPL",
+        rows=rows, members=members, start=start.isoformat(), n_days=n_days,
+        prev_start=(start - timedelta(days=n_days)).isoformat(),
+        next_start=(start + timedelta(days=n_days)).isoformat(),
+        credits=credits,
+        any_editable=any(not r["locked"] for r in rows),
+    )
@@ -46,6 +46,7 @@ BASE_TMPL = """
     <div class="collapse navbar-collapse justify-content-end" id="navmenu">
       <ul class="navbar-nav">
         <li class="nav-item"><a class="nav-link" href="{{ url_for('todaybp.today') }}">Today</a></li>
+        <li class="nav-item"><a class="nav-link" href="{{ url_for('todaybp.week') }}">Week</a></li>
         <li class="nav-item"><a class="nav-link" href="{{ url_for('historybp.history') }}">History</a></li>
         <li class="nav-item"><a class="nav-link" href="{{ url_for('authbp.account') }}">Account</a></li>
         {% if current_user.is_authenticated and current_user.is_admin %}
@@ -180,25 +181,127 @@ TODAY_TMPL = """
 """
 
 
+WEEK_TMPL = """
+{% extends "BASE_TMPL" %}{% block content %}
+  <div class="d-flex justify-content-between align-items-center mt-3 mb-2">
+    <a class="btn btn-outline-secondary btn-sm" href="{{ url_for('todaybp.week', start=prev_start, days=n_days) }}">&larr; Previous</a>
+    <form method="get" class="d-flex gap-2">
+      <input class="form-control form-control-sm" type="date" name="start" value="{{ start }}">
+      <input class="form-control form-control-sm" type="number" name="days" value="{{ n_days }}" min="1" max="31" style="width:5em">
+      <button class="btn btn-secondary btn-sm">Go</button>
+    </form>
+    <a class="btn btn-outline-secondary btn-sm" href="{{ url_for('todaybp.week', start=next_start, days=n_days) }}">Next &rarr;</a>
+  </div>
+
+  <form method="post" class="card">
+    <input type="hidden" name="start" value="{{ start }}">
+    <input type="hidden" name="days" value="{{ n_days }}">
+    <div class="table-scroll">
+      <table class="table table-sm">
+        <thead>
+          <tr>
+            <th>Date</th>
+            {% for m in members %}
+              <th>{{ m['name'] }} <span class="muted">({{ credits.get(m['key'], 0) }})</span></th>
+            {% endfor %}
+            <th>Driver</th>
+          </tr>
+        </thead>
+        <tbody>
+          {% for r in rows %}
+          <tr>
+            <td><a href="{{ url_for('todaybp.today', day=r.day) }}">{{ r.day_fmt }}</a>{% if not r.saved %} <span class="muted">(new)</span>{% endif %}</td>
+            {% for m in members %}
+            <td>
+              <select name="{{ r.day }}|{{ m['key'] }}" {% if r.locked %}disabled{% endif %}>
+                <option value="D" {% if r.roles[m['key']]=='D' %}selected{% endif %}>Driver</option>
+                <option value="R" {% if r.roles[m['key']]=='R' %}selected{% endif %}>Rider</option>
+                <option value="O" {% if r.roles[m['key']]=='O' %}selected{% endif %}>Off</option>
+              </select>
+            </td>
+            {% endfor %}
+            <td>
+              {% if not r.suggestion %}<span class="muted">No carpool</span>
+              {% elif r.driver_is_explicit %}{{ r.suggestion }}
+              {% else %}<span class="muted">{{ r.suggestion }} should drive</span>{% endif %}
+            </td>
+          </tr>
+          {% endfor %}
+        </tbody>
+      </table>
+    </div>
+    {% if any_editable %}
+      <button type="submit" class="btn btn-primary">Save all</button>
+    {% else %}
+      <button type="button" class="btn btn-secondary" disabled>Editing locked (admin only)</button>
+    {% endif %}
+  </form>
+{% endblock %}
+"""
+
 
 HISTORY_TMPL = """
 {% extends "BASE_TMPL" %}{% block content %}
   <h3>History</h3>
+
+  <form class="row g-2 align-items-end mb-3" method="get">
+    <div class="col-auto">
+      <label class="form-label">From</label>
+      <input class="form-control" type="date" name="start" value="{{ request.args.get('start','') }}">
+    </div>
+    <div class="col-auto">
+      <label class="form-label">To</label>
+      <input class="form-control" type="date" name="end" value="{{ request.args.get('end','') }}">
+    </div>
+    <div class="col-auto">
+      <label class="form-label">Member</label>
+      <select name="member" class="form-select">
+        <option value="">(all)</option>
+        {% for k, name in members %}
+          <option value="{{ k }}" {{ 'selected' if request.args.get('member')==k else '' }}>{{ name }}</option>
+        {% endfor %}
+      </select>
+    </div>
+    <div class="col-auto">
+      <label class="form-label">Role</label>
+      <select name="role" class="form-select">
+        <option value="">(all)</option>
+        <option value="D" {{ 'selected' if request.args.get('role')=='D' else '' }}>Driver</option>
+        <option value="R" {{ 'selected' if request.args.get('role')=='R' else '' }}>Rider</option>
+        <option value="O" {{ 'selected' if request.args.get('role')=='O' else '' }}>Off</option>
+      </select>
+    </div>
+
+    <div class="col-auto">
+      <button class="btn btn-primary">Filter</button>
+      <a class="btn btn-secondary" href="{{ url_for('historybp.history') }}">Reset</a>
+    </div>
+  </form>
+
   <div class="table-scroll">
     <table class="table table-sm table-sticky">
-      <thead><tr><th>Date</th><th>Christian</th><th>Eric</th><th>Sean</th></tr></thead>
+      <thead><tr><th>Date</th>{% for k, name in members %}<th>{{ name }}</th>{% endfor %}</tr></thead>
       <tbody>
         {% for r in rows %}
         <tr>
           <td>{{ r['day_fmt'] }}</td>
-          <td>{{ r['CA'] or '' }}</td>
-          <td>{{ r['ER'] or '' }}</td>
-          <td>{{ r['SJ'] or '' }}</td>
+          {% for role in r['roles'] %}<td>{{ role or '' }}</td>{% endfor %}
         </tr>
+        {% else %}
+          <tr><td colspan="{{ members|length + 1 }}" class="text-center text-muted">No results</td></tr>
         {% endfor %}
       </tbody>
     </table>
   </div>
+
+  <nav class="d-flex justify-content-between mt-2">
+    {% if newer_url %}<a class="btn btn-outline-secondary btn-sm" href="{{ newer_url }}">&larr; Newer</a>{% else %}<span></span>{% endif %}
+    <span>
+      {% if not stream_all %}<a class="btn btn-link btn-sm" href="{{ url_for('historybp.history', all=1, **filters) }}">Show all</a>{% endif %}
+      <a class="btn btn-link btn-sm" href="{{ url_for('historybp.export_entries', fmt='csv', **filters) }}">Download CSV</a>
+    </span>
+    {% if older_url %}<a class="btn btn-outline-secondary btn-sm" href="{{ older_url }}">Older &rarr;</a>{% endif %}
+  </nav>
 {% endblock %}
 """
 
@@ -212,3 +315,378 @@ STATS_TMPL = """
   </ul>
 {% endblock %}
 """
+
+# Password change (authbp.account)
+PASSWORD_TMPL = """
+{% extends 'BASE_TMPL' %}{% block content %}
+  <h3>Account</h3>
+  <form method='post' class='card'>
+    <label>New password<br><input type='password' name='pw1' required></label><br><br>
+    <label>Confirm password<br><input type='password' name='pw2' required></label><br><br>
+    <label><input type="checkbox" name="remember"> Keep me signed in on this device</label><br><br>
+    <button class="btn btn-primary">Change password</button>
+  </form>
+{% endblock %}
+"""
+
+# Account stats + password change (accountbp.account)
+ACCOUNT_TMPL = """
+{% extends 'BASE_TMPL' %}{% block content %}
+  <h3>Account</h3>
+
+
+    <div class="ms-3 card p-3 mb-3">
+    <h3>Stats</h3>
+        <div style="margin-left: 2em;">
+            <p><strong>Drives: </strong> {{ drives }}</p>
+            <p><strong>Rides: </strong> {{ rides }}</p>
+            <p><strong>Off: </strong> {{ offs }}</p>
+            <p><strong>Credits: </strong> {{ credits }}</p>
+            <p><strong>Miles (est. as passenger): </strong> {{ miles }}</p>
+            <p><strong>Gas Savings (est.): </strong>
+               ${{ "%.2f"|format(gas_savings) }}
+               <div style="margin-left: 2em;">
+                <p><i><small>( {{ miles }} ÷ {{ avg_mpg }} mpg × ${{ gas_price }}/gal and {{ miles_per_ride }} miles per day saved.</i></small>)
+                </p></div>
+        </div
+  </div>
+
+  <form method="post" class="card">
+    <h5>Change password</h5>
+    <label>New password<br><input type="password" name="pw1" required></label><br><br>
+    <label>Confirm password<br><input type="password" name="pw2" required></label><br><br>
+    <button class="btn btn-primary">Change password</button>
+  </form>
+{% endblock %}
+"""
+
+ACCOUNT_PICK_TMPL = """
+{% extends 'BASE_TMPL' %}{% block content %}
+  <h3>Account</h3>
+  <div class="card">
+    <h5>Who are you?</h5>
+    <form method="post" action="{{ url_for('accountbp.account') }}">
+      <label class="form-label">Member</label>
+      <select name="member_key" class="form-select" required>
+        {% for m in members %}
+          <option value="{{ m['key'] }}">{{ m['key'] }} — {{ m['name'] }}</option>
+        {% endfor %}
+      </select>
+      <input type="hidden" name="pw1" value="">
+      <input type="hidden" name="pw2" value="">
+      <button class="btn btn-primary mt-2">Continue</button>
+    </form>
+  </div>
+{% endblock %}
+"""
+
+# Admin pages
+ADMIN_USERS_TMPL = """
+{% extends 'BASE_TMPL' %}{% block content %}
+  <h3>Users</h3>
+
+  <div class='card'>
+    <h5>Add / Update</h5>
+    <form method='post' class="row gy-2 align-items-end">
+      <input type='hidden' name='action' value='add'>
+      <div class="col-auto">
+        <label class="form-label">Username
+          <input class="form-control" name='username' required>
+        </label>
+      </div>
+      <div class="col-auto">
+        <label class="form-label">Password
+          <input class="form-control" name='password' type='password' required>
+        </label>
+      </div>
+      <div class="col-auto form-check mt-4">
+        <input class="form-check-input" type='checkbox' name='is_admin' id="add_admin">
+        <label class="form-check-label" for="add_admin">Admin</label>
+      </div>
+      <div class="col-auto">
+        <button class="btn btn-primary">Save</button>
+      </div>
+    </form>
+  </div>
+
+  <br>
+
+  <div class='card'>
+    <h5>Reset Password / Toggle Admin</h5>
+    <form method='post' class="row gy-2 align-items-end">
+      <input type='hidden' name='action' value='reset'>
+      <div class="col-auto">
+        <label class="form-label">Username
+          <select class="form-select" name='username'>
+            {% for u in users %}
+              <option value='{{u["username"]}}'>{{u["username"]}}</option>
+            {% endfor %}
+          </select>
+        </label>
+      </div>
+      <div class="col-auto">
+        <label class="form-label">New Password
+          <input class="form-control" name='password' type='password' required>
+        </label>
+      </div>
+      <div class="col-auto form-check mt-4">
+        <input class="form-check-input" type='checkbox' name='is_admin' id="reset_admin">
+        <label class="form-check-label" for="reset_admin">Admin</label>
+      </div>
+      <div class="col-auto">
+        <button class="btn btn-primary">Update</button>
+      </div>
+    </form>
+  </div>
+
+  <br>
+
+  <table class="table table-sm">
+    <thead><tr><th>User</th><th>Admin</th></tr></thead>
+    <tbody>
+      {% for u in users %}
+        <tr>
+          <td>{{ u['username'] }}</td>
+          <td>{{ 'Yes' if u['is_admin'] else 'No' }}</td>
+        </tr>
+      {% endfor %}
+      {% if not users %}
+        <tr><td colspan="2" class="text-center text-muted">No users</td></tr>
+      {% endif %}
+    </tbody>
+  </table>
+{% endblock %}
+"""
+
+AUDIT_TMPL = """
+{% extends 'BASE_TMPL' %}{% block content %}
+  <h3>Audit History</h3>
+
+  <form class="row g-2 align-items-end mb-3" method="get">
+    <div class="col-auto">
+      <label class="form-label">Member</label>
+      <select name="member" class="form-select">
+        <option value="">(all)</option>
+        {% for m in members %}
+        <option value="{{ m['key'] }}" {{ 'selected' if request.args.get('member')==m['key'] else '' }}>{{ m['key'] }}</option>
+        {% endfor %}
+      </select>
+    </div>
+    <div class="col-auto">
+      <label class="form-label">Role</label>
+      <select name="role" class="form-select">
+        <option value="">(all)</option>
+        <option value="D" {{ 'selected' if request.args.get('role')=='D' else '' }}>Driver</option>
+        <option value="R" {{ 'selected' if request.args.get('role')=='R' else '' }}>Rider</option>
+        <option value="O" {{ 'selected' if request.args.get('role')=='O' else '' }}>Off</option>
+      </select>
+    </div>
+    <div class="col-auto">
+      <label class="form-label">From</label>
+      <input class="form-control" type="date" name="start" value="{{ request.args.get('start','') }}">
+    </div>
+    <div class="col-auto">
+      <label class="form-label">To</label>
+      <input class="form-control" type="date" name="end" value="{{ request.args.get('end','') }}">
+    </div>
+    <div class="col-auto">
+      <label class="form-label">Search</label>
+      <input class="form-control" name="q" value="{{ request.args.get('q','') }}" placeholder="day/user/date/timestamp">
+    </div>
+    <div class="col-auto">
+      <button class="btn btn-primary">Filter</button>
+      <a class="btn btn-secondary" href="{{ url_for('adminbp.admin_audit') }}">Reset</a>
+    </div>
+  </form>
+
+  <div class="table-scroll">
+    <table class="table table-sm table-sticky align-middle">
+      <thead>
+        <tr>
+          <th>Day</th>
+          <th>Member</th>
+          <th>Role</th>
+          <th>Update User</th>
+          <th>Update Date</th>
+          <th>Update Timestamp</th>
+        </tr>
+      </thead>
+      <tbody>
+        {% for r in rows %}
+          <tr>
+            <td>{{ r['day'] }}</td>
+            <td>{{ r['member_key'] }}</td>
+            <td>{{ 'Driver' if r['role']=='D' else 'Rider' if r['role']=='R' else 'Off' }}</td>
+            <td>{{ r['update_user'] }}</td>
+            <td>{{ r['update_date'] }}</td>
+            <td><code>{{ r['update_ts'] }}</code></td>
+          </tr>
+        {% else %}
+          <tr><td colspan="6" class="text-center text-muted">No results</td></tr>
+        {% endfor %}
+      </tbody>
+    </table>
+  </div>
+
+  <nav class="d-flex justify-content-between mt-2">
+    {% if newer_url %}<a class="btn btn-outline-secondary btn-sm" href="{{ newer_url }}">&larr; Newer</a>{% else %}<span></span>{% endif %}
+    {% if not stream_all %}<a class="btn btn-link btn-sm" href="{{ url_for('adminbp.admin_audit', all=1, **filters) }}">Show all</a>{% endif %}
+    {% if older_url %}<a class="btn btn-outline-secondary btn-sm" href="{{ older_url }}">Older &rarr;</a>{% endif %}
+  </nav>
+{% endblock %}
+"""
+
+DIAG_TMPL = """
+{% extends 'BASE_TMPL' %}{% block content %}
+  <h3>Diagnostics</h3>
+  <div class="card">
+    <div class="row">
+      <div class="col-12 col-md-6">
+        <table class="table table-sm">
+          <tbody>
+            <tr><th>SQLite main path</th><td><code>{{ main_path }}</code></td></tr>
+            <tr><th>File exists</th><td>{{ 'Yes' if exists else 'No' }}</td></tr>
+            <tr><th>Size (bytes)</th><td>{{ size }}</td></tr>
+            <tr><th>Modified</th><td>{{ mtime_fmt }}</td></tr>
+            <tr><th>Total entries</th><td>{{ n_entries }}</td></tr>
+            <tr><th>Distinct days</th><td>{{ n_days }}</td></tr>
+            <tr><th>Range</th><td>{{ min_day }} → {{ max_day }}</td></tr>
+            <tr><th>Rows with unparsed day</th><td>{{ n_unparsed }}</td></tr>
+          </tbody>
+        </table>
+      </div>
+      <div class="col-12 col-md-6">
+        <h5>Counts per year</h5>
+        <ul class="mb-0">
+          {% for r in per_year %}<li>{{ r['y'] }} — {{ r['days'] }}</li>{% endfor %}
+        </ul>
+      </div>
+    </div>
+  </div>
+  <br>
+  <div class="row gy-3">
+    <div class="col-12 col-md-6">
+      <div class="card">
+        <h5>Storage</h5>
+        <table class="table table-sm mb-0">
+          <tbody>
+            <tr><th>SQLite</th><td>{{ health.sqlite_version }} (schema v{{ health.schema_version }})</td></tr>
+            <tr><th>Journal / synchronous</th><td>{{ health.journal_mode }} / {{ health.synchronous }}</td></tr>
+            <tr><th>Pages</th><td>{{ health.page_count }} × {{ health.page_size }} B = {{ '%.1f'|format(health.page_count * health.page_size / 1048576) }} MiB</td></tr>
+            <tr><th>Freelist</th><td>{{ health.freelist_count }} pages ({{ '%.1f'|format(health.freelist_pct) }}%)</td></tr>
+            <tr><th>WAL size</th><td>{{ '%.1f'|format(health.wal_bytes / 1024) }} KiB</td></tr>
+            <tr><th>cache_size</th><td>{{ health.cache_size }} {{ '(KiB)' if health.cache_size < 0 else '(pages)' }}</td></tr>
+            <tr><th>mmap_size</th><td>{{ health.mmap_size }} B</td></tr>
+          </tbody>
+        </table>
+      </div>
+    </div>
+    <div class="col-12 col-md-6">
+      <div class="card">
+        <h5>This page's queries</h5>
+        <table class="table table-sm mb-0">
+          <thead><tr><th>Query</th><th>Rows</th><th>ms</th></tr></thead>
+          <tbody>
+            {% for t in timings %}
+            <tr><td>{{ t.label }}</td><td>{{ t.rows }}</td><td>{{ '%.2f'|format(t.ms) }}</td></tr>
+            {% endfor %}
+            <tr><th>Total</th><td></td><th>{{ '%.2f'|format(timings|sum(attribute='ms')) }}</th></tr>
+          </tbody>
+        </table>
+      </div>
+    </div>
+  </div>
+  <br>
+  <div class="card">
+    <h5>Slowest queries (this process)</h5>
+    {% if sql_trace %}
+    <p class="muted small mb-2">Last {{ trace_window }} traced queries, grouped by SQL, slowest single run first.</p>
+    <table class="table table-sm mb-0">
+      <thead><tr><th>Max ms</th><th>Calls</th><th>Total ms</th><th>Route</th><th>SQL</th></tr></thead>
+      <tbody>
+        {% for q in slow_queries %}
+        <tr><td>{{ '%.2f'|format(q.max_ms) }}</td><td>{{ q.calls }}</td><td>{{ '%.1f'|format(q.total_ms) }}</td>
+            <td><code>{{ q.path }}</code></td><td><code class="small">{{ q.sql|truncate(300) }}</code></td></tr>
+        {% else %}
+        <tr><td colspan="5" class="muted">Nothing traced yet.</td></tr>
+        {% endfor %}
+      </tbody>
+    </table>
+    {% else %}
+    <p class="muted mb-0">SQL tracing is off. Start the app with <code>CESPOOL_SQL_TRACE=1</code> to time every query and send a <code>Server-Timing</code> header.</p>
+    {% endif %}
+  </div>
+  <br>
+  <div class="card">
+    <h5>Connection pool (this process)</h5>
+    <table class="table table-sm mb-0">
+      <thead><tr><th>Path</th><th>Size</th><th>Open</th><th>Idle</th><th>Hits</th><th>Opens</th><th>Waits</th><th>Timeouts</th><th>Discarded</th></tr></thead>
+      <tbody>
+        {% for p in pools %}
+        <tr><td><code>{{ p.path }}</code></td><td>{{ p.size }}</td><td>{{ p.open }}</td><td>{{ p.idle }}</td>
+            <td>{{ p.hits }}</td><td>{{ p.opens }}</td><td>{{ p.waits }}</td><td>{{ p.timeouts }}</td><td>{{ p.discarded }}</td></tr>
+        {% endfor %}
+      </tbody>
+    </table>
+  </div>
+  <br>
+  <div class="card">
+    <h5>User cache (this process)</h5>
+    <table class="table table-sm mb-0">
+      <thead><tr><th>Size</th><th>Max</th><th>TTL (s)</th><th>Hits</th><th>Misses</th><th>Hit ratio</th><th>Evictions</th><th>Invalidations</th></tr></thead>
+      <tbody>
+        {% set lookups = user_cache.hits + user_cache.misses %}
+        <tr><td>{{ user_cache.size }}</td><td>{{ user_cache.max }}</td><td>{{ user_cache.ttl|int }}</td>
+            <td>{{ user_cache.hits }}</td><td>{{ user_cache.misses }}</td>
+            <td>{{ '%.1f%%'|format(100 * user_cache.hits / lookups) if lookups else 'n/a' }}</td>
+            <td>{{ user_cache.evictions }}</td><td>{{ user_cache.invalidations }}</td></tr>
+      </tbody>
+    </table>
+  </div>
+  <br>
+  <div class="card">
+    <h5>Page cache (this process)</h5>
+    <table class="table table-sm mb-0">
+      <thead><tr><th>Pages</th><th>Memory</th><th>Hits</th><th>Misses</th><th>Hit ratio</th><th>Stores</th><th>Evictions</th><th>Invalidated</th></tr></thead>
+      <tbody>
+        <tr><td>{{ page_cache.entries }} / {{ page_cache.max_entries }}</td>
+            <td>{{ '%.1f'|format(page_cache.bytes / 1024) }} KiB / {{ (page_cache.max_bytes / 1048576)|int }} MiB</td>
+            <td>{{ page_cache.hits }}</td><td>{{ page_cache.misses }}</td>
+            <td>{{ '%.1f%%'|format(100 * page_cache.hit_ratio) if page_cache.hit_ratio is not none else 'n/a' }}</td>
+            <td>{{ page_cache.stores }}</td><td>{{ page_cache.evictions }}</td><td>{{ page_cache.invalidations }}</td></tr>
+      </tbody>
+    </table>
+  </div>
+  <br>
+  <div class="row gy-3">
+    <div class="col-12 col-md-6">
+      <div class="card">
+        <h5>Newest 25 days</h5>
+        <pre>{{ newest }}</pre>
+      </div>
+    </div>
+    <div class="col-12 col-md-6">
+      <div class="card">
+        <h5>Oldest 25 days</h5>
+        <pre>{{ oldest }}</pre>
+      </div>
+    </div>
+  </div>
+{% endblock %}
+"""
+
+# Everything the app's DictLoader serves; views render these by name
+TEMPLATES = {
+    "BASE_TMPL": BASE_TMPL,
+    "LOGIN_TMPL": LOGIN_TMPL,
+    "TODAY_TMPL": TODAY_TMPL,
+    "WEEK_TMPL": WEEK_TMPL,
+    "HISTORY_TMPL": HISTORY_TMPL,
+    "STATS_TMPL": STATS_TMPL,
+    "PASSWORD_TMPL": PASSWORD_TMPL,
+    "ACCOUNT_TMPL": ACCOUNT_TMPL,
+    "ACCOUNT_PICK_TMPL": ACCOUNT_PICK_TMPL,
+    "ADMIN_USERS_TMPL": ADMIN_USERS_TMPL,
+    "AUDIT_TMPL": AUDIT_TMPL,
+    "DIAG_TMPL": DIAG_TMPL,
+}